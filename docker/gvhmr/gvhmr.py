@@ -23,10 +23,13 @@ For commercial uses of this software, please send email to xwzhou@zju.edu.cn
 import argparse
 
 CRF = 23  # 17 is lossless, every +6 halves the mp4 size
+IS_SERVER = False
+STRIDE = 1  # infer every k-th frame, see `--stride`
+LENGTH = 0  # frames of the input video, strided results are filled up to it
 person_count = None
 
 
-def argParse():
+def argParse(argv=None):
     """Put all args to cfg"""
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--input", type=str, metavar="in.mp4")
@@ -47,6 +50,11 @@ def argParse():
     parser.add_argument(
         "--render", action="store_true", help="render the incam/global result video"
     )
+    parser.add_argument(
+        "--render-only",
+        action="store_true",
+        help="render the incam/global result video from saved results, without inference",
+    )
     parser.add_argument(
         "-p", "--persons", type=str, help="List of persons to process, e.g. '0,1,2'"
     )
@@ -55,17 +63,43 @@ def argParse():
         action="store_true",
         help="use euler angles on bones rotation. Default is quaternion.",
     )
+    parser.add_argument(
+        "--stride",
+        type=int,
+        default=1,
+        metavar="1",
+        help="infer on every k-th frame, slerp/lerp the frames between into .mocap.npz",
+    )
+    parser.add_argument(
+        "--target-fps",
+        type=float,
+        default=0,
+        metavar="0",
+        help="infer at about this fps instead of --stride, 0 for every frame",
+    )
     parser.add_argument(
         "--verbose", action="store_true", help="draw intermediate results"
     )
+    parser.add_argument(
+        "--server",
+        metavar="/tmp/gvhmr.sock",
+        help="resident worker, take jobs from unix socket",
+    )
+    parser.add_argument(
+        "--idle",
+        type=float,
+        default=300,
+        metavar="300",
+        help="resident worker exits after idle seconds",
+    )
     try:
         import argcomplete
 
         argcomplete.autocomplete(parser)
     except ImportError:
         pass
-    args, _ = parser.parse_known_args()
-    if not args.input:
+    args, _ = parser.parse_known_args(argv)
+    if not args.input and not args.server:
         parser.print_help()
         exit(1)
 
@@ -77,12 +111,12 @@ def argParse():
 
 
 if __name__ == "__main__":
-    cfg = argParse()
+    args = argParse()
 
 from os import symlink
 from pathlib import Path
 from typing import Sequence, Set
-from lib import Rodrigues, RotMat_to_quat, savez, continuous, euler, free_ram as _free_ram  # type: ignore
+from lib import Rodrigues, RotMat_to_quat, savez, serve, continuous, euler, video_lwh, stride_of, tail_total, unstride_frames, VideoCapture, free_ram as _free_ram  # type: ignore
 import cv2
 import torch
 import pytorch_lightning as pl
@@ -135,17 +169,58 @@ from hmr4d.utils.vis.renderer import (
 from hmr4d.utils.geo_transform import apply_T_on_points, compute_T_ayfz2ay
 
 
+_RESIDENT = {}
+
+
 def free_ram():
     _free_ram(torch)
 
 
-def parse_args_to_cfg(args=argParse()):
+def get_lwh(video_path):
+    """`get_video_lwh` without decoding the video when the host already probed it"""
+    return video_lwh(video_path, get_video_lwh)
+
+
+def resident(key, new):
+    """`new()` once per resident worker (`--server`), else every time"""
+    if not IS_SERVER:
+        return new()
+    if key not in _RESIDENT:
+        _RESIDENT[key] = new()
+    return _RESIDENT[key]
+
+
+def write_strided(video_path, to, stride: int):
+    """every `stride`-th frame of `video_path` to `to`, the temporal model runs on them as 1 shorter sequence"""
+    cap = VideoCapture(cv2, video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    writer = get_writer(to, fps=fps / stride, crf=CRF)
+    i = 0
+    while cap.isOpened():
+        ret, frame = cap.read() if i % stride == 0 else (cap.grab(), None)
+        if not ret:
+            break
+        if frame is not None:
+            writer.write_frame(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        i += 1
+    writer.close()
+    cap.release()
+    Log.info(f"[Stride {stride}] {-(-i // stride)}/{i} frames of {video_path} → {to}")
+
+
+def parse_args_to_cfg(args):
+    global STRIDE, LENGTH
     # Input
     video_path = Path(args.input)
     assert video_path.exists(), f"Video not found at {video_path}"
-    length, width, height = get_video_lwh(video_path)
+    length, width, height = get_lwh(video_path)
     Log.info(f"[Input]: {video_path}")
     Log.info(f"(L, W, H) = ({length}, {width}, {height})")
+    STRIDE, LENGTH = 1, length
+    if args.stride > 1 or args.target_fps > 0:
+        cap = cv2.VideoCapture(str(video_path))
+        STRIDE = stride_of(cap.get(cv2.CAP_PROP_FPS), args.stride, args.target_fps)
+        cap.release()
     # Cfg
     with initialize_config_module(version_base="1.3", config_module=f"hmr4d.configs"):
         overrides = [
@@ -154,12 +229,17 @@ def parse_args_to_cfg(args=argParse()):
             f"verbose={args.verbose}",
             f"use_dpvo={args.use_dpvo}",
             f"person=0",  # u need to override with `cfg.person = 1`
-            f"+render={args.render}",
+            f"+render={args.render or args.render_only}",
+            f"+render_only={args.render_only}",
         ]
         if args.f_mm is not None:
             overrides.append(f"f_mm={args.f_mm}")
         if args.persons is not None:
             overrides.append(f"persons={{{args.persons}}}")
+        if STRIDE > 1:  # intermediate results of the strided video apart, .mocap.npz stays in place
+            workdir = Path(args.outdir or "output", video_path.stem)
+            overrides.append(f"output_dir='{workdir / f'stride{STRIDE}'}'")
+            overrides.append(f"npz_path='{workdir / f'{video_path.stem}.mocap.npz'}'")
 
         # Allow to change output root
         if args.outdir is not None:
@@ -174,7 +254,10 @@ def parse_args_to_cfg(args=argParse()):
 
     # Copy raw-input-video to video_path
     if not Path(cfg.video_path).exists():
-        symlink(video_path, cfg.video_path, target_is_directory=False)
+        if STRIDE > 1:
+            write_strided(video_path, cfg.video_path, STRIDE)
+        else:
+            symlink(video_path, cfg.video_path, target_is_directory=False)
     # Log.info(f"[Copy Video] {video_path} -> {cfg.video_path}")
     # if not Path(cfg.video_path).exists() or get_video_lwh(video_path)[0] != get_video_lwh(cfg.video_path)[0]:
     #     reader = get_video_reader(video_path)
@@ -193,9 +276,13 @@ def save_bbox(cfg, id_frames, id_bbox_xyxy, ids):
         ranges = continuous(id_frames[i])
         if len(ranges) > 1:
             Log.warning(f"Person {p} has multiple ranges: {ranges}")
-        start = str(ranges[0][0])
-        key = ";".join(["smplx;gvhmr", f"person{p}", start, "bbox"])
-        savez(cfg.npz_path, {key: id_bbox_xyxy[i]}, mode="a")
+        begin = ranges[0][0]
+        prefix = ";".join(["smplx;gvhmr", f"person{p}", str(begin * STRIDE)])
+        rows = {"bbox": id_bbox_xyxy[i]}
+        if STRIDE > 1:  # held up to LENGTH like the poses of `export()`
+            total = tail_total(begin, len(rows["bbox"]), STRIDE, LENGTH)
+            rows = unstride_frames(rows, STRIDE, keys=("bbox",), total=total)
+        savez(cfg.npz_path, {f"{prefix};{k}": v for k, v in rows.items()}, mode="a")
 
 
 def load_yolo_track(cfg):
@@ -236,7 +323,7 @@ def get_one_track_patch(self, video_path, cfg):
 
     # TODO: remove interpolate to save size, seperate begins on same person
     # interpolate missing frames
-    mask = frame_id_to_mask(frames, get_video_lwh(video_path)[0])
+    mask = frame_id_to_mask(frames, get_lwh(video_path)[0])
     bbx_xyxy_one_track = rearrange_by_mask(
         bbox_xyxy, mask
     )  # (F, 4), missing filled with 0
@@ -255,10 +342,6 @@ def get_one_track_patch(self, video_path, cfg):
 Tracker.get_one_track = get_one_track_patch  # type: ignore
 
 
-if __name__ == "__main__":
-    cfg = parse_args_to_cfg()
-
-
 @torch.no_grad()
 def run_preprocess(cfg):
     Log.info(f"[Preprocess] Start!")
@@ -290,7 +373,7 @@ def run_preprocess(cfg):
 
     # Get VitPose
     if not Path(paths.vitpose).exists():
-        vitpose_extractor = VitPoseExtractor()
+        vitpose_extractor = resident(VitPoseExtractor, VitPoseExtractor)
         vitpose = vitpose_extractor.extract(video_path, bbx_xys)
         torch.save(vitpose, paths.vitpose)
         del vitpose_extractor
@@ -304,7 +387,7 @@ def run_preprocess(cfg):
 
     # Get vit features
     if not Path(paths.vit_features).exists():
-        extractor = Extractor()
+        extractor = resident(Extractor, Extractor)
         vit_features = extractor.extract_video_features(video_path, bbx_xys)
         torch.save(vit_features, paths.vit_features)
         del extractor
@@ -323,7 +406,7 @@ def run_preprocess(cfg):
             else:  # DPVO
                 from hmr4d.utils.preproc.slam import SLAMModel
 
-                length, width, height = get_video_lwh(cfg.video_path)
+                length, width, height = get_lwh(cfg.video_path)
                 K_fullimg = estimate_K(width, height)
                 intrinsics = convert_K_to_K4(K_fullimg)
                 slam = SLAMModel(
@@ -346,7 +429,7 @@ def run_preprocess(cfg):
 
 def load_data_dict(cfg):
     paths = cfg.paths
-    length, width, height = get_video_lwh(cfg.video_path)
+    length, width, height = get_lwh(cfg.video_path)
     if cfg.static_cam:
         R_w2c = torch.eye(3).repeat(length, 1, 1)
     else:
@@ -393,7 +476,7 @@ def render_incam(cfg):
 
     # -- rendering code -- #
     video_path = cfg.video_path
-    length, width, height = get_video_lwh(video_path)
+    length, width, height = get_lwh(video_path)
     K = pred["K_fullimg"][0]
 
     # renderer
@@ -405,7 +488,7 @@ def render_incam(cfg):
     verts_incam = pred_c_verts
     writer = get_writer(incam_video_path, fps=30, crf=CRF)
     for i, img_raw in tqdm(
-        enumerate(reader), total=get_video_lwh(video_path)[0], desc=f"Rendering Incam"
+        enumerate(reader), total=get_lwh(video_path)[0], desc=f"Rendering Incam"
     ):
         img = renderer.render_mesh(verts_incam[i].cuda(), img_raw, [0.8, 0.8, 0.8])
 
@@ -466,7 +549,7 @@ def render_global(cfg):
 
     # -- rendering code -- #
     video_path = cfg.video_path
-    length, width, height = get_video_lwh(video_path)
+    length, width, height = get_lwh(video_path)
     _, _, K = create_camera_sensor(width, height, 24)  # render as 24mm lens
 
     # renderer
@@ -489,15 +572,24 @@ def render_global(cfg):
     writer.close()
 
 
+FRAME_KEYS = ("global_orient", "body_pose", "transl")  # per-frame props of `export()`, `betas` is per person
+
+
 def export(
     pred: dict,
     file: Path | str = "gvhmr.mocap.npz",
     who=0,
+    stride=1,
+    total=0,
 ):
     """
     Convert `'pred'` torch tensors (.pt) to numpy (.npz) and save to `file`.
 
     keyname = 'smplx;gvhmr;customKey;person{ID};global'
+
+    Args:
+        stride: `pred` of every `stride`-th frame, fill the gaps, with a `source` of 1 inferred, 0 interpolated
+        total: frames of the video, the last row is held after the last inferred frame up to it
     """
     data = {}
     prefix = "smplx;gvhmr"
@@ -515,8 +607,6 @@ def export(
                 if k == "global_orient":
                     R["global"] = _R
                 pred[K][k] = RotMat_to_quat(_R)
-                if IS_EULER:
-                    pred[K][k] = euler(pred[K][k])
             data[key] = pred[K][k].cpu().numpy()
     else:
         # 基本不会执行这里
@@ -535,6 +625,21 @@ def export(
     data[f"{prefix};global_orient"] = cam_R
     data[f"{prefix};transl"] = cam_T
 
+    if stride > 1:  # slerp quaternions before they may turn into euler
+        groups: dict[str, dict] = {}
+        for key, v in data.items():
+            group, prop = key.rsplit(";", 1)
+            groups.setdefault(group, {})[prop] = v
+        data = {
+            f"{group};{prop}": v
+            for group, props in groups.items()
+            for prop, v in unstride_frames(props, stride, keys=FRAME_KEYS, total=total, quats=("global_orient", "body_pose")).items()
+        }
+    if IS_EULER:
+        for k in ("global_orient", "body_pose"):
+            key = f"smplx;gvhmr;{key_who};0;{k}"
+            if key in data:
+                data[key] = euler(data[key])
     savez(file, data)
 
 
@@ -586,9 +691,7 @@ def per_person(cfg):
 
         # ===== HMR4D ===== #
         Log.info("[HMR4D] Predicting")
-        model: DemoPL = hydra.utils.instantiate(cfg.model, _recursive_=False)
-        model.load_pretrained_model(cfg.ckpt_path)
-        model = model.eval().cuda()
+        model: DemoPL = resident(cfg.ckpt_path, lambda: load_model(cfg))
         tic = Log.sync_time()
         pred = model.predict(data, static_cam=cfg.static_cam)
         data_remap(pred)
@@ -608,17 +711,43 @@ def per_person(cfg):
 
     # ===== Render ===== #
     if cfg.render:
-        render_incam(cfg)
-        render_global(cfg)
-        if not Path(paths.incam_global_horiz_video).exists():
-            Log.info("[Merge Videos]")
-            merge_videos_horizontal(
-                [paths.incam_video, paths.global_video], paths.incam_global_horiz_video
-            )
+        render(cfg)
     free_ram()
     return pred
 
 
+def render(cfg):
+    """incam & global videos of `cfg.person`, pytorch3d renders on the 1 cuda device, so no process pool like wilor"""
+    paths = cfg.paths
+    render_incam(cfg)
+    render_global(cfg)
+    if not Path(paths.incam_global_horiz_video).exists():
+        Log.info("[Merge Videos]")
+        merge_videos_horizontal(
+            [paths.incam_video, paths.global_video], paths.incam_global_horiz_video
+        )
+
+
+def render_only(cfg, Persons: Sequence[int] | Set[int] | None = None):
+    """`render()` persons from their saved `hmr4d_results`, without inference.
+    `.mocap.npz` lacks `smpl_params_incam` & `K_fullimg` that the incam video needs"""
+    for p in Persons or set(cfg.persons) or range(1 << 16):
+        cfg.person = p
+        if not Path(cfg.paths.hmr4d_results).exists():
+            if Persons or cfg.persons:
+                Log.error(f"[Person {p}] No {cfg.paths.hmr4d_results} to render, run inference first")
+                continue
+            break
+        Log.info(f"[Person {p}] Render")
+        render(cfg)
+
+
+def load_model(cfg) -> DemoPL:
+    model: DemoPL = hydra.utils.instantiate(cfg.model, _recursive_=False)
+    model.load_pretrained_model(cfg.ckpt_path)
+    return model.eval().cuda()
+
+
 def data_remap(pred):
     del pred["smpl_params_incam"]["betas"]
     del pred["smpl_params_incam"]["body_pose"]
@@ -630,6 +759,8 @@ def data_remap(pred):
 def gvhmr(cfg, Persons: Sequence[int] | Set[int] | None = None):
     # Log.info(f"[GPU]: {torch.cuda.get_device_name()}")
     Log.info(f'[GPU]: {torch.cuda.get_device_properties("cuda")}')
+    if cfg.render_only:
+        return render_only(cfg, Persons)
 
     run_preprocess(cfg)
     # Log.info(f'cfg.persons = {cfg.persons}, type={type(cfg.persons)}')
@@ -647,8 +778,19 @@ def gvhmr(cfg, Persons: Sequence[int] | Set[int] | None = None):
         cfg.person = p
         Log.info(f"[Person {p}] from {Persons}")
         pred = per_person(cfg)
-        export(pred, cfg.npz_path, who=p)
+        export(pred, cfg.npz_path, who=p, stride=STRIDE, total=LENGTH)
+
+
+def job(argv):
+    global args, person_count
+    args = argParse(argv)
+    person_count = None
+    gvhmr(parse_args_to_cfg(args))
 
 
 if __name__ == "__main__":
-    gvhmr(cfg)
+    if args.server:
+        IS_SERVER = True
+        serve(job, args.server, args.idle)
+    else:
+        gvhmr(parse_args_to_cfg(args))
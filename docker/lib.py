@@ -1,9 +1,10 @@
-import os, gc, sys, toml, shlex, inspect, logging, argparse, subprocess
+import os, gc, sys, json, time, toml, queue, shlex, inspect, logging, argparse, threading, subprocess
 import numpy as np
 from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
 from platformdirs import user_config_path
 from types import ModuleType
-from typing import Any, Iterable, Literal, Sequence, TypeVar
+from typing import Any, Callable, Iterable, Literal, Sequence, TypeVar
 
 logging.basicConfig(level=os.environ.get("LOG", "INFO").upper())
 Log = logging.getLogger(__name__)
@@ -44,10 +45,208 @@ RUNS_REPO: dict[TYPE_RUNS, str] = {
 
 def savez(npz: "str|Path", new_data: dict[str, Any], mode: Literal["w", "a"] = "a"):
     if mode == "a" and os.path.exists(npz):
-        new_data = {**np.load(npz, allow_pickle=True), **new_data}
+        with np.load(npz, allow_pickle=True) as f:
+            new_data = {**{k: f[k] for k in f.files}, **new_data}
     np.savez_compressed(npz, **new_data)
 
 
+def probe(video: "str|Path") -> dict[str, Any] | None:
+    """metadata the host wrote into `<stem>.probe.json` next to `video`, None if missing or stale.
+
+    see `mocap_wrapper/lib/probe.py`"""
+    sidecar = os.path.splitext(video)[0] + ".probe.json"
+    try:
+        with open(sidecar, encoding="utf-8") as f:
+            info = json.load(f)
+        st = os.stat(video)
+    except (OSError, ValueError):
+        return None
+    if info.get("size") != st.st_size or info.get("mtime") != st.st_mtime:
+        Log.debug(f"Stale {sidecar}")
+        return None
+    return info
+
+
+def video_lwh(video: "str|Path", fallback: Callable[[Any], Sequence[int]]) -> tuple[int, int, int]:
+    """(length, width, height) from `probe()`, else `fallback(video)` which decodes the video"""
+    info = probe(video)
+    if info and info.get("is_frames_exact") and info.get("width"):
+        return info["frames"], info["width"], info["height"]
+    length, width, height = fallback(video)
+    return int(length), int(width), int(height)
+
+
+class Prefetch:
+    """iterate `source` in a background thread into a bounded queue, so the consumer never waits on decoding
+
+    ```python
+    for image in Prefetch(read_frames(cap), fn=lambda frame: cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)):
+        ...  # inference
+    ```"""
+
+    _END = object()
+
+    def __init__(self, source: Iterable, fn: Callable[[Any], Any] | None = None, size=32, workers=1):
+        """
+        Args:
+            fn: applied to each item in the background, e.g. color conversion.
+            size: items decoded ahead at most
+            workers: threads that run `fn`, order is kept
+        """
+        self.source = source
+        self.fn = fn
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=max(1, size))
+        self.waited = 0.0  # seconds the consumer waited for items
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                return self.queue.put(item, timeout=0.1)
+            except queue.Full:
+                pass
+
+    def _run(self):
+        pool = ThreadPoolExecutor(self.workers) if self.fn and self.workers > 1 else None
+        try:
+            for x in self.source:
+                if self._stop.is_set():
+                    break
+                if pool:
+                    self._put(pool.submit(self.fn, x))  # type: ignore
+                else:
+                    self._put(self.fn(x) if self.fn else x)
+            self._put(self._END)
+        except BaseException as e:
+            self._put(e)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=self._stop.is_set()) if pool else None
+            close = getattr(self.source, "close", None)
+            close() if self._stop.is_set() and close else None  # e.g. stop a generator
+
+    def __iter__(self):
+        self._thread.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                item = self.queue.get()
+                if isinstance(item, Future):
+                    item = item.result()
+                self.waited += time.perf_counter() - start
+                if item is self._END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        self._stop.set()
+        while self._thread.is_alive():
+            try:
+                self.queue.get_nowait()  # unblock the producer
+            except queue.Empty:
+                self._thread.join(timeout=0.1)
+
+
+def vinput(video: "str|Path") -> dict[str, Any] | None:
+    """`<stem>.vinput.json` the host wrote instead of `video`, None if `video` exists or the source changed.
+
+    see `mocap_wrapper/lib/vinput.py`"""
+    if os.path.exists(video):
+        return None
+    sidecar = os.path.splitext(video)[0] + ".vinput.json"
+    try:
+        with open(sidecar, encoding="utf-8") as f:
+            info = json.load(f)
+        st = os.stat(info["source"])
+    except (OSError, ValueError, KeyError) as e:
+        Log.debug(f"No virtual input {sidecar}: {e}")
+        return None
+    if info.get("size") != st.st_size or info.get("mtime") != st.st_mtime:
+        Log.warning(f"Source of {sidecar} changed")
+        return None
+    return info
+
+
+class VideoCapture:
+    """`cv2.VideoCapture` of `video`, or of the source of its `.vinput.json` with seek-and-skip decoding
+
+    ```python
+    cap = VideoCapture(cv2, 'output/in/in.mp4')
+    while cap.isOpened():
+        ret, frame = cap.read()
+    ```"""
+
+    SEEK = 30  # frames to skip by seeking instead of grabbing
+
+    def __new__(cls, cv2, video: "str|Path"):
+        info = vinput(video)
+        if info is None:
+            return cv2.VideoCapture(str(video))
+        return super().__new__(cls)
+
+    def __init__(self, cv2, video: "str|Path"):
+        self.cv2 = cv2
+        self.info = vinput(video) or {}
+        self.frames: list[int] = self.info["frames"]
+        self.cap = cv2.VideoCapture(self.info["source"])
+        self.i = 0  # output frame
+        self.pos = 0  # next source frame of `cap`
+        self.last: tuple[int, Any] = (-1, None)
+        Log.info(f"🪞 {video} ← {len(self.frames)} frames of {self.info['source']}")
+
+    def isOpened(self):
+        return self.cap.isOpened() and self.i < len(self.frames)
+
+    def read(self):
+        if self.i >= len(self.frames):
+            return False, None
+        want = self.frames[self.i]
+        self.i += 1
+        if want == self.last[0]:
+            return True, self.last[1].copy()  # duplicated frame when fps goes up
+        if want < self.pos or want - self.pos > self.SEEK:
+            self.cap.set(self.cv2.CAP_PROP_POS_FRAMES, want)
+            self.pos = want
+        while self.pos < want:
+            self.cap.grab()
+            self.pos += 1
+        ret, frame = self.cap.read()
+        self.pos += 1
+        self.last = (want, frame) if ret else (-1, None)
+        return ret, frame
+
+    def grab(self):
+        """skip an output frame, the next `read()` seeks or grabs the source frames up to its own"""
+        if self.i >= len(self.frames):
+            return False
+        self.i += 1
+        return True
+
+    def set(self, prop: int, value: float):
+        if prop == self.cv2.CAP_PROP_POS_FRAMES:
+            self.i = int(value)
+            return True
+        return self.cap.set(prop, value)
+
+    def get(self, prop: int):
+        cv2 = self.cv2
+        if prop == cv2.CAP_PROP_FPS:
+            return self.info["fps"]
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.frames)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.i
+        return self.cap.get(prop)
+
+    def release(self):
+        self.cap.release()
+
+
 def free_ram(torch):
     """def free_ram(): _free_ram(torch)"""
     vram_before = vram_gb(torch)
@@ -97,6 +296,65 @@ def run(
     return process  # type: ignore
 
 
+def serve(job: Callable[[list[str]], Any], sock: str, idle: float = 300):
+    """resident worker: models stay loaded between jobs, exit after `idle` seconds without jobs.
+
+    protocol over unix socket, 1 json per line:
+    - in: `{"argv": ["--input", "a.mp4", "-o", "output"], "cwd": "/home/user"}`, relative paths of argv are in cwd
+    - out: `{"status": 0}` or `{"status": 1, "error": "..."}`
+    """
+    import json, socket
+
+    os.remove(sock) if os.path.exists(sock) else None
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(sock)
+    server.listen()
+    server.settimeout(idle if idle > 0 else None)
+    Log.info(f"🔌 Listen on {sock}, {idle=}s")
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                Log.info(f"💤 No job in {idle=}s, exit")
+                break
+            conn.settimeout(None)
+            with conn, conn.makefile("rw", encoding="utf-8") as f:
+                for line in f:
+                    req = json.loads(line)
+                    argv, cwd = req["argv"], req.get("cwd", os.getcwd())
+                    Log.info(f"📥 {argv} in {cwd}")
+                    home = os.getcwd()
+                    try:
+                        os.chdir(cwd)
+                        job(argv)
+                        ret = {"status": 0}
+                    except SystemExit as e:
+                        ret = {"status": e.code if isinstance(e.code, int) else 1}
+                    except Exception as e:
+                        Log.exception(f"{argv=}", exc_info=e)
+                        ret = {"status": 1, "error": repr(e)}
+                    finally:
+                        os.chdir(home)
+                    f.write(json.dumps(ret) + "\n")
+                    f.flush()
+    finally:
+        server.close()
+        os.remove(sock) if os.path.exists(sock) else None
+
+
+def batched(iterable: Iterable[T], n: int):
+    """`itertools.batched` of python 3.12, as lists"""
+    batch: list[T] = []
+    for x in iterable:
+        batch.append(x)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 def continuous(List: Sequence[int]) -> list[tuple[int, int]]:
     """
     Detect continuous parts in a sorted list.
@@ -184,6 +442,296 @@ def squeeze(v: np.ndarray, axis=0, key=""):
     return v
 
 
+class Track:
+    """per-frame arrays of 1 tracked object, stored by column & grown ×2 when full, so `append()` is amortized O(1)
+
+    ```python
+    track = Track(begin=frame, is_right=1)
+    for frame in frames:
+        track.append({'bbox': bbox, 'hand_pose': hand_pose})  # a row of 1 frame
+    track['bbox'][-1]  # view of appended rows
+    export(track.trim())  # copies, once
+    ```"""
+
+    __slots__ = ("begin", "is_right", "scaled_focal_length", "len", "_cols")
+
+    def __init__(self, begin=0, is_right=0, scaled_focal_length=0.0):
+        self.begin = begin
+        self.is_right = is_right
+        self.scaled_focal_length = scaled_focal_length
+        self.len = 0
+        self._cols: dict[str, np.ndarray] = {}
+
+    def __len__(self):
+        return self.len
+
+    def __contains__(self, key: str):
+        return key in self._cols
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self._cols[key][: self.len]
+
+    def keys(self):
+        return self._cols.keys()
+
+    def capacity(self):
+        return len(next(iter(self._cols.values()))) if self._cols else 0
+
+    def append(self, row: dict[str, Any]):
+        """
+        Args:
+            row: `{key: array of 1 frame}`, keys of the 1st row fix the columns
+        """
+        if not self._cols:
+            self._cols = {K: np.empty((16, *np.shape(v)), dtype=np.asarray(v).dtype) for K, v in row.items()}
+        elif self.len == self.capacity():
+            for K, col in self._cols.items():
+                grown = np.empty((2 * len(col), *col.shape[1:]), dtype=col.dtype)
+                grown[: self.len] = col[: self.len]
+                self._cols[K] = grown
+        for K, col in self._cols.items():
+            if K in row:
+                col[self.len] = row[K]
+            else:
+                Log.warning(f"{K} not in row {self.len}, repeat the last one")
+                col[self.len] = col[self.len - 1] if self.len else 0
+        self.len += 1
+
+    def trim(self) -> dict[str, np.ndarray]:
+        """compact copy of every column"""
+        return {K: col[: self.len].copy() for K, col in self._cols.items()}
+
+
+class MeshWriter:
+    """stream meshes of every frame into 1 `.mesh.npy` of shape (frames, hands, vertices, 3), NaN if a slot has no hand.
+    Faces & `is_right` of each slot go to `.mesh.meta.npz` once at `close()`
+
+    ```python
+    with MeshWriter('a.mesh.npy', vertices=778, faces=faces) as writer:
+        for frame in frames:
+            writer.write([verts_of_hand0, verts_of_hand1], is_right=[0, 1], slots=[0, 1])
+    verts = np.load('a.mesh.npy', mmap_mode='r')  # no parsing, read on demand
+    ```"""
+
+    HEADER = 128  # bytes of the npy header, rewritten with the final shape at `close()`
+
+    def __init__(self, file: "str|Path", vertices: int, hands=2, faces: dict[str, np.ndarray] = {}, dtype=np.float32):
+        """
+        Args:
+            hands: slots per frame, grown when a frame has more hands
+            faces: saved into `.mesh.meta.npz`, e.g. `{'faces': faces, 'faces_left': faces_left}`
+        """
+        self.file = str(file)
+        self.vertices = vertices
+        self.hands = hands
+        self.faces = faces
+        self.dtype = np.dtype(dtype)
+        self.frames = 0
+        self.is_right: list[np.ndarray] = []  # int8 of each slot, -1 if empty
+        self._f = open(self.file, "wb+")
+        self._header()
+
+    def _header(self, f=None, hands=0):
+        f = f or self._f
+        shape = (self.frames, hands or self.hands, self.vertices, 3)
+        header = f"{{'descr': '{self.dtype.str}', 'fortran_order': False, 'shape': {shape}, }}"
+        magic = np.lib.format.magic(1, 0)
+        header = header.ljust(self.HEADER - len(magic) - 2 - 1) + "\n"
+        f.seek(0)
+        f.write(magic + len(header).to_bytes(2, "little") + header.encode("latin1"))
+        f.seek(0, os.SEEK_END)
+
+    def _grow(self, hands: int):
+        """re-layout frames written so far into more slots, by chunks so memory stays flat"""
+        hands = max(hands, 2 * self.hands)
+        Log.info(f"{self.file}: {self.hands} → {hands} hands per frame")
+        self._f.flush()
+        tmp = self.file + ".tmp"
+        with open(tmp, "wb") as f:
+            self._header(f, hands)
+            old = np.memmap(self.file, dtype=self.dtype, mode="r", offset=self.HEADER, shape=(self.frames, self.hands, self.vertices, 3))
+            for i in range(0, self.frames, 1024):
+                chunk = np.full((min(1024, self.frames - i), hands, self.vertices, 3), np.nan, dtype=self.dtype)
+                chunk[:, : self.hands] = old[i : i + 1024]
+                f.write(chunk.tobytes())
+            del old
+        self._f.close()
+        os.replace(tmp, self.file)
+        self._f = open(self.file, "rb+")
+        self._f.seek(0, os.SEEK_END)
+        self.hands = hands
+
+    def write(self, verts: Sequence[np.ndarray], is_right: Sequence = (), slots: Sequence[int] = ()):
+        """vertices of each hand of the next frame
+
+        Args:
+            slots: slot of each hand, e.g. its track index so a slot keeps the same hand across frames; in order if empty
+        """
+        slots = list(slots) or list(range(len(verts)))
+        if slots and max(slots) >= self.hands:
+            self._grow(max(slots) + 1)
+        frame = np.full((self.hands, self.vertices, 3), np.nan, dtype=self.dtype)
+        flags = np.full(self.hands, -1, dtype=np.int8)
+        for i, v in zip(slots, verts):
+            frame[i] = v
+        for i, right in zip(slots, is_right):
+            flags[i] = right
+        self._f.write(frame.tobytes())
+        self.is_right.append(flags)
+        self.frames += 1
+
+    def close(self):
+        if self._f.closed:
+            return
+        self._header()
+        self._f.close()
+        is_right = np.full((self.frames, self.hands), -1, dtype=np.int8)
+        for i, flags in enumerate(self.is_right):
+            is_right[i, : len(flags)] = flags
+        np.savez(self.file.removesuffix(".npy") + ".meta.npz", is_right=is_right, **self.faces)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def box_cost(a: "np.ndarray|Sequence", b: "np.ndarray|Sequence"):
+    """
+    Args:
+        a, b: boxes of `[x1, y1, x2, y2]`, shape (N,4) & (M,4)
+
+    Returns:
+        cost: (N,M), center distance in sizes of `b` + (1 - IoU)
+        dist: (N,M), center distance in pixels
+    """
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    dist = np.linalg.norm((a[:, None, :2] + a[:, None, 2:]) / 2 - (b[None, :, :2] + b[None, :, 2:]) / 2, axis=-1)
+    area_b = np.prod((b[:, 2:] - b[:, :2]).clip(0), axis=-1)
+    return dist / np.sqrt(area_b).clip(1)[None] + 1 - box_iou(a, b), dist
+
+
+def box_iou(a: "np.ndarray|Sequence", b: "np.ndarray|Sequence") -> np.ndarray:
+    """(N,M) IoU of boxes `[x1, y1, x2, y2]` of shape (N,4) & (M,4)"""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    area_a = np.prod((a[:, 2:] - a[:, :2]).clip(0), axis=-1)
+    area_b = np.prod((b[:, 2:] - b[:, :2]).clip(0), axis=-1)
+    inter = np.prod((np.minimum(a[:, None, 2:], b[None, :, 2:]) - np.maximum(a[:, None, :2], b[None, :, :2])).clip(0), axis=-1)
+    return inter / (area_a[:, None] + area_b[None] - inter).clip(1e-9)
+
+
+def keypoints_box(keypoints: np.ndarray, margin=0.1) -> np.ndarray:
+    """(...,4) box around 2d `keypoints` of shape (...,K,2), grown by `margin` of its size on each side"""
+    lo, hi = keypoints.min(axis=-2), keypoints.max(axis=-2)
+    pad = (hi - lo) * margin
+    return np.concatenate([lo - pad, hi + pad], axis=-1)
+
+
+class BoxTracker:
+    """skip the detector between keyframes: boxes of the next frame are propagated from the keypoints of this frame
+
+    ```python
+    tracker = BoxTracker(every=5)
+    for image in images:
+        boxes = tracker.next()  # None on keyframes
+        bboxes, is_rights = detect(image) if boxes is None else boxes
+        keypoints = estimate(image, bboxes)
+        if not tracker.update(bboxes, is_rights, keypoints, detected=boxes is None):
+            ...  # lost, detect this frame again
+    ```"""
+
+    def __init__(self, every=5, min_iou=0.5, margin=0.1):
+        """
+        Args:
+            every: detect at least every `every` frames
+            min_iou: of a propagated box & the keypoints box estimated in it, else the hand is lost
+            margin: see `keypoints_box()`
+        """
+        self.every = every
+        self.min_iou = min_iou
+        self.margin = margin
+        self.boxes: tuple[np.ndarray, list] | None = None
+        self.since = 0  # frames since the last detection
+        self.detected = self.propagated = self.lost = 0
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(every={self.every}, detected={self.detected}, propagated={self.propagated}, lost={self.lost})"
+
+    def next(self):
+        """`(bboxes, is_rights)` propagated to the next frame, None if it should be detected"""
+        if self.boxes is None or self.since >= self.every or not len(self.boxes[0]):
+            return None
+        return self.boxes
+
+    def update(self, bboxes: np.ndarray, is_rights: list, keypoints: np.ndarray, detected: bool) -> bool:
+        """
+        Args:
+            bboxes: (H,4) the estimation ran on
+            keypoints: (H,K,2) estimated
+
+        Returns:
+            False if a propagated hand is lost, then detect again
+        """
+        fitted = keypoints_box(np.asarray(keypoints).reshape(len(bboxes), -1, 2), self.margin) if len(bboxes) else np.zeros((0, 4))
+        if not detected:
+            iou = np.diag(box_iou(bboxes, fitted))
+            if (iou < self.min_iou).any():
+                self.boxes = None
+                self.lost += 1
+                return False
+            self.propagated += 1
+            self.since += 1
+        else:
+            self.detected += 1
+            self.since = 1
+        self.boxes = (fitted, list(is_rights))
+        return True
+
+
+def assign(cost: np.ndarray, allowed: np.ndarray | None = None) -> list[int | None]:
+    """optimal 1-to-1 assignment of rows to columns by `scipy.optimize.linear_sum_assignment`, greedy by lowest cost without scipy
+
+    Args:
+        cost: (N,M)
+        allowed: (N,M) bool, e.g. same side of hands
+
+    Returns:
+        column of each row, None if unassigned
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    n, m = cost.shape
+    ret: list[int | None] = [None] * n
+    ok = np.isfinite(cost) if allowed is None else np.isfinite(cost) & allowed
+    if not ok.any():
+        return ret
+    c = np.where(ok, cost, cost[ok].sum() + 1)  # any forbidden pair costs more than all allowed ones
+    if n == 1:
+        pairs = [(0, int(c[0].argmin()))]
+    elif m == 1:
+        pairs = [(int(c[:, 0].argmin()), 0)]
+    elif n == m == 2:
+        pairs = [(0, 0), (1, 1)] if c[0, 0] + c[1, 1] <= c[0, 1] + c[1, 0] else [(0, 1), (1, 0)]
+    else:
+        try:
+            from scipy.optimize import linear_sum_assignment
+
+            pairs = zip(*linear_sum_assignment(c))
+        except ImportError:
+            pairs, rows, cols = [], set(), set()
+            for r, col in zip(*np.unravel_index(np.argsort(c, axis=None, kind="stable"), c.shape)):
+                if r not in rows and col not in cols:
+                    pairs.append((r, col))
+                    rows.add(r)
+                    cols.add(col)
+    for r, col in pairs:
+        if ok[r, col]:
+            ret[int(r)] = int(col)
+    return ret
+
+
 def _get_mod(mod1: ModuleType | str):
     if isinstance(mod1, str):
         _mod1 = sys.modules.get(mod1, None)
@@ -499,6 +1047,110 @@ def quat_rotAxis(arr: TN) -> TN:
     return RotMat_to_quat(Rodrigues(arr))
 
 
+def quat_to_RotMat(wxyz: np.ndarray) -> np.ndarray:
+    """[w, x, y, z] of shape (...,4) to rotation matrices of shape (...,3,3), inverse of `RotMat_to_quat()`"""
+    wxyz = wxyz / np.linalg.norm(wxyz, axis=-1, keepdims=True)
+    w, x, y, z = wxyz[..., 0], wxyz[..., 1], wxyz[..., 2], wxyz[..., 3]
+    return np.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+        2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+        2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y),
+    ], axis=-1).reshape(*wxyz.shape[:-1], 3, 3)
+
+
+def quat_to_rotAxis(wxyz: np.ndarray) -> np.ndarray:
+    """[w, x, y, z] of shape (...,4) to axis angles of shape (...,3), inverse of `quat_rotAxis()`"""
+    wxyz = wxyz / np.linalg.norm(wxyz, axis=-1, keepdims=True)
+    wxyz = np.where(wxyz[..., :1] < 0, -wxyz, wxyz)  # angle in [0, π]
+    sin = np.linalg.norm(wxyz[..., 1:], axis=-1, keepdims=True)
+    angle = 2 * np.arctan2(sin, wxyz[..., :1])
+    scale = np.where(sin < 1e-8, 2.0, angle / np.where(sin < 1e-8, 1.0, sin))
+    return wxyz[..., 1:] * scale
+
+
+def slerp(q0: np.ndarray, q1: np.ndarray, t: "np.ndarray|float") -> np.ndarray:
+    """spherical linear interpolation of [w, x, y, z] of shape (...,4) along the shorter arc, `t` broadcasts with (...)"""
+    dot = np.sum(q0 * q1, axis=-1, keepdims=True)
+    q1 = np.where(dot < 0, -q1, q1)  # q & -q are the same rotation
+    theta = np.arccos(np.clip(np.abs(dot), 0, 1))
+    sin = np.sin(theta)
+    t = np.asarray(t)[..., None]
+    near = sin < 1e-6  # lerp when nearly parallel
+    _sin = np.where(near, 1, sin)
+    w0 = np.where(near, 1 - t, np.sin((1 - t) * theta) / _sin)
+    w1 = np.where(near, t, np.sin(t * theta) / _sin)
+    q = w0 * q0 + w1 * q1
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def stride_of(fps: float, stride=1, target_fps=0.0) -> int:
+    """infer every k-th frame, `--target-fps` wins over `--stride`"""
+    if target_fps > 0 and fps > 0:
+        return max(1, round(fps / target_fps))
+    return max(1, stride)
+
+
+def unstride(v: np.ndarray, stride: int, is_quat=False) -> np.ndarray:
+    """rows of every `stride`-th frame → rows of every frame from the 1st to the last row,
+    `slerp()` if `is_quat`, else lerp, nearest row for non-float dtypes"""
+    v = np.asarray(v)
+    if stride <= 1 or len(v) < 2:
+        return v
+    j = np.arange((len(v) - 1) * stride + 1)
+    i = np.minimum(j // stride, len(v) - 2)
+    t = (j - i * stride) / stride
+    a, b = v[i], v[i + 1]
+    if is_quat:
+        return slerp(a, b, t.reshape(-1, *[1] * (v.ndim - 2))).astype(v.dtype)
+    t = t.reshape(-1, *[1] * (v.ndim - 1))
+    if not np.issubdtype(v.dtype, np.floating):
+        return np.where(t < 0.5, a, b)
+    return (a + (b - a) * t).astype(v.dtype)
+
+
+def unstride_frames(
+    data: dict[str, np.ndarray], stride: int, keys: Sequence[str], total=0, quats=("global_orient", "hand_pose")
+):
+    """fill per-frame arrays inferred on every `stride`-th frame to every frame, adds a `source` of 1 inferred, 0 interpolated
+
+    Args:
+        keys: of per-frame arrays in `data`, others are kept as is, e.g. `betas` of shape (10,)
+        total: rows of the result, the last row is held after the last inferred frame, e.g. frames of the video.
+            0 ends at the last inferred frame
+        quats: keys of rotations, [w, x, y, z] are slerped, axis angles of `--raw` too
+
+    Returns:
+        data: of `total` or `(frames - 1) * stride + 1` rows
+    """
+    lens = {len(data[K]) for K in keys if K in data}
+    if len(lens) > 1:
+        raise ValueError(f"per-frame arrays of different lengths: { {K: len(data[K]) for K in keys if K in data} }")
+    frames = lens.pop() if lens else 0
+    rows = total or ((frames - 1) * stride + 1 if frames else 0)
+    filled = {}
+    for K, v in data.items():
+        if K not in keys:
+            filled[K] = v
+            continue
+        if K in quats and np.shape(v)[-1] == 3:
+            v = quat_to_rotAxis(unstride(quat_rotAxis(v), stride, is_quat=True)).astype(v.dtype)
+        else:
+            v = unstride(v, stride, is_quat=K in quats and np.shape(v)[-1] == 4)
+        filled[K] = np.concatenate([v, np.repeat(v[-1:], max(0, rows - len(v)), axis=0)])[:rows] if len(v) else v
+    source = np.zeros(rows, dtype=np.uint8)
+    source[: (frames - 1) * stride + 1 if frames else 0 : stride] = 1
+    filled["source"] = source
+    return filled
+
+
+def tail_total(begin: int, rows: int, stride: int, total: int) -> int:
+    """`total` of `unstride_frames()` for a track of `rows` inferred frames from the `begin`-th inferred frame:
+    up to `total` frames of the video if the track reaches the last inferred frame, else 0"""
+    if total and begin + rows == -(-total // stride):
+        return total - begin * stride
+    return 0
+
+
 def Axis(is_torch=False):
     return "dim" if is_torch else "axis"
 
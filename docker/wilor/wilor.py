@@ -8,13 +8,24 @@
 https://github.com/warmshao/WiLoR-mini/blob/main/tests/test_pipelines.py
 """
 IS_RENDER = IS_RAW = IS_EXPORT_OBJ = False
+BATCH = 8
+DETECT_EVERY = 1
+STRIDE = 1
+TARGET_FPS = 0.0
+PREFETCH = 32
+DECODE_THREADS = 1
+RENDER_WORKERS = 0  # 0: half of cpus
 OUTDIR = 'output'
 LIGHT_PURPLE = (0.25098039, 0.274117647, 0.65882353)
+MANO_VERTICES = 778
+FLIP_YZ = (1, -1, -1)  # rotated 180° around x, see `Renderer.vertices_to_trimesh()`
 import os
+import time
 import argparse
 import numpy as np
-from typing import Literal, Sequence, get_args
-from lib import quat_rotAxis, savez, squeeze, VIDEO_EXT, tqdm  # type: ignore
+from typing import Iterable, Literal, Sequence, get_args
+from lib import quat_rotAxis, quat_to_RotMat, Rodrigues, savez, stride_of, tail_total, unstride_frames, squeeze, serve, batched, BoxTracker, MeshWriter, Prefetch, Track, assign, box_cost, VideoCapture, VIDEO_EXT, tqdm  # type: ignore
+from functools import cache
 from sys import platform
 is_win = platform == "win32"
 is_linux = platform == "linux"
@@ -171,6 +182,8 @@ class Renderer:
         faces = np.concatenate([faces, faces_new], axis=0)
         self.faces = faces
         self.faces_left = self.faces[:, [0, 2, 1]]
+        self._renderer = self._scene = self._camera = self._key = None
+        self._meshes = []
 
     def vertices_to_trimesh(self, vertices, camera_translation, mesh_base_color=(1.0, 1.0, 0.9),
                             rot_axis=[1, 0, 0], rot_angle=0, is_right=1):
@@ -195,69 +208,76 @@ class Renderer:
         mesh.apply_transform(rot)
         return mesh
 
-    def render_rgba(
-            self,
-            vertices: np.ndarray,
-            cam_t=None,
-            rot=None,
-            rot_axis=[1, 0, 0],
-            rot_angle=0,
-            camera_z=3,
-            # camera_translation: np.array,
-            mesh_base_color=(1.0, 1.0, 0.9),
-            scene_bg_color=(0, 0, 0),
-            render_res=[256, 256],
-            focal_length=None,
-            is_right=None,
-    ):
-
-        renderer = pyrender.OffscreenRenderer(
+    def _scene_of(self, render_res: Sequence[int], scene_bg_color):
+        """renderer, camera & lights built once per resolution, only meshes change per frame"""
+        key = (tuple(render_res), tuple(scene_bg_color))
+        if self._key == key:
+            return self._scene
+        self.delete()
+        self._renderer = pyrender.OffscreenRenderer(
             viewport_width=render_res[0],
             viewport_height=render_res[1],
             point_size=1.0)
-        # material = pyrender.MetallicRoughnessMaterial(
-        #     metallicFactor=0.0,
-        #     alphaMode='OPAQUE',
-        #     baseColorFactor=(*mesh_base_color, 1.0))
-
-        if cam_t is not None:
-            camera_translation = cam_t.copy()
-            camera_translation[0] *= -1.
-        else:
-            camera_translation = np.array([0, 0, camera_z * focal_length / render_res[1]])
-        if is_right:
-            mesh_base_color = mesh_base_color[::-1]
-        mesh = self.vertices_to_trimesh(
-            vertices, np.array([0, 0, 0]), mesh_base_color,
-            rot_axis, rot_angle, is_right=is_right)
-        mesh = pyrender.Mesh.from_trimesh(mesh)
-        # mesh = pyrender.Mesh.from_trimesh(mesh, material=material)
-
         scene = pyrender.Scene(bg_color=[*scene_bg_color, 0.0], ambient_light=(0.3, 0.3, 0.3))
-        scene.add(mesh, 'mesh')
-
-        camera_pose = np.eye(4)
-        camera_pose[:3, 3] = camera_translation
-        camera_center = [render_res[0] / 2., render_res[1] / 2.]
         camera = pyrender.IntrinsicsCamera(
-            fx=focal_length, fy=focal_length,
-            cx=camera_center[0], cy=camera_center[1], zfar=1e12)
-
-        # Create camera node and add it to pyRender scene
-        camera_node = pyrender.Node(camera=camera, matrix=camera_pose)
-        scene.add_node(camera_node)
-        self.add_point_lighting(scene, camera_node)
-        self.add_lighting(scene, camera_node)
-
-        light_nodes = create_raymond_lights()
-        for node in light_nodes:
+            fx=1, fy=1, cx=render_res[0] / 2., cy=render_res[1] / 2., zfar=1e12)
+        self._camera = pyrender.Node(camera=camera, matrix=np.eye(4))
+        scene.add_node(self._camera)
+        self.add_point_lighting(scene, self._camera)
+        self.add_lighting(scene, self._camera)
+        for node in create_raymond_lights():
             scene.add_node(node)
+        self._scene, self._key, self._meshes = scene, key, []
+        return scene
 
-        color, rend_depth = renderer.render(scene, flags=pyrender.RenderFlags.RGBA)
-        color = color.astype(np.float32) / 255.0
-        renderer.delete()
+    def render_rgba_multiple(
+            self,
+            vertices: Sequence[np.ndarray],
+            cam_t: Sequence[np.ndarray],
+            is_right: Sequence,
+            mesh_base_color=(1.0, 1.0, 0.9),
+            scene_bg_color=(0, 0, 0),
+            render_res=[256, 256],
+            focal_length=None,
+    ):
+        """all hands of a frame in 1 pass, meshes are moved by `cam_t` in front of a camera at origin"""
+        scene = self._scene_of(render_res, scene_bg_color)
+        for node in self._meshes:
+            scene.remove_node(node)
+        self._meshes = []
+        for i, (verts, t, right) in enumerate(zip(vertices, cam_t, is_right)):
+            color = mesh_base_color[::-1] if right else mesh_base_color
+            mesh = self.vertices_to_trimesh(verts, t.copy(), color, is_right=right)
+            self._meshes.append(scene.add(pyrender.Mesh.from_trimesh(mesh), f'mesh-{i:02d}'))
+        self._camera.camera.fx = self._camera.camera.fy = focal_length
+        color, rend_depth = self._renderer.render(scene, flags=pyrender.RenderFlags.RGBA)
+        return color.astype(np.float32) / 255.0
+
+    def overlay(self, image: np.ndarray, pred: list[dict], **kwargs) -> np.ndarray:
+        """
+        Args:
+            image: RGB
+            pred: hands of `pipe.predict(image)`
+
+        Returns:
+            BGR uint8 of hands blended once over `image`
+        """
+        render_image = image.astype(np.float32)[:, :, ::-1] / 255.0
+        if pred:
+            cam_view = self.render_rgba_multiple(
+                [out['wilor_preds']['pred_vertices'][0] for out in pred],
+                [out['wilor_preds']['pred_cam_t_full'][0] for out in pred],
+                [out['is_right'] for out in pred],
+                render_res=[image.shape[1], image.shape[0]],
+                focal_length=pred[0]['wilor_preds']['scaled_focal_length'],
+                **kwargs)
+            render_image = render_image * (1 - cam_view[:, :, 3:]) + cam_view[:, :, :3] * cam_view[:, :, 3:]
+        return (255 * render_image).astype(np.uint8)
 
-        return color
+    def delete(self):
+        if self._renderer is not None:
+            self._renderer.delete()
+        self._renderer = self._scene = self._camera = self._key = None
 
     def add_lighting(self, scene, cam_node, color=np.ones(3), intensity=1.0):
         # from phalp.visualize.py_renderer import get_light_poses
@@ -298,21 +318,30 @@ class Renderer:
 
 
 def export(
-    preds: list[dict[str, np.ndarray | float | int]],
+    preds: list[Track],
     file='mocap_wilor.npz',
+    stride=1,
+    total=0,
 ):
     """
     save `.npz` to file.
 
     keyname = 'smplx;wilor;hand{ID};prop[0];prop[1];...;props[n]'
+
+    Args:
+        stride: tracks were inferred on every `stride`-th frame, fill the gaps, with a `source` of 1 inferred, 0 interpolated
+        total: frames of the video, tracks until the last inferred frame hold their last row up to it
     """
     data = {}
     prefix = 'smplx;wilor'
 
     for i, hand in enumerate(preds):
-        LR = 'R' if hand.pop('is_right') > 0.5 else 'L'
-        begin = hand.pop('begin')
-        for k, v in hand.items():
+        LR = 'R' if hand.is_right > 0.5 else 'L'
+        begin = hand.begin * stride
+        rows = hand.trim()
+        if stride > 1:
+            rows = unstride_frames(rows, stride, keys=list(rows), total=tail_total(hand.begin, len(hand), stride, total))
+        for k, v in {'scaled_focal_length': hand.scaled_focal_length, **rows}.items():
             key = ';'.join([prefix, f'hand{i}{LR}', f'{begin}', k])
 
             if not IS_RAW and k in ['global_orient', 'hand_pose']:
@@ -326,16 +355,19 @@ def export(
     savez(file, data)
 
 
-def data_remap(From: list[dict], to: list[dict], frame=0):
+def data_remap(From: list[dict], to: list[Track], frame=0) -> list[int]:
     """
     remap preds data for `export()` per frame
 
     Args:
         From: list of dicts, each dict contains hand predictions for a frame
-        to: list of dicts, each dict will be updated with the remapped data
+        to: tracks of hands, each one appended with the remapped data
+
+    Returns:
+        track index in `to` of each hand in `From`
 
     ```python
-    to_preds: list[dict] = []
+    to_preds: list[Track] = []
     frame_count = 0
     while cap.isOpened():
         ...
@@ -347,81 +379,55 @@ def data_remap(From: list[dict], to: list[dict], frame=0):
     lens = len(to)
     print(f"⚠️ Changed: {_len} hands @ {frame=}") if _len != lens else None
     BLACKLIST = ['pred_vertices', 'scaled_focal_length']    # won't save these
-    TO_I = set()
-    # print(f'{frame=}{_FROM_I=}')
-    for _i, _hand in enumerate(From):
-        # ensure to only match with not done hands
-        i_to = match_nearest_hand(_hand, to, frame=frame, done_idx=TO_I)
+    matches = match_nearest_hand(From, to, frame=frame)
+    tracks: list[int] = []
+    for _i, (_hand, i_to) in enumerate(zip(From, matches)):
         if i_to is None:
             i_to = len(to)
-            to.append({})
+            print(f"➕ hand{i_to} created @ {frame=}")
+            to.append(Track(
+                begin=frame,
+                is_right=_hand['is_right'],
+                scaled_focal_length=_hand['wilor_preds']['scaled_focal_length'],
+            ))
         hand = to[i_to]
-        TO_I.add(i_to)
         wilor_preds: dict[str, np.ndarray] = _hand["wilor_preds"]
         wilor_preds['bbox'] = _hand['hand_bbox']
-        wilor_preds = {K: np.expand_dims(squeeze(v, key=K), axis=0) for K, v in wilor_preds.items() if K not in BLACKLIST}
+        wilor_preds = {K: squeeze(v, key=K) for K, v in wilor_preds.items() if K not in BLACKLIST}
 
-        print(f'{i_to is None=}\t{len(hand) == 0=}') if (i_to is None) != (len(hand) == 0) else None
-
-        if len(hand) == 0:
-            print(f"➕ hand{i_to} created @ {frame=}")
-            __hand = {
-                'begin': frame,
-                'is_right': _hand['is_right'],
-                'scaled_focal_length': _hand['wilor_preds']['scaled_focal_length'],
-                **wilor_preds
-            }
-            to[i_to] = __hand
-        else:
-            if _hand['is_right'] != hand['is_right']:
-                print(f"❌ hand{_i} is_right changed @ {frame=}")   # this shouldn't happen
-            for K in _WILOR_KEYS:
-                if K in hand.keys() and K in wilor_preds.keys():
-                    hand[K] = np.concatenate((hand[K], wilor_preds[K]), axis=0)
-                elif K not in BLACKLIST:
-                    print(f"hand{_i} {K} not in pred @ {frame=}, {hand.keys()}")  # this shouldn't happen
+        if _hand['is_right'] != hand.is_right:
+            print(f"❌ hand{_i} is_right changed @ {frame=}")   # this shouldn't happen
+        for K in _WILOR_KEYS:
+            if K not in wilor_preds and K not in BLACKLIST:
+                print(f"hand{_i} {K} not in pred @ {frame=}, {hand.keys()}")  # this shouldn't happen
+        hand.append(wilor_preds)
+        tracks.append(i_to)
+    return tracks
 
 
-def match_nearest_hand(_hand: dict, to: list[dict], frame: int, done_idx: set[int] = set(), max_error=50.0) -> int | None:
+def match_nearest_hand(From: list[dict], to: list[Track], frame: int, max_error=50.0) -> list[int | None]:
     """
-    根据bbox和is_right找到最佳匹配的手部索引
+    一次匹配当前帧所有的手: 代价 = bbox中心点距离 + (1 - IoU), 左右手标识不同则不匹配, 全局最优, 与检测顺序无关
 
     Args:
-        _hand: From的当前手
-        to: _hand 在 `to[frame-1]` 内查找
+        From: 当前帧的手
+        to: 在各轨迹的最后一帧内查找
         frame: current frame
-        done_idx: exclude these idx from `to`
 
     Returns:
-        最佳匹配的索引，如果没有找到则返回None
+        From 每只手匹配的索引，没有找到则为None
     """
-    _bbox = np.array(_hand['hand_bbox'])
-    _is_right = _hand['is_right']
-    min_distance = float('inf')
-    index = None
-
-    for i, hand in enumerate(to):
-        # 跳过空预测 或 已匹配
-        if len(hand) == 0 or i in done_idx:
-            continue
-
-        # 优先匹配相同的左右手标识
-        if hand.get('is_right') == _is_right and 'bbox' in hand:
-            bbox = hand['bbox'][max(0, min(frame, len(hand['bbox'])) - 1)]
-            if bbox.shape == _bbox.shape:
-                # 计算bbox中心点距离
-                from_center = np.array([
-                    (_bbox[0] + _bbox[2]) / 2,
-                    (_bbox[1] + _bbox[3]) / 2])
-                to_center = np.array([
-                    (bbox[0] + bbox[2]) / 2,
-                    (bbox[1] + bbox[3]) / 2])
-                distance = np.linalg.norm(from_center - to_center)
-                if distance < min_distance:
-                    min_distance = distance
-                    index = i
-    print(f'{min_distance=} @ {frame=}') if min_distance > max_error else None
-    return index
+    alive = [i for i, hand in enumerate(to) if len(hand) and 'bbox' in hand]
+    if not From or not alive:
+        return [None] * len(From)
+    cost, dist = box_cost(
+        [np.ravel(_hand['hand_bbox'])[:4] for _hand in From],
+        [to[i]['bbox'][-1] for i in alive])
+    same_side = np.array([_hand['is_right'] for _hand in From])[:, None] == np.array([to[i].is_right for i in alive])[None]
+    matches = assign(cost, same_side)
+    for _i, j in enumerate(matches):
+        print(f'distance={dist[_i, j]} of hand{alive[j]} @ {frame=}') if j is not None and dist[_i, j] > max_error else None
+    return [None if j is None else alive[j] for j in matches]
 
 
 def Import():
@@ -438,12 +444,31 @@ def Import():
     return WiLorHandPose3dEstimationPipeline
 
 
-def image_wilor(input='img.png', out_dir=OUTDIR):
+@cache
+def get_pipe():
+    """load models once, reused by every job of a resident worker"""
     WiLorHandPose3dEstimationPipeline = Import()
     device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
     dtype = torch.float16
+    return WiLorHandPose3dEstimationPipeline(device=device, dtype=dtype, verbose=False)
+
 
-    pipe = WiLorHandPose3dEstimationPipeline(device=device, dtype=dtype, verbose=False)
+@cache
+def get_mano():
+    """only the MANO layer of `get_pipe()`, for `render_wilor()` which infers nothing"""
+    if get_pipe.cache_info().currsize:  # resident worker already loaded it
+        return get_pipe().wilor_model.mano
+    import wilor_mini
+    from wilor_mini.models.mano_wrapper import MANO
+    pretrained = os.path.join(os.path.dirname(wilor_mini.__file__), "pretrained_models")
+    model, mean = os.path.join(pretrained, "MANO_RIGHT.pkl"), os.path.join(pretrained, "mano_mean_params.npz")
+    if not (os.path.exists(model) and os.path.exists(mean)):   # downloaded by the 1st load of the pipeline
+        return get_pipe().wilor_model.mano
+    return MANO(model_path=model, mean_params=mean, gender='neutral', num_hand_joints=15, create_body_pose=False)
+
+
+def image_wilor(input='img.png', out_dir=OUTDIR):
+    pipe = get_pipe()
     image = cv2.imread(input)
     pred = pipe.predict(image)
     image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -455,34 +480,14 @@ def image_wilor(input='img.png', out_dir=OUTDIR):
     if IS_RENDER:
         renderer = Renderer(pipe.wilor_model.mano.faces)
 
-        render_image = image.copy()
-        render_image = render_image.astype(np.float32)[:, :, ::-1] / 255.0
         pred_keypoints_2d_all = []
         for i, out in enumerate(pred):
             wilor_preds = out["wilor_preds"]
-            is_right = out['is_right']
-            verts = wilor_preds['pred_vertices'][0]
-            cam_t = wilor_preds['pred_cam_t_full'][0]
-            scaled_focal_length = wilor_preds['scaled_focal_length']
-            pred_keypoints_2d = wilor_preds["pred_keypoints_2d"]
-            pred_keypoints_2d_all.append(pred_keypoints_2d)
-            misc_args = dict(
-                mesh_base_color=LIGHT_PURPLE,
-                scene_bg_color=(1, 1, 1),
-                focal_length=scaled_focal_length,
-            )
-            export_obj(renderer, verts, cam_t, is_right,
+            pred_keypoints_2d_all.append(wilor_preds["pred_keypoints_2d"])
+            export_obj(renderer, wilor_preds['pred_vertices'][0], wilor_preds['pred_cam_t_full'][0], out['is_right'],
                        os.path.join(out_dir, f'{filename}_hand{i:02d}.obj'))
-            cam_view = renderer.render_rgba(
-                verts, cam_t=cam_t,
-                render_res=[image.shape[1], image.shape[0]],
-                is_right=is_right,
-                **misc_args)
-
-            # Overlay image
-            render_image = render_image[:, :, :3] * (1 - cam_view[:, :, 3:]) + cam_view[:, :, :3] * cam_view[:, :, 3:]
-
-        render_image = (255 * render_image).astype(np.uint8)
+        render_image = renderer.overlay(image, pred, mesh_base_color=LIGHT_PURPLE, scene_bg_color=(1, 1, 1))
+        renderer.delete()
         for pred_keypoints_2d in pred_keypoints_2d_all:
             for j in range(pred_keypoints_2d[0].shape[0]):
                 color = (0, 0, 255)
@@ -498,84 +503,120 @@ def export_obj(renderer, verts, cam_t, is_right, out='{filename}_hand{idx:02d}.o
     tmesh.export(out)
 
 
-def video_wilor(input='video.mp4', out_dir=OUTDIR):
-    WiLorHandPose3dEstimationPipeline = Import()
-    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
-    dtype = torch.float16
+def predict_batch(pipe, images: list[np.ndarray], hand_conf=0.3) -> list[list[dict]]:
+    """same as `[pipe.predict(image) for image in images]`, but the detector runs on all `images` at once"""
+    if len(images) == 1:
+        return [pipe.predict(images[0])]
+    detections = pipe.hand_detector(images, conf=hand_conf, verbose=pipe.verbose)
+    preds = []
+    for image, det in zip(images, detections):
+        boxes = det.boxes.data.cpu().detach().numpy().reshape(-1, 6)  # x1, y1, x2, y2, conf, cls
+        preds.append(predict_with_bboxes(pipe, image, boxes[:, :4], boxes[:, 5].tolist()))
+    return preds
+
+
+def predict_with_bboxes(pipe, image: np.ndarray, bboxes: np.ndarray, is_rights: list) -> list[dict]:
+    """`pipe.predict(image)` in given boxes, without the detector"""
+    if len(bboxes) == 0:
+        return []
+    pred = pipe.predict_with_bboxes(image, bboxes, is_rights)
+    for out, bbox, is_right in zip(pred, bboxes, is_rights):
+        out.setdefault('hand_bbox', bbox.tolist())
+        out.setdefault('is_right', is_right)
+    return pred
+
+
+def predict_tracked(pipe, image: np.ndarray, tracker: BoxTracker) -> list[dict]:
+    """detect on keyframes of `tracker`, else estimate in boxes propagated from the last frame, detect again if lost"""
+    def update(pred: list[dict], detected: bool):
+        return tracker.update(
+            np.array([out['hand_bbox'] for out in pred]).reshape(-1, 4),
+            [out['is_right'] for out in pred],
+            np.array([out['wilor_preds']['pred_keypoints_2d'] for out in pred]).reshape(len(pred), -1, 2),
+            detected=detected)
+
+    boxes = tracker.next()
+    pred = pipe.predict(image) if boxes is None else predict_with_bboxes(pipe, image, *boxes)
+    if not update(pred, detected=boxes is None):
+        pred = pipe.predict(image)
+        update(pred, detected=True)
+    return pred
+
+
+def predict_frames(pipe, images: Iterable[np.ndarray], batch=1, tracker: BoxTracker | None = None):
+    """yield `(image, hands)` of each RGB image in order, detect hands of `batch` images at once,
+    or 1 by 1 only on keyframes of `tracker`"""
+    if tracker:
+        for image in images:
+            yield image, predict_tracked(pipe, image, tracker)
+        return
+    for _images in batched(images, batch):
+        yield from zip(_images, predict_batch(pipe, _images))
+
+
+def rgb(frame: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+def read_frames(cap, stride=1):
+    """every `stride`-th frame, the ones between are grabbed without decoding"""
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+        yield frame
+        for _ in range(stride - 1):
+            if not cap.grab():
+                return
+
 
-    pipe = WiLorHandPose3dEstimationPipeline(device=device, dtype=dtype)
+def video_wilor(input='video.mp4', out_dir=OUTDIR):
+    pipe = get_pipe()
     os.makedirs(out_dir, exist_ok=True)
     renderer = Renderer(pipe.wilor_model.mano.faces)
 
     # Open the video file
-    cap = cv2.VideoCapture(input)
+    cap = VideoCapture(cv2, input)  # or seek-and-skip on the source of .vinput.json
 
     # Get video properties
     fps = int(cap.get(cv2.CAP_PROP_FPS))
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    stride = stride_of(cap.get(cv2.CAP_PROP_FPS), STRIDE, TARGET_FPS)
     filename = no_ext_filename(input)
     file = filename + '.mp4'
-    progress = tqdm(total=total, desc=f"👋←📹 {file}", unit="frame")
+    progress = tqdm(total=-(-total // stride), desc=f"👋←📹 {file}" + (f" /{stride}" if stride > 1 else ''), unit="frame")
 
     # Create VideoWriter object
     output_path = os.path.join(out_dir, _PREFIX + file)  # tmp
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # type:ignore
-    vout = cv2.VideoWriter(output_path, fourcc, fps, (width, height)) if IS_RENDER else None
+    vout = cv2.VideoWriter(output_path, fourcc, fps / stride, (width, height)) if IS_RENDER else None  # inferred frames only
 
-    if IS_EXPORT_OBJ:
-        output_path_obj = os.path.join(out_dir, 'obj')
-        os.makedirs(output_path_obj, exist_ok=True)
-    else:
-        output_path_obj = None
+    meshes = MeshWriter(
+        os.path.join(out_dir, f'{filename}.mesh.npy'), vertices=MANO_VERTICES,
+        faces={'faces': renderer.faces, 'faces_left': renderer.faces_left},
+    ) if IS_EXPORT_OBJ else None
 
-    preds: list[dict] = []  # hands, frames
+    preds: list[Track] = []  # hands, frames
     frame_count = 0
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        _pred = pipe.predict(image)  # hands per frame
-        # Convert frame to RGB
-        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        data_remap(_pred, preds, frame_count)
-
-        if output_path_obj:
-            for i, out in enumerate(_pred):
-                wilor_preds = out["wilor_preds"]
-                is_right = out['is_right']
-                verts = wilor_preds['pred_vertices'][0]
-                cam_t = wilor_preds['pred_cam_t_full'][0]
-                export_obj(renderer, verts, cam_t, is_right,
-                           os.path.join(output_path_obj, f'{filename}_hand{i:02d}_{frame_count}.obj'))
+    frames = read_frames(cap, stride)
+    if PREFETCH:    # decode while inferring
+        images = Prefetch(frames, fn=rgb, size=max(PREFETCH, BATCH), workers=DECODE_THREADS)
+    else:
+        images = map(rgb, frames)
+    tracker = BoxTracker(every=DETECT_EVERY) if DETECT_EVERY > 1 else None
+    start = time.perf_counter()
+    for image, _pred in predict_frames(pipe, images, BATCH, tracker):  # hands per frame
+        tracks = data_remap(_pred, preds, frame_count)
+
+        if meshes:  # same space as `export_obj()`, slot i is hand{i} of the npz
+            meshes.write(
+                [(out['wilor_preds']['pred_vertices'][0] + out['wilor_preds']['pred_cam_t_full'][0]) * FLIP_YZ for out in _pred],
+                is_right=[out['is_right'] for out in _pred], slots=tracks)
 
         if IS_RENDER:
-            render_image = image.copy()
-            render_image = render_image.astype(np.float32)[:, :, ::-1] / 255.0
-
-            for i, out in enumerate(_pred):
-                wilor_preds = out["wilor_preds"]
-                is_right = out['is_right']
-                verts = wilor_preds['pred_vertices'][0]
-                cam_t = wilor_preds['pred_cam_t_full'][0]
-                scaled_focal_length = wilor_preds['scaled_focal_length']
-
-                misc_args = dict(
-                    mesh_base_color=LIGHT_PURPLE,
-                    scene_bg_color=(1, 1, 1),
-                    focal_length=scaled_focal_length,
-                )
-                cam_view = renderer.render_rgba(
-                    verts, cam_t=cam_t,
-                    render_res=[image.shape[1], image.shape[0]],
-                    is_right=is_right,
-                    **misc_args)
-
-                # Overlay image
-                render_image = render_image[:, :, :3] * (1 - cam_view[:, :, 3:]) + cam_view[:, :, :3] * cam_view[:, :, 3:]
-
-            render_image = (255 * render_image).astype(np.uint8)
+            render_image = renderer.overlay(image, _pred, mesh_base_color=LIGHT_PURPLE, scene_bg_color=(1, 1, 1))
 
             # Write the frame to the output video
             vout.write(render_image)
@@ -585,31 +626,150 @@ def video_wilor(input='video.mp4', out_dir=OUTDIR):
 
     # Release everything
     progress.close()
+    waited = f", waited {images.waited:.1f}s for decoding" if isinstance(images, Prefetch) else ''
+    print(f"⏱ {frame_count / (time.perf_counter() - start):.2f} frames/s @ batch={BATCH}, stride={stride}, {len(preds)} hands{waited}")
+    print(f"🔍 {tracker}") if tracker else None
     cap.release()
     vout.release() if vout else None
+    meshes.close() if meshes else None
+    renderer.delete()
     cv2.destroyAllWindows()
 
-    export(preds, os.path.join(out_dir, f'{filename}.mocap.npz'))
+    export(preds, os.path.join(out_dir, f'{filename}.mocap.npz'), stride=stride, total=total)
+
+
+def load_hands(npz: str) -> list[dict]:
+    """tracks of hands from `export()`, keyed by the last part of `smplx;wilor;hand{ID}{LR};{begin};{prop}`"""
+    hands: dict[str, dict] = {}
+    with np.load(npz, allow_pickle=True) as data:
+        for key in data.files:
+            parts = key.split(';')
+            if len(parts) != 5 or parts[:2] != ['smplx', 'wilor']:
+                continue
+            hand = hands.setdefault(parts[2], {'begin': int(parts[3]), 'is_right': parts[2].endswith('R')})
+            hand[parts[4]] = data[key]
+    return list(hands.values())
+
+
+def hand_vertices(mano, hand: dict, batch=1024) -> np.ndarray:
+    """MANO vertices of every frame of `hand`, as `pred_vertices` of `pipe.predict()`"""
+    def rotmat(v: np.ndarray, joints: int):
+        v = v.reshape(len(v), joints, -1)
+        return quat_to_RotMat(v) if v.shape[-1] == 4 else Rodrigues(v)  # else `--raw`
+    global_orient, hand_pose = rotmat(hand['global_orient'], 1), rotmat(hand['hand_pose'], 15)
+    betas = hand['betas'].reshape(len(global_orient), -1)
+    device, dtype = mano.shapedirs.device, mano.shapedirs.dtype
+    verts = []
+    with torch.no_grad():
+        for i in range(0, len(betas), batch):
+            out = mano(**{K: torch.as_tensor(v[i:i + batch], device=device, dtype=dtype) for K, v in dict(
+                global_orient=global_orient, hand_pose=hand_pose, betas=betas).items()}, pose2rot=False)
+            verts.append(out.vertices.float().cpu().numpy())
+    verts = np.concatenate(verts)
+    verts[..., 0] *= 1 if hand['is_right'] else -1  # left hands are inferred mirrored
+    return verts
+
+
+_RENDER: dict = {}
+
+
+def _render_init(video: str, faces: np.ndarray):
+    """per process of the render pool"""
+    _RENDER.update(video=video, renderer=Renderer(faces), cap=None, pos=-1)
+
+
+def _render_chunk(task: tuple[int, int, list[tuple]]) -> list[np.ndarray]:
+    """BGR frames [start, stop) with hands overlaid, each hand of `(is_right, begin, verts, cam_t, focal)` from frame `begin`"""
+    start, stop, hands = task
+    cap = _RENDER['cap'] = _RENDER['cap'] or VideoCapture(cv2, _RENDER['video'])
+    if _RENDER['pos'] != start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    frames = []
+    for f in range(start, stop):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        pred = [
+            {'is_right': is_right, 'wilor_preds': {'pred_vertices': verts[f - begin][None], 'pred_cam_t_full': cam_t[f - begin][None], 'scaled_focal_length': focal}}
+            for is_right, begin, verts, cam_t, focal in hands if 0 <= f - begin < len(verts)
+        ]
+        frames.append(_RENDER['renderer'].overlay(rgb(frame), pred, mesh_base_color=LIGHT_PURPLE, scene_bg_color=(1, 1, 1)))
+    _RENDER['pos'] = start + len(frames)
+    return frames
+
+
+def render_wilor(input='video.mp4', out_dir=OUTDIR, workers=RENDER_WORKERS, chunk=32):
+    """render `{out_dir}/{filename}.mocap.npz` over `input` without inference,
+    chunks of frames are rendered by a pool of headless renderers and written in order"""
+    import multiprocessing
+    workers = workers or max(1, (os.cpu_count() or 2) // 2)
+    filename = no_ext_filename(input)
+    npz = os.path.join(out_dir, f'{filename}.mocap.npz')
+    hands = load_hands(npz)
+    mano = get_mano()
+    faces = mano.faces
+    hands = [(
+        hand['is_right'], hand['begin'], hand_vertices(mano, hand),
+        hand['pred_cam_t_full'].reshape(-1, 3), float(np.ravel(hand.get('scaled_focal_length', 0))[0]),
+    ) for hand in hands]
+
+    cap = VideoCapture(cv2, input)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    tasks = []
+    for a in range(0, total, chunk):
+        b = min(a + chunk, total)
+        tasks.append((a, b, [
+            (is_right, max(a, begin), verts[max(a, begin) - begin:b - begin], cam_t[max(a, begin) - begin:b - begin], focal)
+            for is_right, begin, verts, cam_t, focal in hands if begin < b and a < begin + len(verts)
+        ]))  # only vertices of the chunk are sent to the pool
+    output_path = os.path.join(out_dir, _PREFIX + filename + '.mp4')
+    vout = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))  # type:ignore
+    progress = tqdm(total=total, desc=f"🎨 {filename}.mp4", unit="frame")
+    start = time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(workers, _render_init, (input, faces)) as pool:
+        for frames in pool.imap(_render_chunk, tasks):  # in order
+            for frame in frames:
+                vout.write(frame)
+            progress.update(len(frames))
+    progress.close()
+    vout.release()
+    print(f"⏱ {total / (time.perf_counter() - start):.2f} frames/s rendered by {workers} processes → {output_path}")
 
 
-def argParse():
+def argParse(argv: Sequence[str] | None = None):
     arg = argparse.ArgumentParser()
     arg.add_argument('-i', '--input', metavar='in.mp4')
     arg.add_argument('-o', '--outdir', metavar=OUTDIR, default=OUTDIR)
     arg.add_argument('--raw', action='store_true', help='raw data, NO axis angle to quaternion')
     arg.add_argument('--render', action='store_true', help='render hands mesh to video')
-    arg.add_argument('--obj', action='store_true', help='export hands mesh to .obj')
-    args, _args = arg.parse_known_args()
-    if args.render:
-        global IS_RENDER
-        IS_RENDER = True
-    if args.obj:
-        global IS_EXPORT_OBJ
-        IS_EXPORT_OBJ = True
-    if args.raw:
-        global IS_RAW
-        IS_RAW = True
-    if not args.input:
+    arg.add_argument('--obj', action='store_true', help='export hands mesh, .obj of image or packed .mesh.npy of video')
+    arg.add_argument('--server', metavar='/tmp/wilor.sock', help='resident worker, take jobs from unix socket')
+    arg.add_argument('--idle', type=float, default=300, metavar='300', help='resident worker exits after idle seconds')
+    arg.add_argument('--batch', type=int, default=8, metavar='8', help='frames per batch of the hand detector')
+    arg.add_argument('--detect-every', type=int, default=1, metavar='1', help='run the hand detector every k frames, track boxes by keypoints between them, detect again if lost')
+    arg.add_argument('--stride', type=int, default=1, metavar='1', help='infer every k-th frame, slerp/lerp the frames between into .mocap.npz')
+    arg.add_argument('--target-fps', type=float, default=0, metavar='0', help='infer at about this fps instead of --stride, 0 for every frame')
+    arg.add_argument('--prefetch', type=int, default=32, metavar='32', help='frames decoded ahead in background, 0 to decode inline')
+    arg.add_argument('--decode-threads', type=int, default=1, metavar='1', help='threads converting decoded frames to RGB')
+    arg.add_argument('--render-only', action='store_true', help='render hands of the saved .mocap.npz to video, without inference')
+    arg.add_argument('--render-workers', type=int, default=0, metavar='0', help='processes of --render-only, 0 for half of cpus')
+    args, _args = arg.parse_known_args(argv)
+    global IS_RENDER, IS_EXPORT_OBJ, IS_RAW, BATCH, DETECT_EVERY, STRIDE, TARGET_FPS, PREFETCH, DECODE_THREADS, RENDER_WORKERS
+    IS_RENDER = args.render  # reset for every job of a resident worker
+    IS_EXPORT_OBJ = args.obj
+    IS_RAW = args.raw
+    BATCH = max(1, args.batch)
+    DETECT_EVERY = max(1, args.detect_every)
+    STRIDE = max(1, args.stride)
+    TARGET_FPS = max(0.0, args.target_fps)
+    PREFETCH = max(0, args.prefetch)
+    DECODE_THREADS = max(1, args.decode_threads)
+    RENDER_WORKERS = max(0, args.render_workers)
+    if not args.input and not args.server:
         arg.print_help()
         exit(1)
     return args, _args, arg
@@ -618,7 +778,9 @@ def argParse():
 def wilor(args: argparse.Namespace, arg: argparse.ArgumentParser):
     if args.input:
         outdir = os.path.join(args.outdir, no_ext_filename(args.input))
-        if args.input.split('.')[-1].lower() not in VIDEO_EXT:
+        if args.render_only:
+            render_wilor(input=args.input, out_dir=outdir, workers=RENDER_WORKERS)
+        elif args.input.split('.')[-1].lower() not in VIDEO_EXT:
             image_wilor(input=args.input, out_dir=outdir)
         else:
             video_wilor(input=args.input, out_dir=outdir)
@@ -633,4 +795,7 @@ import torch
 import pyrender
 import trimesh
 if __name__ == '__main__':
-    wilor(args, arg)
+    if args.server:
+        serve(lambda argv: wilor(*argParse(argv)[::2]), args.server, args.idle)
+    else:
+        wilor(args, arg)
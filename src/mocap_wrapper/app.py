@@ -14,15 +14,35 @@ import sys
 import copy
 import asyncio
 import argparse
+from functools import partial
 from typing import Sequence
 from .lib import (
     getLogger,
     ffmpeg_or_link,
+    fps_duration,
+    range_time,
+    plan_shards,
+    stitch,
+    input_key,
+    workdir,
+    partial_snapshot,
+    saved_runs,
+    remove_partial,
+    ingest,
     Python,
+    ResultCache,
+    Scheduler,
+    Stage,
+    pipeline,
     CONFIG,
+    LOOKAHEAD,
+    NO_CACHE,
+    SHARD,
+    SHARD_OVERLAP,
     PACKAGE,
     QRCODE,
     RUNS,
+    RUNS_VINPUT,
     TYPE_RUNS,
     VERSION,
 )
@@ -44,22 +64,177 @@ _VERSION_ = version()
 Log = getLogger(__name__)
 
 
+def npz_of(video: str):
+    """`outdir/<stem>/<stem>.mocap.npz` next to the video from `ffmpeg_or_link()`"""
+    return os.path.splitext(video)[0] + ".mocap.npz"
+
+
+async def prepare(
+    runs: Sequence[TYPE_RUNS],
+    input: str,
+    outdir: str,
+    Range="",
+    args: Sequence[str] = [],
+    cache: ResultCache | None = None,
+    name="",
+):
+    """merge cached results into `.mocap.npz`, transcode only if some runs missed the cache
+
+    Args:
+        name: of `outdir/<name>/`, default from `workdir()`
+
+    Returns:
+        video: "" if all runs hit the cache, missing if all runs to infer read its `.vinput.json`
+        npz: `outdir/<name>/<name>.mocap.npz`
+        keys: `{run: cache_key}` of runs to infer
+    """
+    virtual = all(m in RUNS_VINPUT for m in runs)
+    if cache is None:
+        video = await ffmpeg_or_link(input, outdir, Range=Range, name=name, virtual=virtual)
+        return video, npz_of(video), {m: "" for m in runs}
+    ik = await asyncio.to_thread(input_key, input, Range)
+    name = name or workdir(outdir, input, ik)
+    npz = os.path.join(outdir, name, f"{name}.mocap.npz")
+    keys = {m: cache.key(ik, m, args) for m in runs}
+    keys = {m: k for m, k in keys.items() if not await asyncio.to_thread(cache.get, k, npz)}
+    virtual = all(m in RUNS_VINPUT for m in keys)
+    video = await ffmpeg_or_link(input, outdir, Range=Range, name=name, virtual=virtual) if keys else ""
+    return video, npz, keys
+
+
+async def prepare_shards(
+    runs: Sequence[TYPE_RUNS],
+    input: str,
+    outdir: str,
+    Range="",
+    args: Sequence[str] = [],
+    cache: ResultCache | None = None,
+    shard=SHARD,
+    overlap=SHARD_OVERLAP,
+):
+    """`prepare()` each time shard of `input`, see `plan_shards()`
+
+    Returns:
+        npz: stitched `outdir/<name>/<name>.mocap.npz`
+        parts: `prepare()` of each shard
+        offsets: 1st frame of each shard in `npz`
+        overlap: frames shared by neighbor shards
+    """
+    fps, duration = await asyncio.to_thread(fps_duration, input)
+    start, length = [t.total_seconds() for t in range_time(Range)] if Range else (0, duration)
+    length = min(length, duration - start)
+    shards = plan_shards(length, shard, overlap, start=start)
+    if len(shards) == 1:
+        video, npz, keys = await prepare(runs, input, outdir, Range=Range, args=args, cache=cache)
+        return npz, [(video, npz, keys)], [0], 0
+    name = os.path.splitext(os.path.basename(input))[0]
+    if cache:
+        name = workdir(outdir, input, await asyncio.to_thread(input_key, input, Range))
+    Log.info(f"🔪 {input} → {len(shards)} shards of {shard}s")
+    parts = await asyncio.gather(*[
+        prepare(runs, input, outdir, Range=f"{s}+{d}", args=args, cache=cache, name=f"{name}-shard{i}")
+        for i, (s, d) in enumerate(shards)
+    ])
+    offsets = [round((s - start) * fps) for s, d in shards]
+    os.makedirs(os.path.join(outdir, name), exist_ok=True)
+    return os.path.join(outdir, name, f"{name}.mocap.npz"), parts, offsets, round(overlap * fps)
+
+
+async def python(run: TYPE_RUNS, video: str, outdir: str, args: Sequence[str] = []):
+    """`Python()` on `video`, removes partial files of `run` if cancelled or preempted"""
+    Dir = os.path.dirname(video)
+    before = await asyncio.to_thread(partial_snapshot, Dir, run)
+    cleanup = partial(remove_partial, Dir, run, before, keep=[video])
+    return await Python("--input", video, "-o", outdir, *args, run=run, cleanup=cleanup)
+
+
+async def infer(
+    runs: Sequence[TYPE_RUNS] | dict[TYPE_RUNS, str],
+    video: str,
+    outdir: str,
+    args: Sequence[str] = [],
+    scheduler: Scheduler | None = None,
+    cache: ResultCache | None = None,
+    priority=0,
+):
+    """runs on same `video` go 1 by 1, runs on different videos share the `scheduler` budget
+
+    Args:
+        runs: `{run: cache_key}` from `prepare()` to store successful results in `cache`
+        priority: see `Scheduler.run()`
+    """
+    scheduler = scheduler or Scheduler()
+    keys = runs if isinstance(runs, dict) else {m: "" for m in runs}
+    for m, key in keys.items():
+        p = await scheduler.run(
+            m, partial(python, m, video, outdir, args), key=video, priority=priority
+        )
+        status = p if isinstance(p, int) else p.get_status()
+        if cache and key and status == 0:
+            await asyncio.to_thread(cache.put, key, npz_of(video), m)
+    return video
+
+
 async def run(
     runs: Sequence[TYPE_RUNS],
     input: str,
     outdir: str,
     Range="",
     args: Sequence[str] = [],
+    scheduler: Scheduler | None = None,
+    cache: ResultCache | None = None,
+):
+    if not input:
+        await infer(runs, "", outdir, args=args, scheduler=scheduler)
+        return npz_of("")
+    video, npz, keys = await prepare(runs, input, outdir, Range=Range, args=args, cache=cache)
+    if keys:
+        await infer(keys, video, outdir, args=args, scheduler=scheduler, cache=cache)
+    return npz
+
+
+async def render(
+    inputs: list[str],
+    outdir=OUTPUT_DIR,
+    Range="",
+    by: Sequence[TYPE_RUNS] = RUNS,
+    args: Sequence[str] = [],
+    scheduler: Scheduler | None = None,
 ):
-    video = await ffmpeg_or_link(input, outdir, Range=Range) if input else ""
-    for m in runs:
-        p = await Python("--input", video, "-o", outdir, *args, run=m)
+    """`mocap render`: preview videos of `by` from the saved `.mocap.npz` of `inputs`, without inference
+
+    Returns:
+        videos: next to each rendered `.mocap.npz`, None if it has no run of `by`
+    """
+    scheduler = scheduler or Scheduler()
+    inputs = await asyncio.to_thread(ingest, inputs)
+
+    async def preview(input: str):
+        name = "" if NO_CACHE else workdir(outdir, input, await asyncio.to_thread(input_key, input, Range))
+        virtual = all(m in RUNS_VINPUT for m in by)
+        video = await ffmpeg_or_link(input, outdir, Range=Range, name=name, virtual=virtual)
+        saved = await asyncio.to_thread(saved_runs, npz_of(video))
+        missing = [m for m in by if m not in saved]
+        if missing:
+            Log.error(f"❌ No {missing} in {npz_of(video)} to render, run `mocap -i {input} -b {','.join(missing)}` first")
+        if len(missing) == len(by):
+            return
+        for m in by:
+            if m in saved:
+                await scheduler.run(
+                    m, partial(python, m, video, outdir, ["--render-only", *args]), key=video
+                )
+        Log.info(f"🎨 {os.path.dirname(video)}")
+        return video
+
+    return await asyncio.gather(*[preview(i) for i in inputs])
 
 
 class ArgParser(argparse.ArgumentParser):
     def print_help(self, file=None):
         print(QRCODE)
         print(f"example: mocap -I -@ .. -i input.mp4")
+        print(f"         mocap render -i input.mp4 -b wilor  # preview from .mocap.npz, no inference")
         super().print_help(file)
         tasks = [Python("--help", run=m) for m in DEFAULT]
         asyncio.run(gather(*tasks))
@@ -88,7 +263,13 @@ def argParse():
         metavar=CONFIG["search_dir"],
         help='search_dir of git repos, eg: `--at=".."` if GVHMR is current work dir',
     )
-    arg.add_argument("-i", "--input", nargs="*", metavar="in.mp4")
+    arg.add_argument(
+        "-i",
+        "--input",
+        nargs="*",
+        metavar="in.mp4",
+        help="videos, directories or quoted globs, eg: `-i clips/ 'night/**/*.mov'`",
+    )
     arg.add_argument("-o", "--outdir", metavar=OUTPUT_DIR, default=OUTPUT_DIR)
     arg.add_argument(
         "-r",
@@ -97,6 +278,18 @@ def argParse():
         default="",
         help="video time range, eg: `--range=0:0:1,0:2` is 1s~2s, `--range=10` is 0s~10s",
     )
+    arg.add_argument(
+        "--agent",
+        metavar="http://host:23333",
+        help="run jobs of a remote `mocap` server on this machine, with runs of `--by`, default all installed",
+    )
+    arg.add_argument(
+        "--shard",
+        metavar="seconds",
+        type=float,
+        default=SHARD,
+        help="split each input into time shards that run in parallel, then stitch, eg: `--shard=300` for 30min+ videos",
+    )
     # arg.add_argument('--euler', action='store_true', help='use euler_XYZ for bones rotations for export data')
     ns, args = arg.parse_known_args()
     return ns, args
@@ -109,7 +302,23 @@ async def mocap(
     at=CONFIG["search_dir"],
     by: Sequence[TYPE_RUNS] = RUNS,
     args: list[str] = [],
+    scheduler: Scheduler | None = None,
+    lookahead=LOOKAHEAD,
+    cache: ResultCache | None = None,
+    shard=SHARD,
+    priority=0,
 ):
+    """
+    Args:
+        scheduler: share VRAM budget with other `mocap()` calls, e.g. jobs of the server
+        lookahead: inputs transcoded ahead of inference
+        cache: skip runs whose results are cached, default `ResultCache()` unless env `NO_CACHE`
+        shard: >0 to split each input into shards of `shard` seconds that run in parallel
+        priority: higher preempts runs of lower `mocap()` calls sharing the `scheduler`
+
+    Returns:
+        npzs: `.mocap.npz` of each input, unordered
+    """
     if at:
         CONFIG["search_dir"] = at
     os.makedirs(CONFIG["search_dir"], exist_ok=True)
@@ -125,17 +334,50 @@ async def mocap(
             _by.remove(i)
     await install(runs=_by)
     if inputs:
-        for i in inputs:
-            # TODO: auto parallelize if vram > 6gb
-            await run(by, i, outdir, Range=Range, args=args)
+        inputs = await asyncio.to_thread(ingest, inputs)
+    if inputs:
+        scheduler = scheduler or Scheduler()
+        cache = cache or (None if NO_CACHE else ResultCache())
+        Log.info(f"{scheduler}")
+
+        async def transcode(input: str):
+            if shard > 0:
+                return await prepare_shards(by, input, outdir, Range=Range, args=args, cache=cache, shard=shard)
+            video, npz, keys = await prepare(by, input, outdir, Range=Range, args=args, cache=cache)
+            return npz, [(video, npz, keys)], [0], 0
+
+        async def inference(prepared: tuple[str, list[tuple[str, str, dict]], list[int], int]):
+            npz, parts, offsets, overlap = prepared
+            await asyncio.gather(*[
+                infer(keys, video, outdir, args=args, scheduler=scheduler, cache=cache, priority=priority)
+                for video, _, keys in parts if keys
+            ])
+            if len(parts) > 1:
+                shards = [(p[1], offset) for p, offset in zip(parts, offsets)]
+                await asyncio.to_thread(stitch, shards, npz, overlap)
+            return npz
+
+        async def export(npz: str):
+            if not os.path.exists(npz):
+                raise FileNotFoundError(f"❌ No output of {npz}")
+            Log.info(f"✔ {npz}")
+            return npz
+
+        return await pipeline(
+            inputs,
+            Stage(transcode),
+            Stage(inference, workers=scheduler.concurrent, maxsize=lookahead),
+            Stage(export),
+        )
     else:
         for b in [b for b in by if b in RUNS]:
             p = await Python(args.pop(0) if args else "", *args, run=b)  # type: ignore
 
 
 def script_entry():
+    stage = sys.argv.pop(1) if sys.argv[1:2] == ["render"] else ""
     args, _args = argParse()
-    if len(sys.argv) <= 1:
+    if len(sys.argv) <= 1 and not stage:
         from .server.mcp import main as mcp_main
 
         mcp_main()
@@ -146,6 +388,18 @@ def script_entry():
             by += r.split(",")
     else:
         by = DEFAULT
+    if args.agent:
+        from .server.agent import main as agent_main
+
+        agent_main(args.agent, runs=by if args.by else None)
+        return
+
+    if stage == "render":
+        if not args.input:
+            Log.error("❌ `mocap render` needs `-i input`")
+            return
+        asyncio.run(render(args.input or [], outdir=args.outdir, Range=args.range, by=by, args=_args))
+        return
 
     if args.install and by and by[0]:  # fix mocap -I -b ''
         for r in by:
@@ -160,6 +414,7 @@ def script_entry():
             at=args.at,
             by=by,
             args=_args,
+            shard=args.shard,
         )
     )
 
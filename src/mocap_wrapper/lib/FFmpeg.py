@@ -1,24 +1,18 @@
 import os
 import re
-import ffmpeg
+import time
 import asyncio
-from ffmpeg import probe as ffprobe
-from fractions import Fraction
+import ffmpeg
 from datetime import datetime, timedelta
-from .logger import IS_DEBUG, is_debug, getLogger
+from .logger import IS_DEBUG, is_debug, getLogger, tqdm
+from .process import run_tail
+from .probe import get_catalog, probe
+from .vinput import vinput_of, write_vinput
+from .static import CONCURRENT, FFMPEG_JOBS, FFMPEG_PRESET, FFMPEG_SEGMENT, FFMPEG_THREADS, TIMEOUT_MINUTE
 from typing import Any, Literal
 Log = getLogger(__name__)
 IS_DEBUG = is_debug(Log)
-
-
-def is_vbr(metadata: dict[str, Any], codec_type: Literal['video', 'audio'] = 'video'):
-    """is bitrate variable, fallback is True"""
-    for s in metadata['streams']:
-        if s['codec_type'] == codec_type:
-            IS = s['r_frame_rate'] != s['avg_frame_rate']
-            Log.debug(f"{'VBR' if IS else 'CBR'} from {metadata}")
-            return IS
-    return True
+_RE_PROGRESS_KEY = re.compile(r'[a-z0-9_]+')
 
 
 def range_time(Str: str):
@@ -65,21 +59,280 @@ def range_time(Str: str):
     return start, duration
 
 
-async def ffmpeg_or_link(from_file: str, to_dir: str, Range='', fps_times=5):
-    """if file is vbr, ffmpeg to re-encode  
-    else create soft symlink
+TYPE_OP = Literal['link', 'copy', 'smart', 'encode']
+COPY_CODECS = ('h264',)  # `smart` re-encodes edge GOPs by the same encoder, see `ENCODERS`
+ENCODERS = {'h264': 'libx264'}
+X264_PROFILES = {
+    'Baseline': 'baseline', 'Constrained Baseline': 'baseline', 'Main': 'main', 'High': 'high',
+    'High 10': 'high10', 'High 4:2:2': 'high422', 'High 4:4:4 Predictive': 'high444',
+}
+
+
+def ffmpeg_threads(concurrent=CONCURRENT):
+    """`-threads` of each ffmpeg, env `FFMPEG_THREADS` or CPU cores shared by `concurrent` transcodes"""
+    return FFMPEG_THREADS or max(1, (os.cpu_count() or 1) // max(1, concurrent))
+
+
+def encode_args(info: dict[str, Any] | None = None, threads=0, **kw):
+    """fast x264 without audio, no runner reads it"""
+    args: dict[str, Any] = dict(
+        vcodec='libx264', an=True, extra_options={'preset': FFMPEG_PRESET, 'threads': threads or ffmpeg_threads()}
+    )
+    if info and info.get('pix_fmt'):
+        args['pix_fmt'] = info['pix_fmt']  # same as copied GOPs, see `smart`
+    return {**args, **kw}
+
+
+def stream_copy_args(**kw):
+    return dict(c='copy', an=True, extra_options={'avoid_negative_ts': 'make_zero'}, **kw)
+
+
+def copy_gops_args(info: dict[str, Any], t: float):
+    """stream copy whole GOPs of `t` seconds, counted in frames since `-t` of a copy ends by dts and takes frames of the next GOP"""
+    args = stream_copy_args()
+    args['extra_options']['frames:v'] = round(t * info['fps'])
+    return args
+
+
+def inband_args(info: dict[str, Any], is_copy: bool):
+    """parts of `smart_cut()` carry their SPS/PPS before every keyframe, so a decoder of the joined mp4 never
+    applies the parameter sets of one part to another; re-encoded parts match the profile & level of the source"""
+    if is_copy:
+        return {'bsf:v': 'h264_mp4toannexb'}  # inserts the parameter sets of the source in-band
+    options: dict[str, Any] = {'x264-params': 'repeat-headers=1'}
+    if info.get('profile') in X264_PROFILES:
+        options['profile:v'] = X264_PROFILES[info['profile']]
+    if info.get('level'):
+        options['level'] = f"{info['level'] / 10:.1f}"
+    return options
+
+
+def keyframes(from_file, start: float, end: float) -> list[float]:
+    """pts seconds of keyframes in [start, end], by reading packets without decoding"""
+    metadata = ffmpeg.probe(
+        from_file, show_streams=False, show_format=False, show_packets=True,
+        select_streams='v:0', show_entries='packet=pts_time,flags',
+        read_intervals=f'{max(0, start - 1)}%{end + 1}',
+    )
+    return sorted(
+        float(p['pts_time']) for p in metadata.get('packets', [])
+        if 'K' in p.get('flags', '') and p.get('pts_time') not in (None, 'N/A')
+        and start <= float(p['pts_time']) <= end
+    )
+
+
+def plan(info: dict[str, Any], Range='', fps_times=5, keys: list[float] | None = None) -> tuple[TYPE_OP, dict[str, Any]]:
+    """cheapest valid way to get a CFR video of `Range` with fps of times of `fps_times`
+
+    Args:
+        info: from `probe()`
+        keys: from `keyframes()` of `Range`, to stream copy
+
+    Returns:
+        op:
+            - link: hard link, nothing to cut or fix
+            - copy: stream copy, `Range` is on keyframes
+            - smart: re-encode only the GOPs at the edges of `Range`, stream copy the rest
+            - encode: re-encode all, VFR or fps changes
+        kw: `ss`, `t`, `r` for copy/encode; `head`, `mid`, `tail` as (ss, t) for smart
+    """
+    from_fps = info['fps']
+    to_fps = round(from_fps / fps_times) * fps_times
+    if from_fps != to_fps or info['is_vfr']:
+        kw: dict[str, Any] = {'r': to_fps}
+        if Range:
+            kw.update(zip(('ss', 't'), [r.total_seconds() for r in range_time(Range)]))
+        return 'encode', kw
+    if not Range:
+        return 'link', {}
+    start, duration = [r.total_seconds() for r in range_time(Range)]
+    end = min(start + duration, info['duration'] or start + duration)
+    kw = {'ss': start, 't': end - start}
+    if info['codec'] not in COPY_CODECS or not keys:
+        return 'encode', kw
+    half = 0.5 / from_fps
+    first = next((k for k in keys if k >= start - half), None)
+    last = next((k for k in reversed(keys) if k <= end + half), None)
+    is_start = first is not None and abs(first - start) <= half
+    is_end = end >= info['duration'] - half or (last is not None and abs(last - end) <= half)
+    if is_start and is_end:
+        return 'copy', kw
+    if first is None or last is None or last - first < half:
+        return 'encode', kw  # no whole GOP inside
+    return 'smart', {
+        'head': None if is_start else (start, first - start),
+        'mid': (first, (end if is_end else last) - first),
+        'tail': None if is_end else (last, end - last),
+    }
+
+
+def span(info: dict[str, Any], start=0.0, t=0.0) -> float:
+    """seconds of output from `start`, `t` clipped to the known duration, 0 if unknown (e.g. stream): read to the end"""
+    duration = info.get('duration') or 0
+    if t:
+        return max(0.0, min(t, duration - start)) if duration else t
+    return max(0.0, duration - start) if duration else 0.0
+
+
+class Progress:
+    """parse `ffmpeg -progress pipe:1` lines into a `tqdm` bar of frames, warn if ffmpeg stalls"""
+
+    def __init__(self, desc='', duration=0.0, fps=0.0, stall=TIMEOUT_MINUTE):
+        """
+        Args:
+            duration: seconds of output, for total frames & ETA
+            fps: of output
+            stall: seconds without new frames to warn
+        """
+        self.fps = fps
+        self.stall = stall
+        self.bar = tqdm(total=round(duration * fps) or None, desc=desc, unit='frame', leave=False)
+        self.block: dict[str, str] = {}
+        self._last = (-1, time.monotonic())
+        self._is_stalled = False
+
+    def __call__(self, line: str):
+        key, sep, value = line.partition('=')
+        if not sep or not _RE_PROGRESS_KEY.fullmatch(key):
+            Log.warning(f"ffmpeg❯ {line}") if line.strip() else None  # -loglevel warning
+            return
+        self.block[key] = value.strip()
+        if key == 'progress':
+            self.update(self.block)
+            self.block = {}
+
+    def update(self, block: dict[str, str]):
+        out_time = int(block.get('out_time_us', '0').replace('N/A', '0') or 0) / 1e6
+        n = max(int(block.get('frame', '0') or 0), round(out_time * self.fps), self.bar.n)
+        speed = block.get('speed', '').strip()
+        if speed and speed != 'N/A':
+            self.bar.set_postfix(speed=speed, refresh=False)
+        self.bar.update(n - self.bar.n)
+        now = time.monotonic()
+        if n != self._last[0]:
+            self._last, self._is_stalled = (n, now), False
+        elif not self._is_stalled and now - self._last[1] > self.stall:
+            self._is_stalled = True
+            Log.warning(f"ffmpeg stalled at frame {n} for {self.stall}s: {self.bar.desc}")
+        if block.get('progress') == 'end':
+            self.bar.refresh()  # last event for `PROGRESS_HOOK`, `leave=False` won't display on close
+            self.close()
+
+    def close(self):
+        self.bar.close()
+
+
+async def _ffmpeg(stream, desc='', duration=0.0, fps=0.0):
+    """run ffmpeg with progress, see `Progress`"""
+    cmd = (
+        stream.global_args(
+            progress='pipe:1', stats=False, stdin=False, loglevel='info' if IS_DEBUG else 'warning', hide_banner=not IS_DEBUG
+        )
+        .overwrite_output()
+        .compile()
+    )
+    progress = Progress(desc or os.path.basename(cmd[-1]), duration, fps)
+    try:
+        p = await run_tail(cmd, output_func=progress).Await()
+    finally:
+        progress.close()
+    status = p.get_status()
+    if status:
+        raise RuntimeError(f"ffmpeg exit {status}: {cmd}")
+
+
+async def smart_cut(from_file: str, to_file: str, info: dict[str, Any], head=None, mid=(0, 0), tail=None):
+    """re-encode the `head` & `tail` GOPs, stream copy `mid`, then concat, see `plan()`"""
+    base = os.path.splitext(to_file)[0]
+    parts = []
+    for i, (part, is_copy) in enumerate(((head, False), (mid, True), (tail, False))):
+        if not part:
+            continue
+        ss, t = part
+        out = f'{base}.part{i}.mp4'
+        kw = copy_gops_args(info, t) if is_copy else encode_args(info, vcodec=ENCODERS[info['codec']], t=t)
+        kw['extra_options'].update(inband_args(info, is_copy))
+        try:
+            await _ffmpeg(
+                ffmpeg.input(from_file, ss=ss).output(filename=out, **kw),
+                f"✂ {os.path.basename(out)}", t, info['fps'])
+        except BaseException:
+            for p in parts + [out]:
+                os.remove(p) if os.path.exists(p) else None
+            raise
+        parts.append(out)
+    await concat(parts, to_file, sum(p[1] for p in (head, mid, tail) if p), info['fps'])
+
+
+async def concat(parts: list[str], to_file: str, duration=0.0, fps=0.0):
+    """join `parts` of the same codec by the concat demuxer without re-encoding, then remove them"""
+    txt = os.path.splitext(to_file)[0] + '.concat.txt'
+    with open(txt, 'w', encoding='utf-8') as f:
+        f.writelines(f"file '{os.path.abspath(p)}'\n" for p in parts)
+    try:
+        await _ffmpeg(
+            ffmpeg.input(txt, f='concat', extra_options={'safe': 0}).output(filename=to_file, c='copy'),
+            f"🔗 {os.path.basename(to_file)}", duration, fps)
+    finally:
+        for p in parts + [txt]:
+            if os.path.exists(p):
+                os.remove(p)
+
+
+def split_segments(start: float, end: float, keys: list[float], segment=FFMPEG_SEGMENT) -> list[tuple[float, float]]:
+    """(ss, t) of segments about `segment` seconds long, cut at the 1st keyframe after each boundary"""
+    cuts = [start]
+    for k in keys:
+        if k - cuts[-1] >= segment and end - k >= segment / 2:
+            cuts.append(k)
+    cuts.append(end)
+    return [(a, b - a) for a, b in zip(cuts, cuts[1:])]
+
+
+async def segment_encode(from_file: str, to_file: str, segments: list[tuple[float, float]], jobs=FFMPEG_JOBS, **kw):
+    """encode `segments` by at most `jobs` ffmpeg at the same time, then concat
+
+    Args:
+        kw: output args of each segment, e.g. `r`
+    """
+    jobs = jobs or max(1, ffmpeg_threads() // 4)
+    threads = max(1, ffmpeg_threads() // min(jobs, len(segments)))
+    sem = asyncio.Semaphore(jobs)
+    base = os.path.splitext(to_file)[0]
+    parts = [f'{base}.seg{i}.mp4' for i in range(len(segments))]
+    Log.info(f"🧩 {len(segments)} segments of {from_file}, {jobs} at a time")
+
+    async def encode(i: int, ss: float, t: float):
+        async with sem:
+            await _ffmpeg(
+                ffmpeg.input(from_file, ss=ss).output(filename=parts[i], t=t, **encode_args(threads=threads), **kw),
+                f"🧩 {os.path.basename(parts[i])}", t, kw.get('r', 0))
+
+    try:
+        await asyncio.gather(*[encode(i, ss, t) for i, (ss, t) in enumerate(segments)])
+    except BaseException:
+        for p in parts:
+            if os.path.exists(p):
+                os.remove(p)
+        raise
+    await concat(parts, to_file, sum(t for _, t in segments), kw.get('r', 0))
+
+
+async def ffmpeg_or_link(from_file: str, to_dir: str, Range='', fps_times=5, name='', virtual=False):
+    """hard link, stream copy, or re-encode the video, whichever is cheapest, see `plan()`
 
     Args:
         from_file (str): input video file
         to_dir (str): output directory, e.g.: `output/AAA/...`
         Range (str): see `range_time()`
         fps_times (int): round to times of fps_times, by default leads to 5,10,15,20 fps...
+        name (str): name of `to_dir/<name>/<name>.mp4`, default is stem of `from_file`
+        virtual (bool): all runs read `.vinput.json`, write it instead of a cut/resampled mp4 unless the source is VFR
 
     Returns:
-        to_file (str): path of final video file
+        to_file (str): path of final video file, missing if virtual
     """
-    kw, is_ffmpeg_from = is_need_ffmpeg(from_file, Range, fps_times)
-    filename = os.path.splitext(os.path.basename(from_file))[0]
+    filename = name or os.path.splitext(os.path.basename(from_file))[0]
     to_dir = os.path.join(to_dir, filename)   # output/xxx
     to_file = os.path.join(to_dir, filename + '.mp4')
     os.makedirs(to_dir, exist_ok=True)
@@ -91,27 +344,66 @@ async def ffmpeg_or_link(from_file: str, to_dir: str, Range='', fps_times=5):
         is_ffmpeg_to = True
 
     if is_ffmpeg_to:
-        if is_ffmpeg_from:
-            p = (
-                ffmpeg.input(from_file)
-                .output(filename=to_file, vcodec='libx264', acodec='aac', **kw)
-                .global_args(hide_banner=not IS_DEBUG)
-                .run_async())
-            poll = None
-            while poll is None:
-                poll = p.poll()
-                await asyncio.sleep(0.2)
-        else:
+        info = probe(from_file)
+        keys = None
+        if Range and info['codec'] in COPY_CODECS:
+            start, duration = [r.total_seconds() for r in range_time(Range)]
+            keys = await asyncio.to_thread(keyframes, from_file, start, start + duration)
+        op, kw = plan(info, Range, fps_times, keys)
+        if virtual and op != 'link' and not info['is_vfr']:
+            start, duration = [r.total_seconds() for r in range_time(Range)] if Range else (0, 0)
+            to_fps = round(info['fps'] / fps_times) * fps_times
+            await asyncio.to_thread(write_vinput, from_file, to_file, info, start, duration, to_fps)
+            return to_file
+        Log.info(f"🎞 {op} {from_file} → {to_file} {kw}")
+        if os.path.exists(vinput_of(to_file)):
+            os.remove(vinput_of(to_file))
+        if op == 'link':
+            if os.path.exists(to_file):
+                os.remove(to_file)
             os.link(from_file, to_file)
+        elif op == 'smart':
+            try:
+                await smart_cut(from_file, to_file, info, **kw)
+            except RuntimeError as e:
+                Log.warning(f"Smart cut failed, re-encode all: {e}")
+                op, kw = 'encode', dict(zip(('ss', 't'), [r.total_seconds() for r in range_time(Range)]))
+        if op == 'copy':
+            ss, t = kw['ss'], kw['t']
+            await _ffmpeg(
+                ffmpeg.input(from_file, ss=ss).output(filename=to_file, **copy_gops_args(info, t)),
+                f"📋 {filename}", t, info['fps'])
+        elif op == 'encode':
+            start = kw.pop('ss', 0)
+            t = span(info, start, kw.pop('t', 0))
+            segments = []
+            if FFMPEG_SEGMENT > 0 and t >= 2 * FFMPEG_SEGMENT:
+                keys = await asyncio.to_thread(keyframes, from_file, start, start + t)
+                segments = split_segments(start, start + t, keys)
+            if len(segments) > 1:
+                await segment_encode(from_file, to_file, segments, **kw)
+            else:
+                if t:
+                    kw['t'] = t  # else unknown duration & no Range: to the end
+                await _ffmpeg(
+                    ffmpeg.input(from_file, ss=start).output(filename=to_file, **encode_args(), **kw),
+                    f"🎞 {filename}", t, kw.get('r', info['fps']))
+    get_catalog().write_sidecar(to_file)
     return to_file
 
 
+def fps_duration(from_file, fps_times=5) -> tuple[int, float]:
+    """fps after `ffmpeg_or_link()`, duration in seconds"""
+    info = probe(from_file)
+    to_fps = round(info['fps'] / fps_times) * fps_times
+    return to_fps, info['duration']
+
+
 def is_need_ffmpeg(from_file, Range='', fps_times=5):
     kw: dict[str, Any] = {}
-    metadata = ffprobe(from_file)
-    from_fps = Fraction(metadata['streams'][0]['r_frame_rate'])
-    to_fps = round(from_fps.numerator / from_fps.denominator / fps_times) * fps_times
-    from_fps = from_fps.numerator / from_fps.denominator
+    info = probe(from_file)
+    from_fps = info['fps']
+    to_fps = round(from_fps / fps_times) * fps_times
     if Range:
         is_ffmpeg = True
         r = [r.total_seconds() for r in range_time(Range)]
@@ -120,5 +412,5 @@ def is_need_ffmpeg(from_file, Range='', fps_times=5):
         is_ffmpeg = True
         kw.update({'r': to_fps})
     if not Range and not is_diff_fps:
-        is_ffmpeg = is_vbr(metadata)
+        is_ffmpeg = info['is_vfr']
     return kw, is_ffmpeg
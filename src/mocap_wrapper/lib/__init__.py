@@ -10,9 +10,16 @@ from .config import *
 
 try:
     from .process import *
+    from .scheduler import *
+    from .pipeline import *
+    from .cache import *
+    from .probe import *
+    from .ingest import *
+    from .shard import *
     from .aria import *
     from .pkg_mgr import *
     from .FFmpeg import *
+    from .vinput import *
     from .data_viewer import *
 except ImportError as e:
     Log.exception(f"\n{__name__=}:", exc_info=e) if IS_DEBUG else None
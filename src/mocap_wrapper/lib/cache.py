@@ -0,0 +1,243 @@
+"""
+content-addressed cache of `.mocap.npz` results per run.
+
+key = fast content hash of input + `--range` + run + run args + run version,
+so identical uploads cost nothing, and different files with the same name never collide.
+Results over `CACHE_GB` are evicted by least recent use, a hit counts as use.
+
+`remove_partial()` cleans up what a cancelled run left in its workdir.
+"""
+
+import os
+import json
+import zipfile
+import hashlib
+import numpy as np
+from pathlib import Path
+from fnmatch import fnmatch
+from platformdirs import user_cache_path
+from typing import Sequence
+from .static import PACKAGE, VERSION, CACHE_GB, res_path
+from .config import CONFIG
+from .logger import getLogger
+
+Log = getLogger(__name__)
+CACHE_DIR = user_cache_path(appname=PACKAGE, ensure_exists=True) / "npz"
+SOURCE = ".mocap.source"  # input key of a workdir, see `workdir()`
+_CHUNK = 1024**2
+
+
+def _blake(*parts) -> str:
+    return hashlib.blake2b(json.dumps(parts).encode(), digest_size=16).hexdigest()
+
+
+def hash_file(path: str | Path, chunk=_CHUNK) -> str:
+    """fast content hash: size + head/middle/tail chunks, whole file if ≤ 4 chunks"""
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        if size <= 4 * chunk:
+            h.update(f.read())
+        else:
+            for offset in (0, size // 2, size - chunk):
+                f.seek(offset)
+                h.update(f.read(chunk))
+    return h.hexdigest()
+
+
+def git_head(Dir: str | Path) -> str:
+    """commit hash of a git repo without spawning git, "" if not a repo"""
+    git = Path(Dir, ".git")
+    try:
+        head = (git / "HEAD").read_text().strip()
+        if not head.startswith("ref:"):
+            return head
+        ref = head.split(" ", 1)[1]
+        if (git / ref).exists():
+            return (git / ref).read_text().strip()
+        for line in (git / "packed-refs").read_text().splitlines():
+            if line.endswith(ref):
+                return line.split(" ", 1)[0]
+    except OSError:
+        pass
+    return ""
+
+
+def run_version(run: str) -> str:
+    """changes when the wrapper, the run script, or the run repo/checkpoints change"""
+    try:
+        script = res_path(module="run", file=f"{run}.py")
+    except ModuleNotFoundError:
+        script = Path(run)
+    Dir = CONFIG.get(run, "")
+    ckpts = Path(Dir, "inputs", "checkpoints")
+    stats = [(str(p), p.stat().st_size, p.stat().st_mtime) for p in sorted(ckpts.rglob("*.ckpt"))] if ckpts.exists() else []
+    return _blake(
+        VERSION,
+        hash_file(script) if script.is_file() else "",
+        git_head(Dir) if Dir else "",
+        stats,
+    )
+
+
+def input_key(input: str | Path, Range="") -> str:
+    return _blake(hash_file(input), Range)
+
+
+def workdir(outdir: str, input: str, key: str) -> str:
+    """name of `outdir/<name>/` for `input`: its stem, or `<stem>-<key[:8]>` if the stem is taken by another input"""
+    stem = os.path.splitext(os.path.basename(input))[0]
+    for name in (stem, f"{stem}-{key[:8]}"):
+        source = Path(outdir, name, SOURCE)
+        if not source.exists() or source.read_text().strip() == key:
+            source.parent.mkdir(parents=True, exist_ok=True)
+            source.write_text(key)
+            return name
+    return name
+
+
+RUN_FILES: dict[str, tuple[str, ...]] = {
+    "wilor": ("_out_*", "*.mesh.npy", "*.mesh.meta.npz", "*_hand*.obj"),
+    "gvhmr": ("preprocess/*", "stride*/*", "hmr4d_results_*", "0_input_video.mp4", "1_incam_*", "2_global_*", "*_3_incam_global_horiz_*"),
+}  # relative paths of files each run writes into its workdir, besides `.mocap.npz`
+
+
+def saved_runs(npz: str | Path) -> set[str]:
+    """runs with `smplx;<run>;` keys in `npz`, empty if it is missing or broken"""
+    try:
+        with np.load(npz, allow_pickle=True) as f:
+            return {k.split(";")[1] for k in f.files if k.startswith("smplx;") and k.count(";") > 1}
+    except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+        return set()
+
+
+def partial_snapshot(Dir: str | Path, run: str) -> dict[str, set[str]]:
+    """files in `Dir` and `smplx;<run>;` keys of each `.mocap.npz` before `run` starts, for `remove_partial()`"""
+    before: dict[str, set[str]] = {"": set()}
+    prefix = f"smplx;{run};"
+    for root, dirs, files in os.walk(Dir):
+        for f in files:
+            path = Path(root, f)
+            before[""].add(path.relative_to(Dir).as_posix())
+            if f.endswith(".mocap.npz"):
+                try:
+                    with np.load(path, allow_pickle=True) as npz:
+                        before[str(path)] = {k for k in npz.files if k.startswith(prefix)}
+                except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+                    pass  # broken before, not ours to remove
+    return before
+
+
+def remove_partial(Dir: str | Path, run: str, before: dict[str, set[str]], keep: Sequence[str | Path] = ()):
+    """remove what a cancelled `run` left in `Dir` after `partial_snapshot()`, once its process exited.
+
+    only new files matching `RUN_FILES` of `run` are removed, e.g. `preprocess/vit_features_0.pt`, so files of other
+    runs on the same video stay. `.mocap.npz` only loses `smplx;<run>;` keys added since, or is removed if half-written.
+    """
+    keep = {os.path.abspath(k) for k in keep}
+    patterns = RUN_FILES.get(run, ())
+    prefix = f"smplx;{run};"
+    removed = []
+    for root, dirs, files in os.walk(Dir):
+        for f in files:
+            path = Path(root, f)
+            rel = path.relative_to(Dir).as_posix()
+            if f == SOURCE or str(path.absolute()) in keep:
+                continue
+            if f.endswith(".mocap.npz"):
+                old = before.get(str(path), set())
+                try:
+                    with np.load(path, allow_pickle=True) as npz:
+                        new = [k for k in npz.files if k.startswith(prefix) and k not in old]
+                        data = {k: npz[k] for k in npz.files if k not in new} if new else {}
+                    if not new:
+                        continue
+                    if data:
+                        np.savez_compressed(path, **data)
+                        continue
+                except (OSError, ValueError, EOFError, zipfile.BadZipFile) as e:
+                    if rel in before[""] and str(path) not in before:
+                        continue
+                    Log.warning(f"Remove broken {path}: {e}")
+            elif rel in before[""] or not any(fnmatch(rel, p) for p in patterns):
+                continue
+            path.unlink(missing_ok=True)
+            removed.append(path)
+    Log.info(f"🧹 Removed {len(removed)} partial files of {run} in {Dir}") if removed else None
+    return removed
+
+
+class ResultCache:
+    def __init__(self, Dir: str | Path = CACHE_DIR, limit_gb: float = CACHE_GB):
+        """
+        Args:
+            limit_gb: >0: `evict()` after each `put()` down to this size
+        """
+        self.dir = Path(Dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.limit = limit_gb * 1024**3
+        self._versions: dict[str, str] = {}
+
+    def key(self, input_key: str, run: str, args: Sequence[str] = ()) -> str:
+        if run not in self._versions:
+            self._versions[run] = run_version(run)
+        return _blake(input_key, run, list(args), self._versions[run])
+
+    def path(self, key: str):
+        return self.dir / f"{key}.npz"
+
+    def get(self, key: str, npz: str | Path) -> bool:
+        """on hit, merge cached keys of the run into `npz`"""
+        cached = self.path(key)
+        if not cached.exists():
+            return False
+        with np.load(cached, allow_pickle=True) as f:
+            data = {k: f[k] for k in f.files}
+        if os.path.exists(npz):
+            with np.load(npz, allow_pickle=True) as f:
+                data = {**{k: f[k] for k in f.files}, **data}
+        np.savez_compressed(npz, **data)
+        os.utime(cached)  # recently used
+        Log.info(f"♻️ Cache hit {cached.name} → {npz}")
+        return True
+
+    def put(self, key: str, npz: str | Path, run: str) -> bool:
+        """store `smplx;<run>;...` keys of `npz`"""
+        if not os.path.exists(npz):
+            return False
+        prefix = f"smplx;{run};"
+        with np.load(npz, allow_pickle=True) as f:
+            data = {k: f[k] for k in f.files if k.startswith(prefix)}
+        if not data:
+            return False
+        tmp = self.dir / f"{key}.tmp.npz"
+        np.savez_compressed(tmp, **data)
+        os.replace(tmp, self.path(key))
+        self.evict(keep=self.path(key)) if self.limit > 0 else None
+        return True
+
+    def evict(self, keep: Path | None = None):
+        """remove least recently used results (by mtime) until the cache fits `limit`
+
+        Returns:
+            removed: paths
+        """
+        files = []
+        for path in self.dir.glob("*.npz"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue  # evicted by another process
+            files.append((st.st_mtime, st.st_size, path))
+        size = sum(s for _, s, _ in files)
+        removed = []
+        for _, s, path in sorted(files, key=lambda f: f[0]):
+            if size <= self.limit:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            size -= s
+            removed.append(path)
+        Log.info(f"🧹 Evicted {len(removed)} cached results over {self.limit / 1024**3:.1f}GB") if removed else None
+        return removed
@@ -0,0 +1,85 @@
+"""
+expand `mocap -i` directories & globs into videos, reject unreadable ones before any GPU work,
+and order them by estimated cost, longest first so the tail of a batch packs well.
+
+```python
+inputs = ingest(['clips/', 'night/**/*.mov', 'a.mp4'])
+```
+"""
+
+import os
+import glob
+from pathlib import Path
+from typing import Any, Sequence
+from .static import CONCURRENT, VIDEO_EXT
+from .probe import ProbeCatalog, get_catalog
+from .logger import getLogger
+
+Log = getLogger(__name__)
+_GLOB = set("*?[")
+
+
+def is_video(path: str | Path):
+    return os.path.splitext(path)[1][1:].lower() in VIDEO_EXT
+
+
+def expand_inputs(inputs: Sequence[str]) -> list[str]:
+    """files of directories (recursive) & globs filtered by `VIDEO_EXT`, explicit files & URLs as is, no duplicates"""
+    paths: list[str] = []
+    for i in inputs:
+        if "://" in i:
+            found = [i]
+        elif os.path.isdir(i):
+            found = sorted(str(Path(root, f)) for root, _, files in os.walk(i) for f in files if is_video(f))
+        elif _GLOB & set(i):
+            found = sorted(f for f in glob.glob(i, recursive=True) if os.path.isfile(f) and is_video(f))
+        else:
+            found = [i]
+        Log.warning(f"No video in {i}") if not found else None
+        paths += found
+    seen = set()
+    return [p for p in paths if not (p in seen or seen.add(p))]
+
+
+def input_cost(info: dict[str, Any]) -> float:
+    """pixels to infer, ∝ GPU time"""
+    return info.get("frames", 0) * info.get("width", 0) * info.get("height", 0)
+
+
+def validate_inputs(paths: Sequence[str], catalog: ProbeCatalog | None = None, workers=CONCURRENT * 2):
+    """
+    Returns:
+        valid: `{path: info}` of readable inputs, URLs with empty info
+        rejected: `{path: reason}`
+    """
+    catalog = catalog or get_catalog()
+    valid: dict[str, dict[str, Any]] = {}
+    rejected: dict[str, str] = {}
+    local = []
+    for p in paths:
+        if "://" in p:
+            valid[p] = {}
+        elif not os.path.isfile(p):
+            rejected[p] = "not found"
+        elif os.path.getsize(p) == 0:
+            rejected[p] = "empty"
+        else:
+            local.append(p)
+    for p, info in catalog.probe_many(local, workers=workers).items():
+        if isinstance(info, Exception):
+            rejected[p] = f"unreadable: {info!r}"[:200]
+        elif is_video(p) and not (info["frames"] and info["width"]):
+            rejected[p] = "no frames"
+        else:
+            valid[p] = info
+    return valid, rejected
+
+
+def ingest(inputs: Sequence[str], catalog: ProbeCatalog | None = None, workers=CONCURRENT * 2) -> list[str]:
+    """`expand_inputs()` & `validate_inputs()` inputs, sorted by `input_cost()` descending"""
+    paths = expand_inputs(inputs)
+    valid, rejected = validate_inputs(paths, catalog, workers)
+    for p, reason in rejected.items():
+        Log.error(f"❌ Skip {p}: {reason}")
+    Log.info(f"📥 {len(valid)}/{len(paths)} inputs from {len(inputs)} args") if len(paths) > 1 else None
+    return sorted(valid, key=lambda p: input_cost(valid[p]), reverse=True)
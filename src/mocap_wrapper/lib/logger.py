@@ -1,12 +1,15 @@
 """
 Use env var `IS_JSON=1`/`LOG=d` to enable features.  
 Log to stderr, Progress to stdout
+
+Set `PROGRESS_HOOK` to also receive `TqdmJson.get_dict()` of every bar in the current context, e.g. for a server job.
 """
 import os
 import sys
 import json
 import logging
 from tqdm import tqdm
+from contextvars import ContextVar
 from typing import Any, Callable, ParamSpec, TypeVar, cast
 _LOG_KEYS = ['LOG', 'LOGLEVEL', 'LOG_LEVEL']
 _LOGLEVEL = [os.environ.get(k) for k in _LOG_KEYS]
@@ -30,6 +33,7 @@ _LEVEL_PREFIX = {
 }
 _PS = ParamSpec("_PS")
 _TV = TypeVar("_TV")
+PROGRESS_HOOK: ContextVar[Callable[[dict[str, Any]], Any] | None] = ContextVar('PROGRESS_HOOK', default=None)
 def is_debug(Log: logging.Logger): return Log.isEnabledFor(logging.DEBUG)
 
 
@@ -52,29 +56,41 @@ class CustomFormatter(logging.Formatter):
 
 
 class TqdmJson(tqdm):
-    def display(self, *args, **kwargs): print(self.get_json(), file=sys.stderr) if IS_JSON else super().display(*args, **kwargs)
+    def display(self, *args, **kwargs):
+        hook = self.hook
+        hook(self.get_dict()) if hook else None
+        print(self.get_json(), file=sys.stderr) if IS_JSON else super().display(*args, **kwargs)
 
     @copy_args(tqdm.__init__)
     def __init__(self, *args, **kwargs):
         if IS_JSON:
             kwargs.setdefault('mininterval', 1.0)
         self.id = id(self)
+        self.hook = PROGRESS_HOOK.get()  # of the context creating the bar, display() may run in other threads
         super().__init__(*args, **kwargs)
 
-    def get_json(self):
+    def get_dict(self):
         fmt = self.format_dict if hasattr(self, 'format_dict') else {}
         rate: float = fmt.get('rate')   # type:ignore
-        eta = int((self.total - self.n) / float(rate)) if rate else None
-        fmt = {'time': float(f"{fmt.get('elapsed'):.1f}"), 'eta': eta, 'rate': rate, 'unit': fmt['unit']}
+        eta = int((self.total - self.n) / float(rate)) if rate and self.total else None
+        fmt = {'time': float(f"{fmt.get('elapsed', 0):.1f}"), 'eta': eta, 'rate': rate, 'unit': fmt.get('unit')}
         obj = {
             'progress': self.id,
             'n': self.n,
             'total': self.total,
             **fmt,
             'msg': repr(self.desc)[1:-1],
+            **(self.postfix_dict if hasattr(self, 'postfix_dict') else {}),
         }
-        obj = {k: v for k, v in obj.items() if v is not None and v != ''}
-        return json.dumps(obj, ensure_ascii=False)
+        return {k: v for k, v in obj.items() if v is not None and v != ''}
+
+    def get_json(self):
+        return json.dumps(self.get_dict(), ensure_ascii=False)
+
+    def set_postfix(self, ordered_dict=None, refresh=True, **kwargs):
+        """also kept as dict for `get_dict()`"""
+        self.postfix_dict = {**(ordered_dict or {}), **kwargs}
+        super().set_postfix(ordered_dict, refresh, **kwargs)
 
 
 tqdm = TqdmJson
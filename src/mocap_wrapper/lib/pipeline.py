@@ -0,0 +1,91 @@
+"""
+staged pipeline with bounded queues between stages, so CPU-bound and GPU-bound stages overlap.
+
+```python
+results = await pipeline(
+    inputs,
+    Stage(transcode, maxsize=LOOKAHEAD),    # runs ahead of inference by LOOKAHEAD items
+    Stage(inference, workers=CONCURRENT),
+    Stage(export),
+)
+```
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Iterable
+from .logger import getLogger, is_debug
+
+Log = getLogger(__name__)
+IS_DEBUG = is_debug(Log)
+_DONE = object()
+
+
+class PipelineError(RuntimeError):
+    """every item failed in some stage, so a caller like `JobQueue` records the job as failed"""
+
+    def __init__(self, errors: list[tuple[Any, Exception]]):
+        self.errors = errors  # (item, exception)
+        super().__init__(f"{len(errors)} items failed: " + "; ".join(f"{i}: {e!r}" for i, e in errors))
+
+
+class Stage:
+    def __init__(
+        self,
+        func: Callable[[Any], Awaitable[Any]],
+        workers=1,
+        maxsize=0,
+    ):
+        """
+        Args:
+            func: `await func(item)`, return None to drop the item
+            workers: concurrent `func` calls
+            maxsize: bounded queue before this stage, 0 is unbounded
+        """
+        self.func = func
+        self.name = getattr(func, "__name__", repr(func))
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name}, workers={self.workers}, maxsize={self.maxsize})"
+
+
+async def _worker(stage: Stage, In: asyncio.Queue, Out: asyncio.Queue | None, results: list, errors: list):
+    while (item := await In.get()) is not _DONE:
+        try:
+            ret = await stage.func(item)
+        except Exception as e:
+            Log.error(f"{stage} drop {item}: {e!r}")
+            Log.exception("", exc_info=e) if IS_DEBUG else None
+            errors.append((item, e))
+            continue
+        if ret is None:
+            continue
+        await Out.put(ret) if Out else results.append(ret)
+
+
+async def pipeline(items: Iterable, *stages: Stage) -> list:
+    """feed `items` through `stages`, returns outputs of the last stage (unordered)
+
+    a failed item is dropped and logged, raise `PipelineError` if items failed and none came out
+    """
+    queues = [asyncio.Queue(maxsize=s.maxsize) for s in stages]
+    results = []
+    errors: list[tuple[Any, Exception]] = []
+    tasks: list[list[asyncio.Task]] = []
+    for i, s in enumerate(stages):
+        Out = queues[i + 1] if i + 1 < len(queues) else None
+        tasks.append([asyncio.create_task(_worker(s, queues[i], Out, results, errors)) for _ in range(s.workers)])
+    try:
+        for item in items:  # ingest
+            await queues[0].put(item)
+        for i, s in enumerate(stages):
+            for _ in range(s.workers):
+                await queues[i].put(_DONE)
+            await asyncio.gather(*tasks[i])
+    except BaseException:
+        [t.cancel() for ts in tasks for t in ts]
+        raise
+    if errors and not results:
+        raise PipelineError(errors)
+    return results
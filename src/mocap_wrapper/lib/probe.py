@@ -0,0 +1,163 @@
+"""
+catalog of ffprobe metadata keyed on (path, size, mtime), so each video is probed once.
+Runners read it from the `<stem>.probe.json` sidecar next to the video, see `docker/lib.py:probe()`.
+
+```python
+info = probe('a.mp4')  # {'fps': 30.0, 'is_vfr': False, 'duration': 10.0, 'width': 1920, 'height': 1080, 'codec': 'h264', 'frames': 300, ...}
+infos = probe_many(glob('*.mp4'))
+```
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from fractions import Fraction
+from functools import cache
+from concurrent.futures import ThreadPoolExecutor
+from platformdirs import user_cache_path
+from typing import Any, Iterable
+from .static import CONCURRENT, PACKAGE
+from .logger import getLogger
+
+Log = getLogger(__name__)
+PROBE_DB = user_cache_path(appname=PACKAGE, ensure_exists=True) / "probe.sqlite"
+SIDECAR = ".probe.json"
+
+
+def sidecar_of(video: str | Path):
+    return os.path.splitext(video)[0] + SIDECAR
+
+
+def _fraction(s: str | None):
+    try:
+        return Fraction(s or "0")
+    except (ValueError, ZeroDivisionError):
+        return Fraction(0)  # e.g. '0/0' of images
+
+
+def parse(metadata: dict[str, Any], path: str | Path, size=0, mtime=0.0) -> dict[str, Any]:
+    """flat info of the 1st video stream from `ffmpeg.probe()`"""
+    streams = metadata.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    if video is None:
+        raise ValueError(f"No video stream in {path}")
+    r, avg = _fraction(video.get("r_frame_rate")), _fraction(video.get("avg_frame_rate"))
+    duration = float(metadata.get("format", {}).get("duration") or video.get("duration") or 0)
+    nb_frames = int(video.get("nb_frames") or 0)
+    rotation = int(float(video.get("tags", {}).get("rotate") or 0))
+    for side in video.get("side_data_list", []):
+        rotation = int(float(side.get("rotation", rotation)))
+    frames = nb_frames or round(duration * float(avg or r))
+    return dict(
+        path=str(path),
+        size=size,
+        mtime=mtime,
+        fps=float(r),
+        r_frame_rate=video.get("r_frame_rate", "0/1"),
+        avg_frame_rate=video.get("avg_frame_rate", "0/1"),
+        is_vfr=r != avg,
+        duration=duration,
+        width=int(video.get("width") or 0),
+        height=int(video.get("height") or 0),
+        rotation=rotation,  # width & height are before rotation
+        codec=video.get("codec_name", ""),
+        pix_fmt=video.get("pix_fmt", ""),
+        profile=video.get("profile", ""),
+        level=int(video.get("level") or 0),
+        frames=frames,
+        is_frames_exact=bool(nb_frames),  # else estimated from duration
+        has_audio=any(s.get("codec_type") == "audio" for s in streams),
+    )
+
+
+class ProbeCatalog:
+    def __init__(self, file: str | Path = PROBE_DB):
+        self.file = str(file)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.file, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS probes (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, info TEXT)"
+        )
+
+    def get(self, path: str | Path) -> dict[str, Any] | None:
+        """cached info if `path` is unchanged, from catalog or sidecar"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime, info FROM probes WHERE path=?", (path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime:
+            return json.loads(row[2])
+        sidecar = sidecar_of(path)
+        if os.path.exists(sidecar):
+            try:
+                with open(sidecar, encoding="utf-8") as f:
+                    info = json.load(f)
+                if info.get("size") == st.st_size and info.get("mtime") == st.st_mtime:
+                    self.put({**info, "path": path})
+                    return info
+            except (OSError, ValueError):
+                pass
+        return None
+
+    def put(self, info: dict[str, Any]):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO probes (path, size, mtime, info) VALUES (?, ?, ?, ?)",
+                (info["path"], info["size"], info["mtime"], json.dumps(info)),
+            )
+
+    def probe(self, path: str | Path) -> dict[str, Any]:
+        """cached info, or run ffprobe once"""
+        info = self.get(path)
+        if info is not None:
+            return info
+        import ffmpeg
+
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        Log.debug(f"ffprobe {path}")
+        info = parse(ffmpeg.probe(path), path, st.st_size, st.st_mtime)
+        self.put(info)
+        return info
+
+    def probe_many(self, paths: Iterable[str | Path], workers=CONCURRENT * 2) -> dict[str, dict[str, Any] | Exception]:
+        """probe uncached `paths` with at most `workers` ffprobe at the same time"""
+        paths = [str(p) for p in paths]
+
+        def _probe(path: str):
+            try:
+                return self.probe(path)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return dict(zip(paths, pool.map(_probe, paths)))
+
+    def write_sidecar(self, path: str | Path):
+        """share info of `path` with runners, see `docker/lib.py:probe()`"""
+        info = self.probe(path)
+        sidecar = sidecar_of(path)
+        tmp = sidecar + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(info, f, indent=1)
+        os.replace(tmp, sidecar)
+        return sidecar
+
+    def close(self):
+        self._db.close()
+
+
+@cache
+def get_catalog():
+    return ProbeCatalog()
+
+
+def probe(path: str | Path):
+    return get_catalog().probe(path)
+
+
+def probe_many(paths: Iterable[str | Path], workers=CONCURRENT * 2):
+    return get_catalog().probe_many(paths, workers=workers)
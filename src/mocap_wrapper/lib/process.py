@@ -1,20 +1,27 @@
 """shared functions:
 
 - run_fg: return (exit status, mixture of stdout & stderr), timeout will auto-kill
-- run_tail: interact with stdin, need kill() before get_status()
+- run_bg: interact with stdin, need kill() before get_status()
 - run_tail: no stdin, long running in bg, need kill() before get_status()
 - Spawn: manually controll details of the process
+- AioSpawn: backend of run_bg/run_tail by env `PROCESS=aio` (default) in event loop, `PROCESS=aexpect` to poll by aexpect
+- Worker: resident `run/<run>.py --server`, take jobs over unix socket
 """
 
 import os
 import re
+import json
+import codecs
 import shlex
+import signal
 import aexpect
 import asyncio
+import tempfile
 from pathlib import Path
-from typing import Literal, Sequence
+from collections import deque
+from typing import Any, Callable, Literal, Sequence
 from .logger import Log, getLogger, is_debug
-from .static import TYPE_RUNS, copy_args, res_path
+from .static import PACKAGE, PROCESS, TIMEOUT_QUATER, TYPE_RUNS, WORKER_IDLE, copy_args, res_path
 from .config import CONFIG
 
 INF = float("inf")
@@ -22,7 +29,9 @@ Log = getLogger(__name__)
 IS_DEBUG = is_debug(Log)
 _RUN_ID = 0
 _INTERVAL = 0.1
+TIMEOUT_KILL = 5  # seconds after SIGTERM to SIGKILL
 _RE_CTRL_ASCII = re.compile(r"\x1b\[[0-9;]*m")
+_RE_NEWLINE = re.compile(r"\r\n|\r|\n")
 
 
 def shlex_quote(args: Sequence[str]):
@@ -74,7 +83,7 @@ async def Await(
         is_inf = False
     no_kill = timeout < 0
     timeout = abs(timeout)
-    while self.is_alive() and (is_inf or no_kill or timer < timeout):
+    while self.is_alive() and (is_inf or timer < timeout):
         await asyncio.sleep(interval)
         # Log.debug(f'{locals()=}\n\n\n\n\n')
         timer += interval
@@ -119,7 +128,218 @@ class Tail(aexpect.Tail, Spawn): ...
 class Expect(aexpect.Expect, Spawn): ...
 
 
-def _aexpect(prefix: str, func):
+class AioSpawn:
+    """`aexpect.Spawn`-like process on `asyncio.create_subprocess_exec`:
+    exit is notified by the event loop's child watcher instead of polling,
+    `get_status()` is the real exit code (128+N if killed by signal N),
+    stdout & stderr are streamed line by line to `output_func`.
+
+    Must be created in a running event loop, see `run_tail()`.
+    """
+
+    def __init__(
+        self,
+        command: str | Sequence[str],
+        termination_func: Callable[[int], object] | None = None,
+        output_func: Callable[[str], object] | None = None,
+        output_prefix="",
+        pass_fds: Sequence[int] = (),
+        encoding: str | None = None,
+        stdin=False,
+        tail=1000,
+        **kwargs,
+    ):
+        """
+        Args:
+            command: str runs in shell, list runs without shell
+            stdin: open stdin for `sendline()`
+            tail: lines of output kept for `get_output()`
+        """
+        self.command = command
+        self.termination_func = termination_func
+        self.output_func = output_func
+        self.output_prefix = output_prefix
+        self.pass_fds = pass_fds
+        self.encoding = encoding or "utf-8"
+        self.is_stdin = stdin
+        self.proc: asyncio.subprocess.Process | None = None
+        self.returncode: int | None = None
+        self.output: deque[str] = deque(maxlen=tail)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(pid={self.get_pid()}, status={self.returncode}, {self.command!r})"
+
+    async def _spawn(self):
+        kw = dict(
+            stdin=asyncio.subprocess.PIPE if self.is_stdin else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True,  # kill() the whole process group
+            pass_fds=self.pass_fds,
+        )
+        if isinstance(self.command, str):
+            return await asyncio.create_subprocess_shell(self.command, **kw)
+        return await asyncio.create_subprocess_exec(*map(str, self.command), **kw)
+
+    def _line(self, line: str):
+        self.output.append(line)
+        if self.output_func:
+            self.output_func(self.output_prefix + line)
+
+    async def _run(self):
+        try:
+            self.proc = await self._spawn()
+        except OSError as e:
+            Log.error(f"{self}: {e}")
+            self.returncode = 127  # command not found
+            return
+        except asyncio.CancelledError:
+            self.returncode = self.returncode or 128 + signal.SIGTERM
+            raise
+        assert self.proc.stdout
+        buf = ""
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")  # chars split across chunks
+        while chunk := await self.proc.stdout.read(2**16):
+            *lines, buf = _RE_NEWLINE.split(buf + decoder.decode(chunk))
+            for line in lines:
+                self._line(line)
+        buf += decoder.decode(b"", final=True)
+        self._line(buf) if buf else None
+        code = await self.proc.wait()
+        self.returncode = 128 - code if code < 0 else code
+        if self.termination_func:
+            self.termination_func(self.returncode)
+
+    def get_pid(self):
+        return self.proc.pid if self.proc else None
+
+    def is_alive(self):
+        return self.returncode is None
+
+    def get_status(self):
+        return self.returncode
+
+    @property
+    def status(self):
+        return self.get_status()
+
+    def get_output(self):
+        return "\n".join(self.output)
+
+    def kill(self, sig=signal.SIGKILL):
+        if not self.is_alive():
+            return
+        if self.proc is None:  # not spawned yet, never will be
+            self._task.cancel()
+            self.returncode = 128 + sig
+            return
+        try:
+            os.killpg(self.proc.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def sendline(self, line=""):
+        if not (self.proc and self.proc.stdin):
+            raise BrokenPipeError(f"{self}: no stdin, use `run_bg()`")
+        self.proc.stdin.write((line + "\n").encode(self.encoding))
+
+    def close(self):
+        self.kill()
+
+    async def wait(self, timeout: int | float | None = None) -> bool:
+        """wait for the exit without polling
+
+        Returns:
+            exited: False if still running after `timeout` seconds
+        """
+        await asyncio.wait([self._task], timeout=timeout)
+        return not self.is_alive()
+
+    async def Await(self, timeout: int | float | None = None, interval=_INTERVAL):
+        """same as `Await()` without polling, `interval` is ignored"""
+        done = asyncio.shield(self._task)
+        if timeout is None:
+            await done
+            return self
+        no_kill = timeout < 0
+        try:
+            await asyncio.wait_for(done, abs(timeout))
+        except asyncio.TimeoutError:
+            if no_kill:
+                Log.warning(f"Still running after {timeout=}: {self}")
+                return self
+            self.kill(signal.SIGTERM)
+            self.kill() if not await self.wait(TIMEOUT_KILL) else None
+            await self.wait()
+        if self.get_status() == 128 + 9:  # SIGKILL
+            Log.error(
+                "The process is forced to be terminated by the system (-9), which may be caused by insufficient memory (OOM). Please check the system memory or issue to developer. 进程被系统强制终止（-9），可能是内存不足（OOM）导致，请检查系统内存或联系开发者。"
+            )
+        return self
+
+
+def killpg(p: "aexpect.Spawn | AioSpawn", sig=signal.SIGTERM):
+    """kill `p` with its children, e.g. runner under `pixi run`"""
+    if isinstance(p, AioSpawn):
+        return p.kill(sig)
+    pid = p.get_pid()
+    if pid is None or not p.is_alive():
+        return
+    try:
+        pgid = os.getpgid(pid)
+        if pgid == os.getpgid(0):
+            return p.kill(sig)  # same group as us
+        os.killpg(pgid, sig)
+    except (ProcessLookupError, PermissionError):
+        p.kill(sig)
+
+
+async def wait_exit(p: "aexpect.Spawn | AioSpawn", timeout=TIMEOUT_KILL):
+    """after `killpg()`, wait until `p` exits, SIGKILL its group if it takes over `timeout` seconds
+
+    Returns:
+        exited: False if `p` still runs after SIGKILL too
+    """
+    for sig in (None, signal.SIGKILL):
+        killpg(p, sig) if sig else None
+        if isinstance(p, AioSpawn):
+            if await p.wait(timeout):
+                return True
+            continue
+        timer = 0.0
+        while p.is_alive() and timer < timeout:
+            await asyncio.sleep(_INTERVAL)
+            timer += _INTERVAL
+        if not p.is_alive():
+            return True
+    Log.error(f"{p} still alive after SIGKILL")
+    return False
+
+
+async def stop(p: "aexpect.Spawn | AioSpawn", cleanup: Callable[[], Any] | None = None):
+    """kill `p` with its children, once it exited run `cleanup()` in a thread, e.g. `remove_partial()`"""
+    killpg(p)
+    if await wait_exit(p) and cleanup:
+        await asyncio.to_thread(cleanup)
+
+
+def _is_aio():
+    if PROCESS != "aio":
+        return False
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False  # called from sync code
+
+
+def _aexpect(prefix: str, func, aio: dict | None = None):
+    """
+    Args:
+        aio: kwargs of `AioSpawn`, use it instead of `func` if `_is_aio()`
+    """
+
     def wrapper(commands: str | Sequence[str], *args, **kwargs):
         global _RUN_ID
         cmd = commands if isinstance(commands, str) else shlex_quote(commands)
@@ -138,7 +358,10 @@ def _aexpect(prefix: str, func):
                 )
 
             kwargs.setdefault("output_func", _Log_info)
-        ret = func(command=cmd, *args, **kwargs)
+        if aio is not None and _is_aio():
+            ret = AioSpawn(commands, *args, **kwargs, **aio)
+        else:
+            ret = func(command=cmd, *args, **kwargs)
         _RUN_ID += 1
         return ret
 
@@ -151,13 +374,13 @@ def run_fg(cmds: Sequence[str], *args, **kwargs) -> tuple[int | None, str | None
 
 
 @copy_args(aexpect.run_bg)
-def run_bg(cmds: str | Sequence[str], *args, **kwargs) -> Expect:
-    return _aexpect("bg", aexpect.run_bg)(cmds, *args, **kwargs)
+def run_bg(cmds: str | Sequence[str], *args, **kwargs) -> Expect | AioSpawn:
+    return _aexpect("bg", aexpect.run_bg, aio=dict(stdin=True))(cmds, *args, **kwargs)
 
 
 @copy_args(aexpect.run_tail)
-def run_tail(cmds: str | Sequence[str], *args, **kwargs) -> Tail:
-    return _aexpect("", aexpect.run_tail)(cmds, *args, **kwargs)
+def run_tail(cmds: str | Sequence[str], *args, **kwargs) -> Tail | AioSpawn:
+    return _aexpect("", aexpect.run_tail, aio={})(cmds, *args, **kwargs)
 
 
 async def unzip(
@@ -201,15 +424,10 @@ async def unzip(
     return p
 
 
-async def Python(
+def pixi_python(
     arg0: str | Path = "", *args: str, run: TYPE_RUNS | Path, env="default"
 ):
-    """pixi run -e=env -- python args...
-
-    if `arg0` is Path: pixi run -e=env -- python arg0 args...
-    else if `arg0` is str and run==gvhmr: pixi run -e=env -- python ...run/gvhmr.py args...
-    """
-    # TODO: run at same time if vram > 6gb, or 1 by 1 based if vram < 4gb
+    """cmd of `pixi run -e=env -- python args...`, see `Python()`"""
     _arg0 = [str(arg0)] if arg0 else []
     py = (
         _arg0
@@ -219,7 +437,7 @@ async def Python(
     RUN = str(run) if isinstance(run, Path) else CONFIG[run]
     _env = [] if not env or env == "default" else [f"-e={env}"]
     _args = [*py, *args]
-    cmd = [
+    return [
         "pixi",
         "run",
         "-q",
@@ -230,6 +448,122 @@ async def Python(
         "python",
         *_args,
     ]
-    if "--help" in _args or "-h" in _args:
+
+
+class Worker:
+    """resident `run/<run>.py --server`, loads models once and takes jobs over unix socket.
+
+    The socket path is stable, so later `mocap` calls reuse a worker until it exits after `idle` seconds.
+    Each job carries the caller's cwd, so relative `--input`/`-o` resolve as without a worker.
+
+    `lock` runs 1 job at a time per worker, while `Scheduler` still reserves VRAM of each waiting job, so a budget
+    that fits 2 jobs of 1 run lets the 2nd queue here instead of a job of another run. Set `[vram]` or
+    `CONCURRENT` accordingly, or `WORKER_IDLE=0` for parallel runners.
+    """
+
+    _WORKERS: dict[tuple[str, str], "Worker"] = {}
+
+    def __init__(self, run: TYPE_RUNS, env="default", idle=WORKER_IDLE):
+        self.run = run
+        self.env = env
+        self.idle = idle
+        self.sock = os.path.join(tempfile.gettempdir(), f"{PACKAGE}-{run}-{env}.sock")
+        self.process: Expect | AioSpawn | None = None
+        self.lock = asyncio.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.run}, sock={self.sock})"
+
+    @classmethod
+    def get(cls, run: TYPE_RUNS, env="default"):
+        key = (run, env)
+        if key not in cls._WORKERS:
+            cls._WORKERS[key] = cls(run, env)
+        return cls._WORKERS[key]
+
+    def is_alive(self):
+        if self.process:
+            return self.process.is_alive()
+        return os.path.exists(self.sock)  # started by previous `mocap`
+
+    async def start(self, timeout=TIMEOUT_QUATER):
+        if self.is_alive():
+            return
+        cmd = pixi_python(
+            "--server", self.sock, "--idle", str(self.idle), run=self.run, env=self.env
+        )
+        self.process = run_bg(cmd, output_prefix="", output_func=print)
+        timer = 0.0
+        while not os.path.exists(self.sock) and self.process.is_alive():
+            await asyncio.sleep(_INTERVAL)
+            timer += _INTERVAL
+            if timer > timeout:
+                self.process.kill()
+                break
+
+    async def _send(self, argv: Sequence[str]) -> dict:
+        reader, writer = await asyncio.open_unix_connection(self.sock)
+        try:
+            job = {"argv": list(argv), "cwd": os.getcwd()}
+            writer.write((json.dumps(job) + "\n").encode())
+            await writer.drain()
+            line = await reader.readline()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+        if not line:
+            raise ConnectionResetError(f"{self} exited before reply")
+        return json.loads(line)
+
+    async def __call__(self, *argv: str, cleanup: Callable[[], Any] | None = None) -> int:
+        """Returns: exit status of the job. When cancelled, the worker is killed to stop the job, see `stop()`
+
+        Args:
+            cleanup: after the killed worker exited, skipped if the worker is not ours, its job goes on
+        """
+        async with self.lock:
+            for retry in (True, False):
+                await self.start()
+                try:
+                    ret = await self._send(argv)
+                    break
+                except asyncio.CancelledError:
+                    if self.process:
+                        process, self.process = self.process, None
+                        await asyncio.shield(stop(process, cleanup))
+                    else:
+                        Log.warning(f"{self} not started by us, its job goes on, so do its files")
+                    raise
+                except (ConnectionError, FileNotFoundError) as e:
+                    Log.warning(f"{self}: {e}") if not retry else None
+                    self.process = None
+                    os.remove(self.sock) if os.path.exists(self.sock) else None
+                    ret = {"status": 1, "error": repr(e)}
+        if ret.get("error"):
+            Log.error(f"{self}: {ret['error']}")
+        return ret.get("status", 1)
+
+
+async def Python(
+    arg0: str | Path = "", *args: str, run: TYPE_RUNS | Path, env="default", cleanup: Callable[[], Any] | None = None
+):
+    """pixi run -e=env -- python args...
+
+    if `arg0` is Path: pixi run -e=env -- python arg0 args...
+    else if `arg0` is str and run==gvhmr: pixi run -e=env -- python ...run/gvhmr.py args...
+    else if env `WORKER_IDLE` > 0: send args to resident `Worker`, return exit status
+
+    When cancelled, the runner and its children are killed, `cleanup()` runs once they exited.
+    """
+    cmd = pixi_python(arg0, *args, run=run, env=env)
+    if "--help" in cmd or "-h" in cmd:
         return os.system(" ".join(cmd))
-    return await run_tail(cmd, output_prefix="", output_func=print).Await()
+    if WORKER_IDLE > 0 and not isinstance(run, Path) and not isinstance(arg0, Path):
+        _arg0 = [str(arg0)] if arg0 else []
+        return await Worker.get(run, env)(*_arg0, *args, cleanup=cleanup)
+    p = run_tail(cmd, output_prefix="", output_func=print)
+    try:
+        return await p.Await()
+    except asyncio.CancelledError:
+        await asyncio.shield(stop(p, cleanup))  # the scheduler budget is freed once the VRAM is
+        raise
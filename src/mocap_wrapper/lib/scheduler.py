@@ -0,0 +1,185 @@
+"""
+pack (input, run) jobs by their VRAM/RAM cost, so they run at the same time without exceeding the budget.
+Higher `priority` jobs go first, and preempt running lower ones if the budget is full; preempted jobs run again later.
+
+```python
+scheduler = Scheduler()  # budget: env `VRAM` > nvidia-smi > RAM
+await asyncio.gather(*[
+    scheduler.run(m, partial(Python, "--input", video, run=m), key=video)
+    for m in ("wilor", "gvhmr")
+])
+```
+"""
+
+import os
+import time
+import shutil
+import asyncio
+import subprocess
+from collections import Counter
+from functools import cache
+from contextlib import asynccontextmanager, nullcontext
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+from .static import CONCURRENT, RUNS_VRAM_GB
+from .config import CONFIG
+from .logger import getLogger
+
+Log = getLogger(__name__)
+_TV = TypeVar("_TV")
+_GB = 1024**3
+
+
+@cache
+def get_budget_gb() -> float:
+    """env `VRAM` (GB) > total VRAM of the 1st GPU > total RAM > 0 (run 1 by 1)"""
+    env = os.environ.get("VRAM", "")
+    if env:
+        return float(env)
+    if shutil.which("nvidia-smi"):
+        cmd = ["nvidia-smi", "--query-gpu=memory.total", "--format=csv,noheader,nounits"]
+        p = subprocess.run(cmd, capture_output=True, text=True)
+        mib = p.stdout.split()
+        if p.returncode == 0 and mib:
+            return float(mib[0]) / 1024
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / _GB
+    except (AttributeError, ValueError, OSError):
+        return 0.0
+
+
+class Slot:
+    """budget held by a running job"""
+
+    def __init__(self, run: str, cost: float, priority=0):
+        self.run = run
+        self.cost = cost
+        self.priority = priority
+        self.start = time.monotonic()
+        self.task: asyncio.Future | None = None
+        self.is_preempted = False
+        self.is_released = False
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.run}, cost={self.cost}, priority={self.priority})"
+
+
+class Scheduler:
+    def __init__(
+        self,
+        budget: float | None = None,
+        costs: dict[str, float] = {},
+        concurrent: int = CONCURRENT,
+    ):
+        """
+        Args:
+            budget: GB of VRAM/RAM, default `get_budget_gb()`
+            costs: GB per run, default `RUNS_VRAM_GB` updated by `[vram]` in config.toml
+            concurrent: max running jobs, default env `CONCURRENT`
+        """
+        self.budget = get_budget_gb() if budget is None else budget
+        self.costs: dict[str, float] = {**RUNS_VRAM_GB, **CONFIG.get("vram", {}), **costs}
+        self.concurrent = max(1, concurrent)
+        self.used = 0.0
+        self.running = 0
+        self._cond = asyncio.Condition()
+        self._keys: dict[Hashable, asyncio.Lock] = {}
+        self._slots: set[Slot] = set()
+        self._waiting: Counter[int] = Counter()  # priority: count
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(used={self.used:.1f}/{self.budget:.1f}GB, running={self.running}/{self.concurrent})"
+
+    def cost(self, run: str) -> float:
+        """unknown run costs as much as the most expensive one"""
+        return float(self.costs.get(run, max(self.costs.values(), default=0)))
+
+    def is_fit(self, cost: float, used: float | None = None, running: int | None = None):
+        used = self.used if used is None else used
+        running = self.running if running is None else running
+        if running == 0:
+            return True  # a job larger than budget still runs, but alone
+        return running < self.concurrent and used + cost <= self.budget
+
+    def release(self, slot: Slot):
+        """give back budget of `slot` at once, idempotent"""
+        if slot.is_released:
+            return
+        slot.is_released = True
+        self._slots.discard(slot)
+        self.used -= slot.cost
+        self.running -= 1
+
+    def preempt(self, cost: float, priority: int):
+        """cancel lowest & newest jobs below `priority` until `cost` fits, only if it would fit"""
+        victims = sorted(
+            (s for s in self._slots if s.priority < priority and s.task),
+            key=lambda s: (s.priority, -s.start),
+        )
+        used, running, n = self.used, self.running, 0
+        while not self.is_fit(cost, used, running) and n < len(victims):
+            used -= victims[n].cost
+            running -= 1
+            n += 1
+        if not self.is_fit(cost, used, running):
+            return []
+        for s in victims[:n]:
+            Log.warning(f"⏏ Preempt {s} for {priority=}")
+            s.is_preempted = True
+            self.release(s)
+            s.task.cancel()  # type: ignore
+        return victims[:n]
+
+    @asynccontextmanager
+    async def acquire(self, cost: float, priority=0, run=""):
+        async with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while not (self.is_fit(cost) and priority >= max(self._waiting)):
+                    if priority >= max(self._waiting) and self.preempt(cost, priority):
+                        continue
+                    await self._cond.wait()
+            finally:
+                self._waiting[priority] -= 1
+                self._waiting += Counter()  # drop zeros
+                self._cond.notify_all()
+            slot = Slot(run, cost, priority)
+            self._slots.add(slot)
+            self.used += cost
+            self.running += 1
+        Log.debug(f"⏵ {cost=}GB {self}")
+        try:
+            yield slot
+        finally:
+            async with self._cond:
+                self.release(slot)
+                self._cond.notify_all()
+
+    async def run(
+        self,
+        run: str,
+        func: Callable[[], Awaitable[_TV]],
+        key: Hashable = None,
+        cost: float | None = None,
+        priority=0,
+    ) -> _TV:
+        """await `func()` once budget allows.
+
+        Args:
+            run: name of runner, to look up `cost`
+            key: jobs with same key run 1 by 1, e.g. runs on same video write the same `.mocap.npz`
+            cost: override GB of this job
+            priority: higher runs first, and preempts lower jobs when budget is full.
+                `func()` of a preempted job is cancelled, and awaited again when budget allows
+        """
+        cost = self.cost(run) if cost is None else cost
+        lock: Any = nullcontext() if key is None else self._keys.setdefault(key, asyncio.Lock())
+        async with lock:
+            while True:
+                async with self.acquire(cost, priority, run) as slot:
+                    slot.task = asyncio.ensure_future(func())
+                    try:
+                        return await slot.task
+                    except asyncio.CancelledError:
+                        if not slot.is_preempted:
+                            raise
+                Log.info(f"🔁 Retry preempted {slot}")
@@ -0,0 +1,297 @@
+"""
+split long videos into overlapping time shards that run in parallel, then stitch their `.mocap.npz`.
+
+```python
+shards = plan_shards(duration=1800, shard=300, overlap=2)  # [(0, 302), (300, 302), ...] in seconds
+npz = stitch([('a-shard0.mocap.npz', 0), ('a-shard1.mocap.npz', 9000)], 'a.mocap.npz', overlap=60)
+```
+"""
+
+import os
+import numpy as np
+from pathlib import Path
+from collections import Counter
+from typing import Sequence
+from .logger import getLogger
+
+Log = getLogger(__name__)
+IOU_MATCH = 0.3  # min mean bbox IoU in overlap to treat 2 tracks as the same person/hand
+_ROTS = ("global_orient", "body_pose", "hand_pose")
+_CAM = "cam@"
+_T_Track = dict[str, list[tuple[int, np.ndarray]]]  # prop: [(begin, array), ...]
+
+
+def plan_shards(duration: float, shard: float, overlap: float = 2, start: float = 0):
+    """
+    Args:
+        duration: seconds of video (or `--range`) to process
+        shard: seconds per shard, excluding overlap
+        overlap: seconds shared by 2 neighbor shards, to match IDs & blend
+
+    Returns:
+        shards: `[(start, duration), ...]` in seconds, for `--range=start+duration`
+    """
+    if shard <= 0 or duration <= shard + overlap:
+        return [(start, duration)]
+    shards = []
+    t = 0.0
+    while t < duration:
+        if duration - t < shard / 2 and shards:  # too short, extend last shard
+            s0, d0 = shards[-1]
+            shards[-1] = (s0, start + duration - s0)
+            break
+        shards.append((start + t, min(shard + overlap, duration - t)))
+        t += shard
+    return shards
+
+
+def split_key(key: str):
+    """`smplx;<run>;<who>;<begin>;<prop>` → (run, who, begin, prop)"""
+    _, run, who, begin, prop = key.split(";", 4)
+    return run, who, int(begin), prop
+
+
+def _is_per_frame(props: dict[str, np.ndarray]) -> set[str]:
+    """props whose 1st dim is the frame count of their track"""
+    lens = Counter(v.shape[0] for v in props.values() if v.ndim >= 2)
+    if not lens:
+        return set()
+    L = lens.most_common(1)[0][0]
+    return {k for k, v in props.items() if v.ndim >= 1 and v.shape[0] == L}
+
+
+def load_tracks(npz: str | Path, offset=0):
+    """
+    Returns:
+        tracks: `{(run, who): {prop: [(begin + offset, array)]}}` of per-frame props
+        static: `{(run, who): {prop: array}}` e.g. betas of gvhmr
+        other: keys not in `smplx;<run>;<who>;<begin>;<prop>` format
+    """
+    groups: dict[tuple[str, str, int], dict[str, np.ndarray]] = {}
+    other: dict[str, np.ndarray] = {}
+    with np.load(npz, allow_pickle=True) as f:
+        for k in f.files:
+            try:
+                run, who, begin, prop = split_key(k)
+            except ValueError:
+                other[k] = f[k]
+                continue
+            groups.setdefault((run, who, begin), {})[prop] = f[k]
+    tracks: dict[tuple[str, str], _T_Track] = {}
+    static: dict[tuple[str, str], dict[str, np.ndarray]] = {}
+    for (run, who, begin), props in groups.items():
+        per_frame = _is_per_frame(props)
+        for prop, v in props.items():
+            if prop in per_frame:
+                tracks.setdefault((run, who), {}).setdefault(prop, []).append((begin + offset, v))
+            else:
+                static.setdefault((run, who), {})[prop] = v
+    return tracks, static, other
+
+
+def _boxes(track: _T_Track) -> dict[int, np.ndarray]:
+    return {b + i: box for b, arr in track.get("bbox", []) for i, box in enumerate(arr)}
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU of xyxy boxes, shape (..., 4)"""
+    x1, y1 = np.maximum(a[..., 0], b[..., 0]), np.maximum(a[..., 1], b[..., 1])
+    x2, y2 = np.minimum(a[..., 2], b[..., 2]), np.minimum(a[..., 3], b[..., 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-9)
+
+
+def _kind(who: str):
+    """`person3` → (`person`, ``), `hand2R` → (`hand`, `R`)"""
+    head = who.rstrip("LR")
+    return head.rstrip("0123456789"), who[len(head):]
+
+
+def match_ids(old: dict[tuple[str, str], _T_Track], new: dict[tuple[str, str], _T_Track], lo: int, hi: int):
+    """greedy match tracks of `new` shard to `old` by mean bbox IoU in frames `[lo, hi)`
+
+    Returns:
+        `{new (run, who): old (run, who)}`
+    """
+    pairs = []
+    for n, n_track in new.items():
+        if n[1].startswith(_CAM):
+            continue
+        n_boxes = _boxes(n_track)
+        for o, o_track in old.items():
+            if o[0] != n[0] or _kind(o[1]) != _kind(n[1]) or o[1].startswith(_CAM):
+                continue
+            o_boxes = _boxes(o_track)
+            frames = [t for t in range(lo, hi) if t in n_boxes and t in o_boxes]
+            if not frames:
+                continue
+            score = float(iou(np.stack([o_boxes[t] for t in frames]), np.stack([n_boxes[t] for t in frames])).mean())
+            if score >= IOU_MATCH:
+                pairs.append((score, n, o))
+    matched: dict[tuple[str, str], tuple[str, str]] = {}
+    for score, n, o in sorted(pairs, reverse=True):
+        if n not in matched and o not in matched.values():
+            matched[n] = o
+    return matched
+
+
+def _qmul(a: np.ndarray, b: np.ndarray):
+    """hamilton product of wxyz quaternions"""
+    aw, ax, ay, az = np.moveaxis(a, -1, 0)
+    bw, bx, by, bz = np.moveaxis(b, -1, 0)
+    return np.stack([
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    ], axis=-1)
+
+
+def _qconj(q: np.ndarray):
+    return q * np.array([1, -1, -1, -1], dtype=q.dtype)
+
+
+def _qrot(q: np.ndarray, v: np.ndarray):
+    """rotate vectors `v` (..., 3) by quaternion `q` (4,)"""
+    p = np.concatenate([np.zeros((*v.shape[:-1], 1), dtype=v.dtype), v], axis=-1)
+    return _qmul(_qmul(q, p), _qconj(q))[..., 1:]
+
+
+def _nlerp(a: np.ndarray, b: np.ndarray, w: np.ndarray):
+    """`w` weight of `a`, broadcast on frames"""
+    b = np.where((a * b).sum(-1, keepdims=True) < 0, -b, b)
+    q = w * a + (1 - w) * b
+    return q / np.maximum(np.linalg.norm(q, axis=-1, keepdims=True), 1e-9)
+
+
+def _at(entries: list[tuple[int, np.ndarray]], lo: int, hi: int):
+    """frames `[lo, hi)` of the entry covering them, or None"""
+    for begin, arr in entries:
+        if begin <= lo and hi <= begin + len(arr):
+            return arr[lo - begin: hi - begin]
+    return None
+
+
+def align_world(old: _T_Track, new: _T_Track, lo: int, hi: int):
+    """rigid transform (quat `d`, transl `c`) from world of `new` shard to world of `old` shard, by overlap frames.
+
+    Each gvhmr shard starts its own gravity-aligned world at its 1st frame, so heading & position drift between shards.
+    """
+    qo, qn = _at(old.get("global_orient", []), lo, hi), _at(new.get("global_orient", []), lo, hi)
+    to, tn = _at(old.get("transl", []), lo, hi), _at(new.get("transl", []), lo, hi)
+    if any(x is None for x in (qo, qn, to, tn)) or qo.shape[-1] != 4 or to.shape[-1] != 3:  # type: ignore
+        return None
+    d = _qmul(qo, _qconj(qn))  # type: ignore
+    d = np.where((d * d[:1]).sum(-1, keepdims=True) < 0, -d, d).mean(0)
+    d /= np.linalg.norm(d)
+    c = (to - _qrot(d, tn)).mean(0)  # type: ignore
+    return d, c
+
+
+def transform_world(track: _T_Track, d: np.ndarray, c: np.ndarray, is_cam=False):
+    """apply `align_world()` to person (world pose) or `cam@person` (world→camera extrinsics)"""
+    if is_cam:
+        rots = [(b, _qmul(q, _qconj(d))) for b, q in track.get("global_orient", [])]
+        track["transl"] = [(b, t - _qrot(q, c)) for (b, t), (_, q) in zip(track.get("transl", []), rots)]
+        track["global_orient"] = rots
+    else:
+        track["global_orient"] = [(b, _qmul(d, q)) for b, q in track.get("global_orient", [])]
+        track["transl"] = [(b, _qrot(d, t) + c) for b, t in track.get("transl", [])]
+
+
+def blend(a: tuple[int, np.ndarray], b: tuple[int, np.ndarray], is_quat=False):
+    """join 2 entries of a prop, cross-fading frames where both exist. `a` begins first"""
+    (ba, va), (bb, vb) = a, b
+    end = max(ba + len(va), bb + len(vb))
+    out = np.empty((end - ba, *va.shape[1:]), dtype=np.result_type(va, vb))
+    out[: len(va)] = va
+    out[bb - ba: bb - ba + len(vb)] = vb
+    lo, hi = bb, min(ba + len(va), bb + len(vb))
+    if hi > lo and np.issubdtype(out.dtype, np.floating):
+        n = hi - lo
+        w = np.linspace(1, 0, n + 2)[1:-1].reshape(-1, *[1] * (va.ndim - 1))  # weight of a
+        A, B = va[lo - ba: hi - ba], vb[:n]
+        out[lo - ba: hi - ba] = _nlerp(A, B, w) if is_quat else w * A + (1 - w) * B
+    return ba, out
+
+
+def merge(old: _T_Track, new: _T_Track):
+    """merge entries of `new` into `old` in place, overlapping/adjacent entries are blended"""
+    for prop, entries in new.items():
+        is_quat = prop in _ROTS
+        olds = old.setdefault(prop, [])
+        for b in entries:
+            for i, a in enumerate(olds):
+                if a[0] <= b[0] <= a[0] + len(a[1]):
+                    olds[i] = blend(a, b, is_quat=is_quat and a[1].shape[-1] == 4)
+                    break
+            else:
+                olds.append(b)
+        olds.sort(key=lambda e: e[0])
+
+
+def _rename(who: str, n: int):
+    kind, LR = _kind(who.removeprefix(_CAM))
+    return f"{_CAM if who.startswith(_CAM) else ''}{kind}{n}{LR}"
+
+
+def stitch(parts: Sequence[tuple[str | Path, int]], to: str | Path, overlap: int):
+    """stitch `.mocap.npz` of shards into `to`
+
+    Args:
+        parts: `[(npz, offset), ...]`, offset is the 1st frame of the shard in the whole video
+        overlap: frames shared by 2 neighbor shards
+
+    Returns:
+        to: path of stitched `.mocap.npz`
+    """
+    tracks: dict[tuple[str, str], _T_Track] = {}
+    static: dict[tuple[str, str], dict[str, np.ndarray]] = {}
+    other: dict[str, np.ndarray] = {}
+    count: Counter[tuple[str, str]] = Counter()  # next id of (run, kind)
+    for npz, offset in parts:
+        if not os.path.exists(npz):
+            Log.warning(f"Missing shard {npz}")
+            continue
+        new, new_static, new_other = load_tracks(npz, offset)
+        other = {**new_other, **other}
+        matched = match_ids(tracks, new, offset, offset + overlap)
+        names: dict[tuple[str, str], tuple[str, str]] = {}
+        for key in sorted(k for k in new if not k[1].startswith(_CAM)):
+            if key in matched:
+                names[key] = matched[key]
+            else:
+                run, who = key
+                kind = (run, _kind(who)[0])
+                names[key] = (run, _rename(who, count[kind]))
+                count[kind] += 1
+        for key in new:  # cam@person follows person
+            if key[1].startswith(_CAM):
+                person = names.get((key[0], key[1].removeprefix(_CAM)))
+                names[key] = (key[0], _CAM + person[1]) if person else key
+        worlds = {
+            key: align_world(tracks[matched[key]], new[key], offset, offset + overlap) for key in matched
+        }  # before any transform
+        for key, track in new.items():
+            is_cam = key[1].startswith(_CAM)
+            dc = worlds.get((key[0], key[1].removeprefix(_CAM)))
+            if dc is not None:
+                transform_world(track, *dc, is_cam=is_cam)
+            merge(tracks.setdefault(names[key], {}), track)
+        for key, props in new_static.items():
+            name = names.get(key, key)
+            static[name] = {**props, **static.get(name, {})}  # keep values of the 1st shard
+    data = dict(other)
+    for (run, who), track in tracks.items():
+        for prop, entries in track.items():
+            for begin, arr in entries:
+                data[f"smplx;{run};{who};{begin};{prop}"] = arr
+    for (run, who), props in static.items():
+        begin = min((b for entries in tracks.get((run, who), {}).values() for b, _ in entries), default=0)
+        for prop, v in props.items():
+            data[f"smplx;{run};{who};{begin};{prop}"] = v
+    np.savez_compressed(to, **data)
+    Log.info(f"🧵 Stitched {len(parts)} shards → {to}")
+    return to
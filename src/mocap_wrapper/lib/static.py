@@ -33,7 +33,30 @@ RUNS_REPO: dict[TYPE_RUNS, str] = {
     "gvhmr": "GVHMR",
     "dynhamr": "Dyn-HaMR",
 }
+RUNS_VRAM_GB: dict[TYPE_RUNS, float] = {
+    "wilor": 2.5,
+    "gvhmr": 3,
+    "dynhamr": 6,
+}  # peak VRAM per run, override by `[vram]` table in config.toml
+RUNS_VINPUT: tuple[TYPE_RUNS, ...] = ("wilor",)  # runs that read `.vinput.json` instead of a cut mp4
+VIDEO_EXT = sorted(set(
+    "webm,mkv,flv,vob,ogv,ogg,drc,gifv,mng,avi,mov,qt,wmv,yuv,rm,rmvb,viv,asf,amv,mp4,m4p,m4v,mpg,mp2,mpeg,mpe,mpv,m2v,svi,3gp,3g2,mxf,roq,nsv,f4v,f4p,f4a,f4b".split(",")
+))  # same as `docker/lib.py`, which the host can't import, see `test_video_ext`
 CONCURRENT = int(os.environ.get("CONCURRENT", 3))
+SERVER_JOBS = int(os.environ.get("SERVER_JOBS", CONCURRENT))  # jobs run by the server itself, 0: only by remote agents
+AGENT_INTERVAL = float(os.environ.get("AGENT_INTERVAL", 5))  # seconds between heartbeats/pulls of `mocap --agent`
+FLEET_SECRET = os.environ.get("FLEET_SECRET", "")  # shared by server & agents to register, unset: no agent may register
+LOOKAHEAD = int(os.environ.get("LOOKAHEAD", 2))  # inputs transcoded ahead of inference
+WORKER_IDLE = float(os.environ.get("WORKER_IDLE", 0))  # >0: keep models loaded in resident workers for N seconds
+NO_CACHE = bool(os.environ.get("NO_CACHE", ""))  # always re-run, skip the `.mocap.npz` result cache
+CACHE_GB = float(os.environ.get("CACHE_GB", 10))  # >0: evict least recently used results when the cache grows over N GB
+SHARD = float(os.environ.get("SHARD", 0))  # >0: split videos into N seconds shards that run in parallel
+SHARD_OVERLAP = float(os.environ.get("SHARD_OVERLAP", 2))  # seconds shared by neighbor shards to stitch
+FFMPEG_PRESET = os.environ.get("FFMPEG_PRESET", "veryfast")  # x264 preset when re-encoding is unavoidable
+FFMPEG_THREADS = int(os.environ.get("FFMPEG_THREADS", 0))  # `-threads` per ffmpeg, 0: CPU cores / CONCURRENT
+FFMPEG_SEGMENT = float(os.environ.get("FFMPEG_SEGMENT", 60))  # >0: re-encode inputs of 2N+ seconds as N seconds segments in parallel
+FFMPEG_JOBS = int(os.environ.get("FFMPEG_JOBS", 0))  # concurrent segments of 1 input, 0: FFMPEG_THREADS / 4
+PROCESS: Literal["aio", "aexpect"] = os.environ.get("PROCESS", "aio")  # type: ignore  # backend of `run_tail`/`run_bg`
 DIR_SELF = os.path.dirname(os.path.abspath(__file__))
 PACKAGE = __package__.split(".")[0] if __package__ else os.path.basename(DIR_SELF)
 VERSION = _version(PACKAGE)
@@ -0,0 +1,65 @@
+"""
+virtual input: instead of writing a cut/resampled mp4, `ffmpeg_or_link()` writes `<stem>.vinput.json`
+next to where the mp4 would be, runners of `RUNS_VINPUT` decode the source with seek-and-skip, see `docker/lib.py:VideoCapture`.
+
+```python
+vinput = write_vinput('in.mp4', 'output/in/in.mp4', probe('in.mp4'), start=1, duration=4, fps=30)
+vinput['frames']  # source frame index of each output frame
+```
+"""
+
+import os
+import json
+from pathlib import Path
+from typing import Any
+from .logger import getLogger
+
+Log = getLogger(__name__)
+VINPUT = ".vinput.json"
+
+
+def vinput_of(video: str | Path):
+    return os.path.splitext(video)[0] + VINPUT
+
+
+def frame_map(from_fps: float, to_fps: float, start=0.0, duration=0.0, total=0) -> list[int]:
+    """nearest source frame of each output frame at `to_fps` in [start, start+duration)
+
+    Args:
+        total: frames of the source, to clip the map
+    """
+    first = round(start * from_fps)
+    n = round(duration * to_fps)
+    frames = [first + round(i * from_fps / to_fps) for i in range(n)]
+    return [f for f in frames if f < total] if total else frames
+
+
+def write_vinput(from_file: str, to_file: str, info: dict[str, Any], start=0.0, duration=0.0, fps: float = 0):
+    """
+    Args:
+        to_file: the mp4 that is NOT written, runners find the sidecar by it
+        info: `probe(from_file)`
+        duration: seconds, default till the end
+        fps: output fps, default the source fps
+    """
+    fps = fps or info["fps"]
+    duration = min(duration or info["duration"], info["duration"] - start)
+    st = os.stat(from_file)
+    vinput = dict(
+        source=os.path.abspath(from_file),
+        size=st.st_size,
+        mtime=st.st_mtime,
+        fps=fps,
+        source_fps=info["fps"],
+        width=info["width"],
+        height=info["height"],
+        rotation=info.get("rotation", 0),
+        frames=frame_map(info["fps"], fps, start, duration, info["frames"]),
+    )
+    sidecar = vinput_of(to_file)
+    tmp = sidecar + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(vinput, f)
+    os.replace(tmp, sidecar)
+    Log.info(f"🪞 {len(vinput['frames'])} frames of {from_file} → {sidecar}")
+    return vinput
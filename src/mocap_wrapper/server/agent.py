@@ -0,0 +1,201 @@
+"""
+`mocap --agent URL`: run jobs of a remote `mocap` server on this machine, see `fleet.py`.
+
+```python
+agent = Agent('http://gpu-server:23333', mocap)
+await agent.serve()
+```
+"""
+
+import os
+import json
+import socket
+import shutil
+import asyncio
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Sequence
+from mocap_wrapper.lib import AGENT_INTERVAL, CONCURRENT, CONFIG, FLEET_SECRET, RUNS, TIMEOUT_MINUTE, Scheduler, getLogger
+
+Log = getLogger(__name__)
+
+
+def installed_runs() -> list[str]:
+    """runs with `pixi.toml` in their repo, same check as `mocap()`"""
+    return [r for r in RUNS if os.path.exists(os.path.join(CONFIG.get(r) or "", "pixi.toml"))]
+
+
+class Agent:
+    def __init__(
+        self,
+        url: str,
+        func: Callable[..., Awaitable[Any]],
+        runs: Sequence[str] | None = None,
+        concurrent: int = CONCURRENT,
+        Dir: str | Path | None = None,
+        interval=AGENT_INTERVAL,
+        name=socket.gethostname(),
+        secret=FLEET_SECRET,
+    ):
+        """
+        Args:
+            url: of `mocap` server, e.g. `http://localhost:23333`
+            func: `await func(inputs=..., outdir=..., scheduler=..., **kwargs)`, e.g. `mocap`
+            runs: runs to take jobs for, default `installed_runs()`
+            Dir: to download inputs & keep outputs while a job runs, default temp dir
+            interval: seconds between heartbeats, and between pulls when no job
+            secret: shared with the server to register, see `Fleet`
+        """
+        self.url = url.rstrip("/") + "/agent"
+        self.func = func
+        self.runs = list(runs) if runs else installed_runs()
+        self.concurrent = max(1, concurrent)
+        self.dir = Path(Dir or tempfile.mkdtemp(prefix="mocap-agent-"))
+        self.interval = interval
+        self.name = name
+        self.secret = secret
+        self.id = ""
+        self.token = ""  # issued by `register()`, sent with every call
+        self.scheduler: Scheduler | None = None
+        self.tasks: dict[str, asyncio.Task] = {}  # job id: task
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name}, {self.id}, runs={self.runs}, running={len(self.tasks)})"
+
+    def _request(
+        self, method: str, path: str, body: Any = None, file: Path | None = None, to: Path | None = None, headers: dict[str, str] = {}
+    ):
+        """blocking HTTP call, streams `file` as request body or response body into `to`"""
+        req = urllib.request.Request(self.url + path, method=method, headers=headers)
+        req.add_header("X-Agent-Token", self.token)
+        if file:
+            req.add_header("Content-Length", str(os.path.getsize(file)))
+            with open(file, "rb") as f:
+                return self._urlopen(req, f, to)
+        if body is not None:
+            req.add_header("Content-Type", "application/json")
+            return self._urlopen(req, json.dumps(body).encode(), to)
+        return self._urlopen(req, None, to)
+
+    def _urlopen(self, req: urllib.request.Request, data: Any, to: Path | None):
+        with urllib.request.urlopen(req, data=data, timeout=TIMEOUT_MINUTE) as r:
+            if to is None:
+                ret = r.read()
+                return json.loads(ret) if ret else None
+            with open(to, "wb") as out:
+                shutil.copyfileobj(r, out)
+            return to
+
+    async def call(self, method: str, path: str, **kwargs):
+        return await asyncio.to_thread(self._request, method, path, **kwargs)
+
+    async def register(self):
+        assert self.scheduler
+        agent = await self.call(
+            "POST", "/register", body=dict(name=self.name, runs=self.runs, vram=self.scheduler.budget),
+            headers={"X-Fleet-Secret": self.secret},
+        )
+        self.id, self.token = agent["id"], agent["token"]
+        Log.info(f"🤝 {self} → {self.url}")
+
+    async def heartbeat(self):
+        assert self.scheduler
+        body = dict(
+            vram_free=self.scheduler.budget - self.scheduler.used, running=len(self.tasks), jobs=list(self.tasks)
+        )
+        try:
+            agent = await self.call("POST", f"/heartbeat/{self.id}", body=body)
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                raise
+            await self.register()  # server restarted or lost us
+            return
+        for id in agent.get("cancel", []):
+            if id in self.tasks:
+                Log.info(f"⏹ job {id} stopped by server")
+                self.tasks[id].cancel()
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                await self.heartbeat()
+            except (urllib.error.URLError, OSError) as e:
+                Log.warning(f"{self}: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def pull(self) -> dict[str, Any] | None:
+        try:
+            return await self.call("POST", f"/pull/{self.id}")
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                raise
+            await self.register()
+            return None
+
+    async def execute(self, job: dict[str, Any]):
+        id, kwargs = job["id"], dict(job["kwargs"])
+        Dir = self.dir / id
+        Dir.mkdir(parents=True, exist_ok=True)
+        prefix = f"/{self.id}/{id}"
+        result, error = [], ""
+        try:
+            inputs = []
+            for i, input in enumerate(kwargs.pop("inputs", [])):
+                to = Dir / "inputs" / str(i) / os.path.basename(input)  # e.g. day1/DJI_0001.MP4 & day2/DJI_0001.MP4
+                to.parent.mkdir(parents=True, exist_ok=True)
+                inputs.append(str(await self.call("GET", f"/input{prefix}/{i}", to=to)))
+            kwargs.update(inputs=inputs, outdir=str(Dir / "output"))
+            npzs = await self.func(**kwargs, scheduler=self.scheduler)
+            for npz in npzs if isinstance(npzs, list) else []:
+                npz = Path(npz)
+                name = f"{urllib.parse.quote(npz.parent.name)}/{urllib.parse.quote(npz.name)}"
+                await self.call("PUT", f"/result{prefix}/{name}", file=npz)
+                result.append(f"{npz.parent.name}/{npz.name}")
+        except asyncio.CancelledError:
+            shutil.rmtree(Dir, ignore_errors=True)
+            raise
+        except Exception as e:
+            Log.exception(f"job {id}", exc_info=e)
+            error = repr(e)
+        shutil.rmtree(Dir, ignore_errors=True)
+        try:
+            await self.call("POST", f"/done{prefix}", body=dict(result=result, error=error))
+        except urllib.error.HTTPError as e:
+            Log.warning(f"job {id} was taken back by server: {e}")
+
+    async def serve(self):
+        """pull & run jobs until cancelled"""
+        self.scheduler = Scheduler(concurrent=self.concurrent)
+        await self.register()
+        slots = asyncio.Semaphore(self.concurrent)
+        beat = asyncio.create_task(self._heartbeat())
+        try:
+            while True:
+                await slots.acquire()
+                try:
+                    job = await self.pull()
+                except (urllib.error.URLError, OSError) as e:
+                    Log.warning(f"{self}: {e}")
+                    job = None
+                if job is None:
+                    slots.release()
+                    await asyncio.sleep(self.interval)
+                    continue
+                task = asyncio.create_task(self.execute(job))
+                self.tasks[job["id"]] = task
+                task.add_done_callback(lambda t, id=job["id"]: (self.tasks.pop(id, None), slots.release()))
+        finally:
+            beat.cancel()
+            tasks = list(self.tasks.values())
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(beat, *tasks, return_exceptions=True)
+
+
+def main(url: str, runs: Sequence[str] | None = None):
+    from mocap_wrapper.app import mocap
+
+    asyncio.run(Agent(url, mocap, runs=runs).serve())
@@ -0,0 +1,234 @@
+"""
+coordinate remote `mocap --agent URL` workers: they register, heartbeat free VRAM & installed runs,
+pull jobs from the shared `JobStore`, download inputs and upload `.mocap.npz` as streaming bodies.
+`/register` needs the shared `X-Fleet-Secret` of env `FLEET_SECRET`, every other `/agent/*` route
+the `X-Agent-Token` issued at registration, only videos under `roots` are served as inputs.
+
+```python
+FLEET = Fleet(QUEUE.store)
+APP.include_router(router(FLEET), prefix='/agent')
+```
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import secrets
+from pathlib import Path
+from typing import Any
+from fastapi import APIRouter, Body, Header, HTTPException, Request
+from fastapi.responses import FileResponse
+from mocap_wrapper.lib import AGENT_INTERVAL, CONFIG, FLEET_SECRET, RUNS, RUNS_VRAM_GB, getLogger, is_video
+from mocap_wrapper.server.jobs import JobStore
+
+Log = getLogger(__name__)
+TOKEN_HEADER = "X-Agent-Token"
+SECRET_HEADER = "X-Fleet-Secret"
+
+
+def _safe_name(name: str):
+    if not name or name != os.path.basename(name) or name.startswith("."):
+        raise HTTPException(status_code=400, detail=f"Bad name {name!r}")
+    return name
+
+
+class Fleet:
+    def __init__(
+        self, store: JobStore, timeout=AGENT_INTERVAL * 3, roots: list[str | Path] = [], secret=FLEET_SECRET
+    ):
+        """
+        Args:
+            timeout: seconds without heartbeat before an agent is lost and its jobs are queued again
+            roots: dirs whose videos may be served to agents, default `search_dir`
+            secret: agents register only with it, empty refuses every agent
+        """
+        self.store = store
+        self.secret = secret
+        self.timeout = timeout
+        self.roots = [os.path.realpath(r) for r in roots or [CONFIG["search_dir"]]]
+        self.agents: dict[str, dict[str, Any]] = {}
+        self.tokens: dict[str, str] = {}  # agent id: token, apart so `agents` can be listed
+        self.costs: dict[str, float] = {**RUNS_VRAM_GB, **CONFIG.get("vram", {})}
+        self._task: asyncio.Task | None = None
+
+    def register(self, name: str, runs: list[str], vram: float, secret=""):
+        """403 unless `secret` is the fleet's one"""
+        if not self.secret:
+            raise HTTPException(status_code=403, detail="No agent may register, set env FLEET_SECRET on the server")
+        if not secrets.compare_digest(self.secret, secret or ""):
+            Log.warning(f"⛔ agent {name} registers with a bad secret")
+            raise HTTPException(status_code=403, detail="Bad fleet secret")
+        id = uuid.uuid4().hex
+        self.agents[id] = dict(
+            id=id, name=name, runs=runs, vram=vram, vram_free=vram, running=0, seen=time.time()
+        )
+        self.tokens[id] = secrets.token_urlsafe(32)
+        Log.info(f"🤝 agent {name} {id}: {runs=} {vram=:.1f}GB")
+        return {**self.agents[id], "token": self.tokens[id]}
+
+    def auth(self, id: str, token: str):
+        """404 if `id` is unknown, so the agent registers again, 403 if `token` is not the one issued to it"""
+        if id not in self.agents:
+            raise HTTPException(status_code=404, detail=f"No agent {id}, register again")
+        if not secrets.compare_digest(self.tokens.get(id, ""), token or ""):
+            raise HTTPException(status_code=403, detail=f"Bad token of agent {id}")
+        return id
+
+    def input_of(self, id: str, job_id: str, i: int) -> str:
+        """`i`th input of a running job of the agent, only an existing video under `roots`"""
+        inputs = self.job_of(id, job_id)["kwargs"].get("inputs", [])
+        if not 0 <= i < len(inputs) or not os.path.isfile(inputs[i]):
+            raise HTTPException(status_code=404, detail=f"No input {i} of job {job_id}")
+        path = os.path.realpath(inputs[i])
+        if not is_video(path) or not any(os.path.commonpath([path, r]) == r for r in self.roots):
+            Log.warning(f"⛔ agent {id} asked for {inputs[i]} outside of {self.roots}")
+            raise HTTPException(status_code=403, detail=f"Input {i} of job {job_id} is not served")
+        return path
+
+    def heartbeat(self, id: str, vram_free: float, running: int, jobs: list[str] = []):
+        """
+        Args:
+            jobs: ids of jobs running on the agent
+
+        Returns:
+            agent: with `cancel`, ids of `jobs` the agent should stop, e.g. cancelled or taken back
+        """
+        agent = self.agents[id]
+        agent.update(vram_free=vram_free, running=running, seen=time.time())
+        cancel = []
+        for job_id in jobs:
+            job = self.store.get(job_id)
+            if job is None or job["status"] != "running" or job["agent"] != id:
+                cancel.append(job_id)
+        return {**agent, "cancel": cancel}
+
+    def cost(self, job: dict[str, Any]) -> float:
+        """peak GB of a job, its runs go 1 by 1"""
+        return max((self.costs.get(r, 0) for r in job["kwargs"].get("by") or RUNS), default=0)
+
+    def is_accept(self, agent: dict[str, Any], job: dict[str, Any]):
+        by = job["kwargs"].get("by") or RUNS
+        if not set(by) <= set(agent["runs"]):
+            return False
+        return agent["running"] == 0 or self.cost(job) <= agent["vram_free"]
+
+    def pull(self, id: str):
+        """claim the oldest job this agent can run, or None"""
+        self.sweep()
+        agent = self.agents[id]
+        agent["seen"] = time.time()
+        job = self.store.claim(accept=lambda j: self.is_accept(agent, j), agent=id)
+        if job:
+            agent["running"] += 1
+            agent["vram_free"] -= self.cost(job)  # until next heartbeat
+            Log.info(f"▶ job {job['id']} → agent {agent['name']}")
+        return job
+
+    def job_of(self, id: str, job_id: str):
+        """running job owned by agent, else 409"""
+        job = self.store.get(job_id)
+        if job is None or job["status"] != "running" or job["agent"] != id:
+            raise HTTPException(status_code=409, detail=f"Job {job_id} is not running on agent {id}")
+        return job
+
+    def done(self, id: str, job_id: str, result: list[str], error=""):
+        """
+        Args:
+            result: `<name>/<name>.mocap.npz` uploaded into `outdir` of the job
+        """
+        job = self.job_of(id, job_id)
+        outdir = job["kwargs"].get("outdir", "")
+        paths = [os.path.join(outdir, r) for r in result]
+        if error:
+            self.store.update(job_id, "failed", result=paths, error=error)
+        else:
+            self.store.update(job_id, "done", result=[p for p in paths if os.path.exists(p)])
+        if id in self.agents:
+            self.agents[id]["running"] = max(0, self.agents[id]["running"] - 1)
+        Log.info(f"{'❌' if error else '✔'} job {job_id} by agent {id} {error}")
+        return self.store.get(job_id)
+
+    def sweep(self):
+        """forget lost agents, queue their jobs again"""
+        now = time.time()
+        for id, agent in list(self.agents.items()):
+            if now - agent["seen"] > self.timeout:
+                Log.warning(f"💔 lost agent {agent['name']} {id}")
+                del self.agents[id]
+                self.tokens.pop(id, None)
+                self.store.requeue(id)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.timeout)
+            self.sweep()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def router(fleet: Fleet):
+    """HTTP endpoints for `server/agent.py`"""
+    r = APIRouter(tags=["agent"])
+
+    def _agent(id: str, token: str):
+        return fleet.auth(id, token)
+
+    @r.post("/register")
+    async def register(
+        name: str = Body(embed=True),
+        runs: list[str] = Body(embed=True),
+        vram: float = Body(embed=True),
+        secret: str = Header("", alias=SECRET_HEADER),
+    ):
+        return fleet.register(name, runs, vram, secret)
+
+    @r.post("/heartbeat/{id}")
+    async def heartbeat(
+        id: str,
+        vram_free: float = Body(embed=True),
+        running: int = Body(embed=True),
+        jobs: list[str] = Body([], embed=True),
+        token: str = Header("", alias=TOKEN_HEADER),
+    ):
+        return fleet.heartbeat(_agent(id, token), vram_free, running, jobs)
+
+    @r.post("/pull/{id}")
+    async def pull(id: str, token: str = Header("", alias=TOKEN_HEADER)):
+        return fleet.pull(_agent(id, token))
+
+    @r.get("/input/{id}/{job_id}/{i}")
+    async def input(id: str, job_id: str, i: int, token: str = Header("", alias=TOKEN_HEADER)):
+        path = fleet.input_of(_agent(id, token), job_id, i)
+        return FileResponse(path, filename=os.path.basename(path))
+
+    @r.put("/result/{id}/{job_id}/{name}/{file}")
+    async def result(id: str, job_id: str, name: str, file: str, request: Request, token: str = Header("", alias=TOKEN_HEADER)):
+        outdir = fleet.job_of(_agent(id, token), job_id)["kwargs"].get("outdir", "")
+        to = Path(outdir, _safe_name(name), _safe_name(file))
+        to.parent.mkdir(parents=True, exist_ok=True)
+        tmp = to.with_name(f".{to.name}.{id}.tmp")
+        with open(tmp, "wb") as f:
+            async for chunk in request.stream():
+                f.write(chunk)
+        os.replace(tmp, to)
+        return f"{name}/{file}"
+
+    @r.post("/done/{id}/{job_id}")
+    async def done(
+        id: str,
+        job_id: str,
+        result: list[str] = Body(embed=True),
+        error: str = Body("", embed=True),
+        token: str = Header("", alias=TOKEN_HEADER),
+    ):
+        return fleet.done(_agent(id, token), job_id, result, error)
+
+    return r
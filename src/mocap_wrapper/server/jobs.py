@@ -0,0 +1,276 @@
+"""
+durable job queue on SQLite: `run` returns a job id at once, a bounded executor drains the queue,
+and queued/running jobs are picked up again after server restart.
+Jobs with higher `priority` are claimed first, and preempt lower running jobs when all workers are busy.
+
+```python
+QUEUE = JobQueue(mocap)
+await QUEUE.start()
+id = QUEUE.submit(inputs=['a.mp4'], by=['wilor'])
+QUEUE.store.get(id)   # {'id':..., 'status': 'done', 'result': [...npz], ...}
+QUEUE.cancel(id)
+```
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from functools import partial
+from pathlib import Path
+from platformdirs import user_data_path
+from typing import Any, Awaitable, Callable, Literal
+from mocap_wrapper.lib import CONCURRENT, PACKAGE, PROGRESS_HOOK, Scheduler, getLogger
+
+Log = getLogger(__name__)
+TYPE_STATUS = Literal["queued", "running", "done", "failed", "cancelled"]
+DB = user_data_path(appname=PACKAGE, ensure_exists=True) / "jobs.sqlite"
+_COLUMNS = ("id", "status", "kwargs", "result", "error", "created", "updated", "agent", "priority", "progress")
+PROGRESS_INTERVAL = 1.0  # seconds between progress writes of a job
+
+
+def result_paths(inputs: list[str] = [], outdir="", **kwargs) -> list[str]:
+    """`.mocap.npz` of each input, see `ffmpeg_or_link()` for `outdir/<stem>/`"""
+    stems = [os.path.splitext(os.path.basename(i))[0] for i in inputs]
+    npzs = [os.path.join(outdir, s, f"{s}.mocap.npz") for s in stems]
+    return [f for f in npzs if os.path.exists(f)]
+
+
+class JobStore:
+    def __init__(self, file: Path | str = DB):
+        self.file = str(file)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.file, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, status TEXT NOT NULL, kwargs TEXT NOT NULL,
+                result TEXT, error TEXT, created REAL NOT NULL, updated REAL NOT NULL, agent TEXT,
+                priority INTEGER NOT NULL DEFAULT 0, progress TEXT)"""
+        )
+        columns = [r[1] for r in self._db.execute("PRAGMA table_info(jobs)")]
+        if "agent" not in columns:  # db of older version
+            self._db.execute("ALTER TABLE jobs ADD COLUMN agent TEXT")
+        if "priority" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+        if "progress" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN progress TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+
+    def _row(self, row: tuple | None) -> dict[str, Any] | None:
+        if row is None:
+            return None
+        job = dict(zip(_COLUMNS, row))
+        job["kwargs"] = json.loads(job["kwargs"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["progress"] = json.loads(job["progress"]) if job["progress"] else None
+        return job
+
+    def submit(self, **kwargs) -> str:
+        """`kwargs['priority']` also orders the queue"""
+        id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, kwargs, created, updated, priority) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (id, json.dumps(kwargs), now, now, int(kwargs.get("priority", 0))),
+            )
+        return id
+
+    def get(self, id: str):
+        with self._lock:
+            cur = self._db.execute(f"SELECT {','.join(_COLUMNS)} FROM jobs WHERE id=?", (id,))
+            return self._row(cur.fetchone())
+
+    def list(self, status: TYPE_STATUS | None = None, limit=100):
+        sql = f"SELECT {','.join(_COLUMNS)} FROM jobs"
+        sql += " WHERE status=?" if status else ""
+        sql += " ORDER BY created DESC LIMIT ?"
+        with self._lock:
+            cur = self._db.execute(sql, (status, limit) if status else (limit,))
+            return [self._row(r) for r in cur.fetchall()]
+
+    def claim(self, accept: Callable[[dict[str, Any]], bool] | None = None, agent=""):
+        """oldest queued job of highest priority → running, or None
+
+        Args:
+            accept: skip queued jobs that `accept(job)` is False, e.g. runs not installed on the agent
+            agent: id of the remote agent that runs the job, "" is this server
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                sql = f"SELECT {','.join(_COLUMNS)} FROM jobs WHERE status='queued' ORDER BY priority DESC, created"
+                cur = self._db.execute(sql if accept else sql + " LIMIT 1")
+                job = None
+                for row in cur.fetchall():
+                    job = self._row(row)
+                    if accept is None or accept(job):  # type: ignore
+                        break
+                    job = None
+                if job:
+                    job["status"], job["agent"] = "running", agent or None
+                    self._db.execute(
+                        "UPDATE jobs SET status='running', agent=?, updated=? WHERE id=?",
+                        (job["agent"], time.time(), job["id"]),
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return job
+
+    def update(self, id: str, status: TYPE_STATUS, result: Any = None, error=""):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status=?, result=?, error=?, updated=? WHERE id=?",
+                (status, json.dumps(result), error, time.time(), id),
+            )
+
+    def progress(self, id: str, event: dict[str, Any]):
+        """latest `TqdmJson.get_dict()` of a job, e.g. ffmpeg frames, speed & ETA"""
+        with self._lock:
+            self._db.execute("UPDATE jobs SET progress=? WHERE id=?", (json.dumps(event), id))
+
+    def requeue(self, agent: str) -> int:
+        """running jobs of a lost agent are queued again"""
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE jobs SET status='queued', agent=NULL, updated=? WHERE status='running' AND agent=?",
+                (time.time(), agent),
+            )
+        Log.warning(f"♻️ Requeue {cur.rowcount} jobs of lost agent {agent}") if cur.rowcount else None
+        return cur.rowcount
+
+    def recover(self) -> int:
+        """jobs left running by a dead server are queued again"""
+        with self._lock:
+            cur = self._db.execute("UPDATE jobs SET status='queued', agent=NULL WHERE status='running'")
+        Log.info(f"♻️ Requeue {cur.rowcount} jobs from {self.file}") if cur.rowcount else None
+        return cur.rowcount
+
+    def close(self):
+        self._db.close()
+
+
+class JobQueue:
+    def __init__(
+        self,
+        func: Callable[..., Awaitable[Any]],
+        store: JobStore | None = None,
+        workers: int = CONCURRENT,
+    ):
+        """
+        Args:
+            func: `await func(**kwargs, scheduler=...)` for each job, e.g. `mocap`
+            workers: max jobs in progress, VRAM is still bounded by the shared `Scheduler`.
+                0 runs no job on this server, only remote agents, see `Fleet`
+        """
+        self.func = func
+        self.store = store or JobStore()
+        self.workers = max(0, workers)
+        self.scheduler: Scheduler | None = None
+        self._wake: asyncio.Event | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._running: dict[str, tuple[asyncio.Task, int, float]] = {}  # id: (task, priority, start)
+        self._stops: dict[str, TYPE_STATUS] = {}  # id: status after its task is cancelled
+        self._progress_at: dict[str, float] = {}  # id: time of last progress write
+
+    def submit(self, **kwargs) -> str:
+        id = self.store.submit(**kwargs)
+        self._wake.set() if self._wake else None
+        priority = int(kwargs.get("priority", 0))
+        if self.workers and len(self._running) >= self.workers:
+            lower = [(p, -start, i) for i, (_, p, start) in self._running.items() if p < priority]
+            if lower:
+                self.preempt(min(lower)[2])  # lowest & newest
+        return id
+
+    def _stop(self, id: str, status: TYPE_STATUS):
+        task = self._running[id][0]
+        self._stops[id] = status
+        task.cancel()
+
+    def cancel(self, id: str):
+        """stop a queued/running job, runs on remote agents stop on their next heartbeat"""
+        job = self.store.get(id)
+        if job is None or job["status"] not in ("queued", "running"):
+            return job
+        self.store.update(id, "cancelled")
+        if id in self._running:
+            self._stop(id, "cancelled")
+        Log.info(f"⏹ job {id} cancelled")
+        return self.store.get(id)
+
+    def preempt(self, id: str):
+        """stop a running job of this server and queue it again, its finished runs are kept by the result cache"""
+        if id in self._running:
+            Log.warning(f"⏏ job {id} preempted")
+            self.store.update(id, "queued")
+            self._stop(id, "queued")
+        return self.store.get(id)
+
+    async def start(self):
+        self.store.recover()
+        self.scheduler = Scheduler()
+        self._wake = asyncio.Event()
+        self._wake.set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        assert self._wake
+        while True:
+            job = self.store.claim()
+            if job is None:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            self._wake.set()  # maybe more queued jobs for other workers
+            task = asyncio.create_task(self.execute(job))
+            self._running[job["id"]] = (task, int(job.get("priority") or 0), time.time())
+            try:
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                task.cancel()
+                await asyncio.wait([task])
+                raise
+            finally:
+                self._running.pop(job["id"], None)
+
+    def progress(self, id: str, event: dict[str, Any]):
+        """`PROGRESS_HOOK` of a job, throttled by `PROGRESS_INTERVAL` except the end of a bar"""
+        now = time.time()
+        is_end = event.get("total") is not None and event.get("n") == event.get("total")
+        if is_end or now - self._progress_at.get(id, 0) >= PROGRESS_INTERVAL:
+            self._progress_at[id] = now
+            self.store.progress(id, event)
+
+    async def execute(self, job: dict[str, Any]):
+        id, kwargs = job["id"], job["kwargs"]
+        Log.info(f"▶ job {id}: {kwargs}")
+        PROGRESS_HOOK.set(partial(self.progress, id))  # bars created in this task & its children
+        try:
+            result = await self.func(**kwargs, scheduler=self.scheduler)
+            result = result if isinstance(result, list) else result_paths(**kwargs)
+            self.store.update(id, "done", result=result)
+            Log.info(f"✔ job {id}")
+        except asyncio.CancelledError:
+            status = self._stops.pop(id, None)
+            if status is None:
+                self.store.update(id, "queued")  # server shutdown, retry on restart
+                raise
+            Log.info(f"⏹ job {id} → {status}")
+        except Exception as e:
+            Log.exception(f"job {id}", exc_info=e)
+            self.store.update(id, "failed", error=repr(e))
+        finally:
+            self._progress_at.pop(id, None)
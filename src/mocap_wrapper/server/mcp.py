@@ -1,16 +1,33 @@
 import asyncio
 from functools import partial
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
 from fastmcp import FastMCP, Context
 from mocap_wrapper import OUTPUT_DIR, SELF_DIR, mocap
-from mocap_wrapper.lib import RUNS, CONFIG, LOG_LEVEL, PACKAGE, TYPE_RUNS, VERSION
+from mocap_wrapper.lib import RUNS, CONFIG, expand_inputs, LOG_LEVEL, PACKAGE, SERVER_JOBS, TYPE_RUNS, VERSION
+from mocap_wrapper.server.jobs import JobQueue, PROGRESS_INTERVAL, TYPE_STATUS
+from mocap_wrapper.server.fleet import Fleet, router
 from typing import Callable, Sequence
 TITLE = f'{PACKAGE} {{}} backend server'
 HOST = '0.0.0.0'
 PORT = 23333
 MCP = FastMCP(TITLE.format('MCP'), version=VERSION)
 APP_MCP = MCP.http_app(path='/mcp')
-APP = FastAPI(lifespan=APP_MCP.lifespan, title=TITLE.format('fastapi'), version=VERSION)
+QUEUE = JobQueue(mocap, workers=SERVER_JOBS)
+FLEET = Fleet(QUEUE.store, roots=[CONFIG['search_dir'], OUTPUT_DIR])  # only videos under these are served to agents
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with APP_MCP.lifespan(app):
+        await QUEUE.start()
+        await FLEET.start()
+        yield
+        await FLEET.stop()
+        await QUEUE.stop()
+
+APP = FastAPI(lifespan=lifespan, title=TITLE.format('fastapi'), version=VERSION)
+APP.include_router(router(FLEET), prefix='/agent')  # `mocap --agent URL`
 
 
 def tool_post(func: Callable | None = None, **kwargs):
@@ -55,17 +72,61 @@ async def install(by: Sequence[TYPE_RUNS], at=CONFIG['search_dir'], ctx: Context
 
 
 @tool_post
-async def run(inputs: list[str], outdir=OUTPUT_DIR, Range='', by: Sequence[TYPE_RUNS] = RUNS, ctx: Context | None = None):
-    '''Run the mocap model and get results.'''
+async def run(inputs: list[str], outdir=OUTPUT_DIR, Range='', by: Sequence[TYPE_RUNS] = RUNS, priority: int = 0, wait: bool = False, ctx: Context | None = None):
+    '''Queue a mocap job of videos, directories or globs in `inputs` and return its id at once, poll `job` for status, progress and result `.mocap.npz` paths.
+    Higher `priority` (e.g. 1 for interactive use) runs first and preempts lower running jobs.
+    `wait` until the job ends, reporting its progress.'''
+    inputs = await asyncio.to_thread(expand_inputs, inputs)  # big trees or network mounts would block the loop & heartbeats
+    id = QUEUE.submit(inputs=inputs, outdir=outdir, Range=Range, by=list(by), priority=priority)
     if ctx:
-        await ctx.info(f'Run {by}...')
-        # progress = 0
-        # while progress < 1.0:
-        #     progress += 10
-        #     await ctx.report_progress(progress, 100, f'Running at {progress}...')
-        #     await asyncio.sleep(2)
-    await mocap(inputs=inputs, outdir=outdir, Range=Range, by=by)
-    return outdir
+        await ctx.info(f'Queued {id}: run {by}...')
+    _job = QUEUE.store.get(id)
+    while wait and _job and _job['status'] in ('queued', 'running'):
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        _job = QUEUE.store.get(id)
+        if ctx and _job and (p := _job['progress']):
+            await ctx.report_progress(p.get('n', 0), p.get('total'), f"{_job['status']} {p.get('msg', '')} {p.get('speed', '')}".strip())
+    return _job
+
+
+@tool_post
+async def job(id: str):
+    '''Get status & result `.mocap.npz` paths of a job.'''
+    _job = QUEUE.store.get(id)
+    if _job is None:
+        raise HTTPException(status_code=404, detail=f'No job {id}')
+    return _job
+
+
+@tool_post
+async def cancel(id: str):
+    '''Cancel a queued or running job, its partial outputs are removed.'''
+    _job = QUEUE.cancel(id)
+    if _job is None:
+        raise HTTPException(status_code=404, detail=f'No job {id}')
+    return _job
+
+
+@tool_post
+async def preempt(id: str):
+    '''Stop a running job and queue it again, to make room for other jobs.'''
+    _job = QUEUE.preempt(id)
+    if _job is None:
+        raise HTTPException(status_code=404, detail=f'No job {id}')
+    return _job
+
+
+@tool_post
+async def jobs(status: TYPE_STATUS | None = None, limit: int = 100):
+    '''List latest jobs, filter by status: queued, running, done, failed, cancelled.'''
+    return QUEUE.store.list(status, limit=limit)
+
+
+@tool_post
+async def agents():
+    '''List remote agents of `mocap --agent URL`, with their runs, free VRAM and running jobs.'''
+    FLEET.sweep()
+    return list(FLEET.agents.values())
 
 APP.mount("/", APP_MCP)
 
@@ -0,0 +1,131 @@
+#!/bin/env python
+import shutil
+import pytest
+import logging
+import subprocess
+from mocap_wrapper.lib.FFmpeg import plan, span
+Log = logging.getLogger(__name__)
+IS_FFMPEG = bool(shutil.which('ffmpeg'))
+INFO = dict(fps=30.0, is_vfr=False, duration=10.0, codec='h264', pix_fmt='yuv420p')
+KEYS = [0.0, 2.0, 4.0, 6.0, 8.0]
+
+
+@pytest.mark.parametrize(
+    'info, Range, keys, op',
+    [
+        ({}, '', None, 'link'),
+        ({}, '2+4', KEYS, 'copy'),                        # 2s~6s on keyframes
+        ({}, '6+10', KEYS, 'copy'),                       # till the end
+        ({}, '1+4', KEYS, 'smart'),
+        ({}, '1+4', None, 'encode'),                      # keyframes unknown
+        ({}, '2.5+1', KEYS, 'encode'),                    # no whole GOP inside
+        ({'codec': 'vp9'}, '2+4', KEYS, 'encode'),
+        ({'fps': 29.0}, '', None, 'encode'),              # fps to round
+        ({'is_vfr': True}, '2+4', KEYS, 'encode'),
+    ]
+)
+def test_plan(info, Range, keys, op):
+    _op, kw = plan({**INFO, **info}, Range, keys=keys)
+    assert _op == op, kw
+
+
+@pytest.mark.parametrize(
+    'duration, start, t, seconds',
+    [
+        (10.0, 0, 0, 10.0),
+        (10.0, 2, 4, 4.0),
+        (10.0, 8, 4, 2.0),      # clipped to the end
+        (0, 2, 4, 4.0),         # unknown duration, e.g. stream
+        (None, 2, 0, 0.0),      # unknown & no Range: no `-t`
+    ]
+)
+def test_span(duration, start, t, seconds):
+    assert span({**INFO, 'duration': duration}, start, t) == seconds
+
+
+def test_plan_smart():
+    op, kw = plan(INFO, '1+6', keys=KEYS)   # 1s~7s
+    assert op == 'smart'
+    assert kw == {'head': (1, 1), 'mid': (2, 4), 'tail': (6, 1)}, kw
+    op, kw = plan(INFO, '2+5', keys=KEYS)
+    assert kw['head'] is None and kw['tail'] == (6, 1), kw
+
+
+@pytest.mark.skipif(not IS_FFMPEG, reason='no ffmpeg')
+@pytest.mark.parametrize('Range, op', [('', 'link'), ('2+4', 'copy'), ('1+6', 'smart'), ('1.5+0.2', 'encode')])
+async def test_ffmpeg_or_link(tmp_path, Range, op):
+    from mocap_wrapper.lib.FFmpeg import ffmpeg_or_link
+    from mocap_wrapper.lib.probe import ProbeCatalog
+    video = tmp_path / 'testsrc.mp4'
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc=d=10:s=128x96:r=30',
+        '-c:v', 'libx264', '-g', '60', '-keyint_min', '60', '-sc_threshold', '0', str(video),
+    ], check=True)
+    to = await ffmpeg_or_link(str(video), str(tmp_path / 'out'), Range=Range)
+    info = ProbeCatalog(tmp_path / 'probe.sqlite').probe(to)
+    assert not info['has_audio']
+    if Range:
+        duration = float(Range.split('+')[1])
+        assert abs(info['duration'] - duration) < 0.1, (op, info)
+    p = subprocess.run(['ffmpeg', '-v', 'error', '-i', str(to), '-f', 'framemd5', '-'], capture_output=True, text=True, check=True)
+    frames = [line for line in p.stdout.splitlines() if not line.startswith('#')]
+    assert not p.stderr, (op, p.stderr)
+    assert len(frames) == round(float(Range.split('+')[1]) * 30 if Range else 300), (op, len(frames))
+
+
+def test_vinput(tmp_path):
+    import os
+    from sys import path as PATH
+    from pathlib import Path
+    from mocap_wrapper.lib.vinput import frame_map, write_vinput
+    assert frame_map(30, 30, start=1, duration=0.1) == [30, 31, 32]
+    assert frame_map(30, 15, duration=0.4) == [0, 2, 4, 6, 8, 10]
+    assert frame_map(24, 30, duration=0.2) == [0, 1, 2, 2, 3, 4], 'duplicated when fps goes up'
+    assert frame_map(30, 30, start=9.9, duration=1, total=300) == [297, 298, 299]
+
+    source = tmp_path / 'in.mp4'
+    source.write_bytes(b'0')
+    to = tmp_path / 'out' / 'in' / 'in.mp4'
+    to.parent.mkdir(parents=True)
+    vinput = write_vinput(str(source), str(to), {**INFO, 'width': 64, 'height': 48, 'frames': 300}, start=2, duration=1)
+    assert vinput['frames'] == list(range(60, 90)) and not to.exists()
+    PATH.append(str(Path(__file__).parent.parent / 'docker'))
+    from lib import vinput as read_vinput  # type: ignore
+    assert read_vinput(to) == vinput, 'runners read what the host wrote'
+    os.utime(source, (0, 0))
+    assert read_vinput(to) is None, 'source changed'
+
+
+def test_split_segments():
+    from mocap_wrapper.lib.FFmpeg import split_segments
+    keys = [float(k) for k in range(0, 300, 2)]
+    segments = split_segments(1, 299, keys, segment=60)
+    assert [ss for ss, t in segments] == [1, 62, 122, 182, 242], segments
+    assert sum(t for ss, t in segments) == 298
+    assert split_segments(0, 80, keys, segment=60) == [(0, 80)], 'tail shorter than half a segment'
+
+
+@pytest.mark.skipif(not IS_FFMPEG, reason='no ffmpeg')
+async def test_segment_benchmark(tmp_path):
+    """parallel segments should beat 1 ffmpeg on a long synthetic video"""
+    import time
+    from mocap_wrapper.lib.FFmpeg import _ffmpeg, encode_args, keyframes, segment_encode, split_segments
+    from mocap_wrapper.lib.probe import ProbeCatalog
+    import ffmpeg
+    video = tmp_path / 'testsrc.mp4'
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc=d=120:s=640x360:r=30',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', str(video),
+    ], check=True)
+    cost = {}
+    start = time.perf_counter()
+    await _ffmpeg(ffmpeg.input(str(video)).output(filename=str(tmp_path / 'one.mp4'), r=25, **encode_args()))
+    cost['one'] = time.perf_counter() - start
+    start = time.perf_counter()
+    segments = split_segments(0, 120, keyframes(str(video), 0, 120), segment=20)
+    await segment_encode(str(video), str(tmp_path / 'seg.mp4'), segments, jobs=len(segments), r=25)
+    cost['segments'] = time.perf_counter() - start
+    Log.info(f'{len(segments)=} {cost=}')
+    info = ProbeCatalog(tmp_path / 'probe.sqlite').probe(tmp_path / 'seg.mp4')
+    assert abs(info['duration'] - 120) < 0.2 and info['frames'] == 3000, info
+    assert cost['segments'] < cost['one'], cost
@@ -0,0 +1,464 @@
+#!/bin/env python
+import os
+import pytest
+import asyncio
+import logging
+from pathlib import Path
+from functools import partial
+from mocap_wrapper.lib.scheduler import Scheduler
+Log = logging.getLogger(__name__)
+COSTS = {'wilor': 2.5, 'gvhmr': 3}
+
+
+@pytest.mark.parametrize(
+    'budget, concurrent, peak',
+    [
+        (24, 3, 3),     # limited by CONCURRENT
+        (6, 8, 2),      # limited by VRAM
+        (2, 8, 1),      # job > budget still runs, alone
+        (0, 8, 1),      # unknown budget, 1 by 1
+    ]
+)
+async def test_scheduler(budget, concurrent, peak):
+    scheduler = Scheduler(budget=budget, costs=COSTS, concurrent=concurrent)
+    running = []
+
+    async def fake_run():
+        running.append(scheduler.running)
+        assert scheduler.running == 1 or scheduler.used <= scheduler.budget, scheduler
+        await asyncio.sleep(0.05)
+
+    jobs = [scheduler.run(r, fake_run, key=i) for i in range(4) for r in COSTS]
+    await asyncio.gather(*jobs)
+    Log.info(f'{running=}')
+    assert max(running) == peak, running
+    assert scheduler.used == 0 and scheduler.running == 0, scheduler
+
+
+async def test_scheduler_same_key():
+    scheduler = Scheduler(budget=24, costs=COSTS, concurrent=8)
+    order = []
+
+    async def fake_run(run):
+        order.append(f'{run}+')
+        await asyncio.sleep(0.02)
+        order.append(f'{run}-')
+
+    await asyncio.gather(*[scheduler.run(r, lambda r=r: fake_run(r), key='video.mp4') for r in COSTS])
+    assert order == ['wilor+', 'wilor-', 'gvhmr+', 'gvhmr-'], order
+
+
+async def test_worker(tmp_path, monkeypatch):
+    import threading
+    from sys import path as PATH
+    from mocap_wrapper.lib.process import Worker
+    PATH.append(str(Path(__file__).parent.parent / 'docker'))
+    from lib import serve  # type: ignore
+    jobs, cwds = [], []
+
+    def fake_job(argv):
+        jobs.append(argv)
+        cwds.append(os.getcwd())
+        if '--fail' in argv:
+            raise ValueError(argv)
+
+    worker = Worker('wilor', idle=1)
+    worker.sock = str(tmp_path / 'wilor.sock')
+    thread = threading.Thread(target=serve, args=(fake_job, worker.sock, 1), daemon=True)
+    thread.start()
+    while not os.path.exists(worker.sock):
+        await asyncio.sleep(0.01)
+    assert await worker('--input', 'a.mp4') == 0
+    (tmp_path / 'b').mkdir()
+    monkeypatch.chdir(tmp_path / 'b')
+    assert await worker('--input', 'b.mp4', '--fail') == 1
+    assert jobs == [['--input', 'a.mp4'], ['--input', 'b.mp4', '--fail']], jobs
+    assert cwds[1] == str(tmp_path / 'b') and cwds[0] != cwds[1], 'relative paths of the caller'
+    assert os.getcwd() == str(tmp_path / 'b')
+    thread.join(timeout=3)
+    assert not thread.is_alive(), 'idle worker should exit'
+
+
+async def test_job_queue(tmp_path):
+    from mocap_wrapper.server.jobs import JobQueue, JobStore
+    store = JobStore(tmp_path / 'jobs.sqlite')
+    lost = store.submit(inputs=['lost.mp4'])
+    assert store.claim()['id'] == lost     # server died while running
+    running = []
+
+    async def fake_mocap(inputs, scheduler, fail=False):
+        running.append(len([j for j in store.list('running')]))
+        await asyncio.sleep(0.05)
+        if fail:
+            raise ValueError(inputs)
+
+    queue = JobQueue(fake_mocap, store=store, workers=2)
+    await queue.start()
+    assert store.get(lost)['status'] == 'queued', 'recover on restart'
+    ids = [queue.submit(inputs=[f'{i}.mp4'], fail=i == 0) for i in range(4)]
+    while store.list('queued') or store.list('running'):
+        await asyncio.sleep(0.02)
+    await queue.stop()
+    assert max(running) <= 2, running
+    assert [store.get(i)['status'] for i in ids] == ['failed', 'done', 'done', 'done']
+    assert store.get(lost)['status'] == 'done'
+
+
+@pytest.mark.parametrize('lookahead', [1, 3])
+async def test_pipeline(lookahead):
+    from mocap_wrapper.lib.pipeline import PipelineError, Stage, pipeline
+    transcoded, inferred = [], []
+
+    async def transcode(i):
+        await asyncio.sleep(0.01)
+        transcoded.append(i)
+        return i
+
+    async def inference(i):
+        ahead = len(transcoded) - len(inferred)
+        assert ahead <= lookahead + 2, f'{ahead=} > {lookahead=}'  # +1 transcoding, +1 inferring
+        await asyncio.sleep(0.03)
+        inferred.append(i)
+        return None if i == 3 else i    # drop
+
+    async def export(i):
+        if i == 5:
+            raise ValueError(i)
+        return f'{i}.mocap.npz'
+
+    results = await pipeline(range(8), Stage(transcode), Stage(inference, maxsize=lookahead), Stage(export))
+    assert sorted(results) == [f'{i}.mocap.npz' for i in (0, 1, 2, 4, 6, 7)], results
+    with pytest.raises(PipelineError) as e:
+        await pipeline([5, 3], Stage(inference), Stage(export))
+    assert [i for i, _ in e.value.errors] == [5], 'every item failed or dropped'
+
+
+def test_result_cache(tmp_path):
+    import numpy as np
+    from mocap_wrapper.lib.cache import ResultCache, hash_file, input_key, workdir
+    big = tmp_path / 'big.mp4'
+    big.write_bytes(os.urandom(5 * 1024**2))
+    h = hash_file(big)
+    with open(big, 'r+b') as f:
+        f.seek(0)
+        f.write(b'x')
+    assert hash_file(big) != h, 'head chunk changed'
+
+    a, b = tmp_path / 'a' / 'in.mp4', tmp_path / 'b' / 'in.mp4'
+    for i, f in enumerate((a, b)):
+        f.parent.mkdir()
+        f.write_bytes(bytes([i]) * 100)
+    out = tmp_path / 'output'
+    ka, kb = input_key(a), input_key(b)
+    assert workdir(out, a, ka) == 'in'
+    assert workdir(out, b, kb) == f'in-{kb[:8]}', 'same name, different content'
+    assert workdir(out, a, ka) == 'in'
+
+    cache = ResultCache(tmp_path / 'cache')
+    key = cache.key(ka, 'wilor', ['--render'])
+    assert key != cache.key(ka, 'wilor') and key != cache.key(kb, 'wilor', ['--render'])
+    npz = out / 'in' / 'in.mocap.npz'
+    assert not cache.get(key, npz)
+    np.savez(npz, **{'smplx;wilor;0;0;pose': np.ones(3), 'smplx;gvhmr;0;0;pose': np.zeros(3)})
+    assert cache.put(key, npz, 'wilor')
+
+    npz2 = out / 'in2.mocap.npz'
+    np.savez(npz2, **{'smplx;gvhmr;0;0;pose': np.zeros(3)})
+    assert cache.get(key, npz2)
+    with np.load(npz2) as f:
+        assert sorted(f.files) == ['smplx;gvhmr;0;0;pose', 'smplx;wilor;0;0;pose'], f.files
+    with np.load(cache.path(key)) as f:
+        assert f.files == ['smplx;wilor;0;0;pose'], 'only keys of the run'
+
+    keys = [cache.key(ka, 'wilor', [str(i)]) for i in range(3)]
+    for i, k in enumerate([key, *keys]):
+        cache.put(k, npz, 'wilor')
+        os.utime(cache.path(k), (i, i))
+    lru = ResultCache(tmp_path / 'cache', limit_gb=2.5 * cache.path(key).stat().st_size / 1024**3)
+    assert lru.get(keys[0], npz2), 'hit counts as use'
+    assert lru.evict() == [cache.path(key), cache.path(keys[1])], 'least recently used'
+    assert lru.put(key, npz, 'wilor') and not cache.path(keys[2]).exists() and cache.path(key).exists()
+
+
+async def test_fleet(tmp_path):
+    import socket
+    import urllib.error
+    import threading
+    import uvicorn
+    from fastapi import FastAPI
+    from mocap_wrapper.server.jobs import JobStore
+    from mocap_wrapper.server.fleet import Fleet, router
+    from mocap_wrapper.server.agent import Agent
+    store = JobStore(tmp_path / 'jobs.sqlite')
+    fleet = Fleet(store, timeout=5, roots=[tmp_path / 'videos'], secret='s3cret')
+    app = FastAPI()
+    app.include_router(router(fleet), prefix='/agent')
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    url = f'http://127.0.0.1:{sock.getsockname()[1]}'
+    server = uvicorn.Server(uvicorn.Config(app, log_level='warning'))
+    thread = threading.Thread(target=server.run, kwargs=dict(sockets=[sock]), daemon=True)
+    thread.start()
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    outdir = tmp_path / 'output'
+    (tmp_path / 'videos').mkdir()
+    ids = []
+    for i in range(6):
+        input = tmp_path / 'videos' / f'{i}.mp4'
+        input.write_bytes(os.urandom(1000 + i))
+        by = ['gvhmr'] if i % 2 else ['wilor']
+        ids.append(store.submit(inputs=[str(input)], outdir=str(outdir), by=by))
+    same = []
+    for day in ('day1', 'day2'):
+        input = tmp_path / 'videos' / day / 'DJI_0001.mp4'
+        input.parent.mkdir()
+        input.write_bytes(day.encode())
+        same.append(str(input))
+    same_id = store.submit(inputs=same, outdir=str(tmp_path / 'same'), by=['wilor'])
+    ran: dict[str, list] = {}
+    got: dict[str, list] = {}
+
+    def fake_mocap(name):
+        async def mocap(inputs, outdir, scheduler, by, **kwargs):
+            assert set(by) <= {'wilor', 'gvhmr'} and (name != 'wilor-only' or by == ['wilor'])
+            ran.setdefault(name, []).append(inputs[0])
+            npzs = []
+            for input in inputs:
+                stem = Path(input).stem
+                if stem == 'DJI_0001':
+                    got.setdefault(outdir, []).append(Path(input).read_bytes())
+                    continue
+                os.makedirs(os.path.join(outdir, stem))
+                npz = os.path.join(outdir, stem, f'{stem}.mocap.npz')
+                with open(input, 'rb') as f, open(npz, 'wb') as out:
+                    out.write(f.read())     # echo input as result
+                npzs.append(npz)
+            await asyncio.sleep(0.1)
+            return npzs
+        return mocap
+
+    agents = [
+        Agent(url, fake_mocap('wilor-only'), runs=['wilor'], concurrent=1, Dir=tmp_path / 'a', interval=0.05, name='wilor-only', secret='s3cret'),
+        Agent(url, fake_mocap('all'), runs=['wilor', 'gvhmr'], concurrent=2, Dir=tmp_path / 'b', interval=0.05, name='all', secret='s3cret'),
+    ]
+    tasks = [asyncio.create_task(a.serve()) for a in agents]
+    try:
+        while store.list('queued') or store.list('running'):
+            await asyncio.sleep(0.05)
+        assert len(fleet.agents) == 2
+        evil = Agent(url, fake_mocap('evil'), runs=['wilor'], Dir=tmp_path / 'c', name='evil')
+        evil.scheduler = agents[0].scheduler
+        with pytest.raises(urllib.error.HTTPError) as e:
+            await evil.register()
+        assert e.value.code == 403 and len(fleet.agents) == 2, 'no secret, no token'
+    finally:
+        [t.cancel() for t in tasks]
+        await asyncio.gather(*tasks, return_exceptions=True)
+        server.should_exit = True
+        thread.join(timeout=5)
+    for i, id in enumerate(ids):
+        job = store.get(id)
+        assert job['status'] == 'done', job
+        npz = outdir / str(i) / f'{i}.mocap.npz'
+        assert job['result'] == [str(npz)]
+        assert npz.read_bytes() == (tmp_path / 'videos' / f'{i}.mp4').read_bytes(), 'streamed round trip'
+    assert set(ran) == {'wilor-only', 'all'}, ran
+    assert store.get(same_id)['status'] == 'done' and list(got.values()) == [[b'day1', b'day2']], 'same basename'
+
+    # a client reads files only by jobs of registered agents, and only videos under `roots`
+    from fastapi import HTTPException
+    secret = tmp_path / 'secret.mp4'
+    secret.write_bytes(b'secret')
+    for bad in ('', 'guess'):
+        with pytest.raises(HTTPException) as e:
+            fleet.register('evil', ['wilor'], 8, bad)
+        assert e.value.status_code == 403, 'registers only with the fleet secret'
+    with pytest.raises(HTTPException):
+        Fleet(store, secret='').register('evil', ['wilor'], 8, '')
+    agent = fleet.register('evil', ['wilor'], 8, 's3cret')
+    for input in [secret, tmp_path / 'videos' / '..' / 'secret.mp4', tmp_path / 'videos' / '0.txt']:
+        input.write_bytes(b'secret') if not input.exists() else None
+        id = store.submit(inputs=[str(input)], by=['wilor'])
+        assert fleet.pull(agent['id'])['id'] == id
+        with pytest.raises(HTTPException) as e:
+            fleet.input_of(agent['id'], id, 0)
+        assert e.value.status_code == 403, input
+        fleet.done(agent['id'], id, [], error='forbidden')
+    with pytest.raises(HTTPException) as e:
+        fleet.auth(agent['id'], 'guess')
+    assert e.value.status_code == 403 and 'token' not in fleet.agents[agent['id']]
+    assert fleet.auth(agent['id'], agent['token']) == agent['id']
+
+    # lost agent
+    agent = fleet.register('lost', ['wilor'], 8, 's3cret')
+    id = store.submit(inputs=[], by=['wilor'])
+    assert fleet.pull(agent['id'])['id'] == id
+    fleet.agents[agent['id']]['seen'] -= 10
+    fleet.sweep()
+    assert agent['id'] not in fleet.agents and store.get(id)['status'] == 'queued'
+
+
+async def test_scheduler_preempt():
+    scheduler = Scheduler(budget=6, costs=COSTS, concurrent=8)
+    order = []
+
+    async def fake_run(name, t=0.1):
+        order.append(f'{name}+')
+        try:
+            await asyncio.sleep(t)
+        except asyncio.CancelledError:
+            order.append(f'{name}!')
+            raise
+        order.append(f'{name}-')
+
+    batch = [asyncio.create_task(scheduler.run('gvhmr', partial(fake_run, f'batch{i}'))) for i in range(2)]
+    await asyncio.sleep(0.02)
+    assert scheduler.used == 6
+    start = asyncio.get_running_loop().time()
+    await scheduler.run('gvhmr', partial(fake_run, 'urgent', 0.02), priority=1)
+    assert asyncio.get_running_loop().time() - start < 0.08, 'urgent should not wait for batch'
+    await asyncio.gather(*batch)
+    assert order.index('urgent+') < order.index('urgent-') < order.index('batch1-'), order
+    assert order.count('batch1+') == 2 and 'batch1!' in order, 'newest batch preempted then retried'
+    assert 'batch0!' not in order, order
+    assert scheduler.used == 0 and scheduler.running == 0, scheduler
+
+
+async def test_job_queue_cancel(tmp_path):
+    from mocap_wrapper.server.jobs import JobQueue, JobStore
+    store = JobStore(tmp_path / 'jobs.sqlite')
+    started = []
+
+    async def fake_mocap(inputs, scheduler, priority=0):
+        started.append(inputs[0])
+        await asyncio.sleep(0.2)
+
+    queue = JobQueue(fake_mocap, store=store, workers=1)
+    await queue.start()
+    batch = queue.submit(inputs=['batch.mp4'])
+    queued = queue.submit(inputs=['queued.mp4'])
+    await asyncio.sleep(0.05)
+    assert queue.cancel(queued)['status'] == 'cancelled'
+    urgent = queue.submit(inputs=['urgent.mp4'], priority=1)
+    await asyncio.sleep(0.05)
+    assert store.get(batch)['status'] == 'queued', 'preempted'
+    assert store.get(urgent)['status'] == 'running'
+    while store.list('queued') or store.list('running'):
+        await asyncio.sleep(0.02)
+    await queue.stop()
+    assert started == ['batch.mp4', 'urgent.mp4', 'batch.mp4'], started
+    assert [store.get(i)['status'] for i in (batch, queued, urgent)] == ['done', 'cancelled', 'done']
+    assert queue.cancel(batch)['status'] == 'done', 'finished job stays'
+
+
+def test_remove_partial(tmp_path):
+    import numpy as np
+    from mocap_wrapper.lib.cache import partial_snapshot, remove_partial, saved_runs
+    video = tmp_path / 'a.mp4'
+    video.write_bytes(b'0')
+    old = tmp_path / 'preprocess' / 'bbx.pt'
+    old.parent.mkdir()
+    old.write_bytes(b'0')
+    npz = tmp_path / 'a.mocap.npz'
+    np.savez(npz, **{'smplx;wilor;hand0R;0;bbox': np.ones(4), 'smplx;gvhmr;person0;0;bbox': np.ones(4)})
+    before = partial_snapshot(tmp_path, 'gvhmr')
+    partial = tmp_path / 'preprocess' / 'vit_features_0.pt'
+    partial.write_bytes(b'half')
+    other = tmp_path / '_out_a.mp4'     # of a wilor run on the same video meanwhile
+    other.write_bytes(b'0')
+    np.savez(npz, **{'smplx;wilor;hand0R;0;bbox': np.ones(4), 'smplx;gvhmr;person0;0;bbox': np.ones(4),
+                     'smplx;gvhmr;person1;0;bbox': np.ones(4)})
+    assert remove_partial(tmp_path, 'gvhmr', before, keep=[video]) == [partial]
+    assert old.exists() and video.exists() and other.exists()
+    with np.load(npz) as f:
+        assert f.files == ['smplx;wilor;hand0R;0;bbox', 'smplx;gvhmr;person0;0;bbox'], 'keys of earlier runs stay'
+    assert saved_runs(npz) == {'wilor', 'gvhmr'} and saved_runs(tmp_path / 'missing.mocap.npz') == set()
+
+    before = partial_snapshot(tmp_path, 'gvhmr')
+    new = tmp_path / 'b.mocap.npz'
+    np.savez(new, **{'smplx;gvhmr;person0;0;bbox': np.ones(4)})
+    assert remove_partial(tmp_path, 'gvhmr', before) == [new]
+
+
+def test_probe_catalog(tmp_path):
+    import json
+    from mocap_wrapper.lib.probe import ProbeCatalog, parse, sidecar_of
+    video = tmp_path / 'a.mp4'
+    video.write_bytes(b'0' * 10)
+    meta = {
+        'format': {'duration': '10.0'},
+        'streams': [
+            {'codec_type': 'video', 'codec_name': 'h264', 'width': 1920, 'height': 1080,
+             'r_frame_rate': '30/1', 'avg_frame_rate': '30000/1001', 'pix_fmt': 'yuv420p'},
+            {'codec_type': 'audio'},
+        ],
+    }
+    st = video.stat()
+    info = parse(meta, video, st.st_size, st.st_mtime)
+    assert info['fps'] == 30 and info['is_vfr'] and info['has_audio']
+    assert info['frames'] == 300 and not info['is_frames_exact']
+
+    catalog = ProbeCatalog(tmp_path / 'probe.sqlite')
+    catalog.put({**info, 'path': str(video)})
+    assert catalog.probe(video) == {**info, 'path': str(video)}, 'no ffprobe when cached'
+    sidecar = catalog.write_sidecar(video)
+    assert sidecar == sidecar_of(video) == str(tmp_path / 'a.probe.json')
+
+    other = ProbeCatalog(tmp_path / 'other.sqlite')
+    assert other.get(video)['width'] == 1920, 'shared by sidecar'
+    os.utime(video, (st.st_mtime + 1, st.st_mtime + 1))
+    assert catalog.get(video) is None and other.get(video) is None, 'changed file'
+    with open(sidecar) as f:
+        assert json.load(f)['codec'] == 'h264'
+    catalog.close()
+    other.close()
+
+
+def test_ingest(tmp_path):
+    from mocap_wrapper.lib.ingest import expand_inputs, ingest, validate_inputs
+    from mocap_wrapper.lib.probe import ProbeCatalog
+    (tmp_path / 'clips' / 'night').mkdir(parents=True)
+    files = {name: tmp_path / 'clips' / name for name in ('a.mp4', 'b.MOV', 'night/c.mkv', 'notes.txt', 'empty.mp4', 'bad.mp4')}
+    for name, f in files.items():
+        f.write_bytes(b'' if name == 'empty.mp4' else b'0' * 10)
+    clips = str(tmp_path / 'clips')
+    assert len(expand_inputs([clips])) == 5, 'recursive, no .txt'
+    assert expand_inputs([f'{clips}/**/*.mkv', f'{clips}/night', 'https://a.b/c.mp4']) == [str(files['night/c.mkv']), 'https://a.b/c.mp4'], 'no duplicates'
+    assert expand_inputs(['missing.mp4']) == ['missing.mp4'], 'explicit file as is'
+
+    catalog = ProbeCatalog(tmp_path / 'probe.sqlite')
+    for name, frames in (('a.mp4', 300), ('b.MOV', 900), ('night/c.mkv', 0)):
+        st = files[name].stat()
+        catalog.put(dict(path=str(files[name]), size=st.st_size, mtime=st.st_mtime, frames=frames, width=64, height=48))
+    valid, rejected = validate_inputs(expand_inputs([clips, 'missing.mp4']), catalog, workers=2)
+    assert rejected.keys() == {str(files[f]) for f in ('night/c.mkv', 'empty.mp4', 'bad.mp4')} | {'missing.mp4'}, rejected
+    assert rejected['missing.mp4'] == 'not found' and rejected[str(files['empty.mp4'])] == 'empty'
+    assert rejected[str(files['bad.mp4'])].startswith('unreadable')
+    assert ingest([clips], catalog) == [str(files['b.MOV']), str(files['a.mp4'])], 'longest first'
+    catalog.close()
+
+
+async def test_job_progress(tmp_path):
+    from mocap_wrapper.lib.FFmpeg import Progress
+    from mocap_wrapper.server.jobs import JobQueue, JobStore
+    store = JobStore(tmp_path / 'jobs.sqlite')
+
+    async def fake_mocap(inputs, scheduler):
+        progress = Progress('🎞 a', duration=2, fps=30)
+        for frame in (15, 60):
+            for line in (f'frame={frame}', f'out_time_us={frame * 33333}', 'speed=2.5x', 'progress=continue'):
+                progress(line)
+            await asyncio.sleep(0.01)
+        progress('progress=end')
+
+    queue = JobQueue(fake_mocap, store=store, workers=1)
+    await queue.start()
+    id = queue.submit(inputs=['a.mp4'])
+    while store.get(id)['status'] != 'done':
+        await asyncio.sleep(0.02)
+    await queue.stop()
+    progress = store.get(id)['progress']
+    assert progress['n'] == progress['total'] == 60, progress
+    assert progress['speed'] == '2.5x' and progress['msg'] == '🎞 a'
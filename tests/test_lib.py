@@ -6,9 +6,11 @@ import numpy as np
 from os import getcwd
 from sys import path as PATH
 from time import sleep
-from mocap_wrapper.run.lib import euler, quat_rotAxis
+from pathlib import Path
 CWD = getcwd()
 PATH.append(CWD)
+PATH.append(str(Path(__file__).parent.parent / 'docker'))
+from lib import euler, quat_rotAxis  # type: ignore
 from mocap_wrapper.lib import *
 DRY_RUN = False
 ENV = 'test'
@@ -94,7 +96,7 @@ async def test_resume(urls):
             continue
 
 
-@pytest.skip('requires aria2c')
+@pytest.mark.skip(reason='requires aria2c')
 @pytest.mark.parametrize(
     "video",
     [
@@ -139,6 +141,187 @@ def test_rod(rot):
     Log.info(Euler)
 
 
+def box(t):
+    """hand moves right"""
+    x = 10 + 2 * t
+    return np.array([x, 0, x + 50, 100], dtype=np.float32)
+
+
+def yaw(rad):
+    return np.array([np.cos(rad / 2), 0, 0, np.sin(rad / 2)])
+
+
+def docker_lib():
+    import lib  # type: ignore
+    return lib
+
+
+def test_video_ext():
+    from mocap_wrapper.lib.static import VIDEO_EXT
+    assert set(docker_lib().VIDEO_EXT) == set(VIDEO_EXT), 'host ingests the videos that runners take'
+
+
+def test_track():
+    Track = docker_lib().Track
+    track = Track(begin=5, is_right=1)
+    n = 1000
+    for t in range(n):
+        track.append({'bbox': box(t), 'hand_pose': np.tile(yaw(t), (15, 1))})
+    assert len(track) == n and track.capacity() == 1024
+    assert np.array_equal(track['bbox'][-1], box(n - 1)) and track['bbox'].shape == (n, 4)
+    data = track.trim()
+    assert data['hand_pose'].shape == (n, 15, 4) and data['bbox'].dtype == np.float32
+    assert not np.shares_memory(data['bbox'], track['bbox']), 'trimmed copy'
+
+
+@pytest.mark.parametrize('scipy', [True, False])
+def test_assign(scipy, monkeypatch):
+    import sys
+    lib = docker_lib()
+    if scipy:
+        pytest.importorskip('scipy')
+    else:
+        monkeypatch.setitem(sys.modules, 'scipy.optimize', None)
+    assert lib.assign(np.zeros((0, 2))) == []
+    assert lib.assign([[1.0, 0.5]]) == [1], 'fast path of 1 hand'
+    assert lib.assign([[1.0, 0.5]], allowed=np.array([[True, False]])) == [0], 'other side'
+    assert lib.assign([[1.0, 2.0], [1.1, 9.0]]) == [1, 0], 'fast path of 2 hands, global not greedy'
+    assert lib.assign([[1.0], [0.5], [2.0]]) == [None, 0, None]
+
+    rng = np.random.default_rng(0)
+    n = 24  # a crowd of hands, 2 per person
+    tracks = np.concatenate([rng.uniform(0, 1800, (n, 2)), np.zeros((n, 2))], axis=1)
+    tracks[:, 2:] = tracks[:, :2] + rng.uniform(40, 80, (n, 2))
+    is_right = np.arange(n) % 2
+    moved = tracks + rng.normal(0, 3, (n, 1))
+    order = rng.permutation(n)
+    cost, dist = lib.box_cost(moved[order], tracks)
+    match = lib.assign(cost, is_right[order][:, None] == is_right[None])
+    assert match == order.tolist(), 'detection order does not matter'
+    assert cost.shape == dist.shape == (n, n) and np.allclose(np.diag(lib.box_cost(tracks, tracks)[0]), 0)
+
+
+def test_quat_to_RotMat():
+    lib = docker_lib()
+    aa = np.random.default_rng(1).normal(size=(5, 15, 3))
+    R = lib.Rodrigues(aa)
+    assert np.allclose(lib.quat_to_RotMat(lib.quat_rotAxis(aa)), R), 'inverse of RotMat_to_quat(), as saved by wilor'
+    assert np.allclose(lib.Rodrigues(lib.quat_to_rotAxis(lib.quat_rotAxis(aa))), R)
+
+
+@pytest.mark.parametrize('stride', [1, 3, 4])
+def test_unstride(stride):
+    """every `stride`-th frame inferred, the gaps slerped, compared to every frame of a hand turning at constant speed"""
+    lib = docker_lib()
+    n = 28  # 10 rows of stride 3, as long as betas
+    t = np.arange(n)
+    aa = np.stack([np.zeros(n), 0.1 * t, np.zeros(n)], -1)[:, None] * [[1], [0.5]]  # 2 joints
+    q = lib.quat_rotAxis(aa)
+    q[1::2] *= -1   # same rotations, flipped signs
+    data = {
+        'hand_pose': q[::stride], 'global_orient': aa[::stride, 0],
+        'bbox': np.stack([t, t, t + 10, t + 10], -1)[::stride].astype(float), 'betas': np.ones(10),
+    }
+    keys = ['hand_pose', 'global_orient', 'bbox']
+    filled = lib.unstride_frames(data, stride, keys=keys)
+    m = len(filled['source'])
+    assert m == (len(data['bbox']) - 1) * stride + 1 and filled['source'].sum() == len(data['bbox'])
+    assert np.array_equal(np.flatnonzero(filled['source']), np.arange(0, m, stride))
+    assert np.allclose(np.abs(np.sum(filled['hand_pose'] * lib.quat_rotAxis(aa[:m]), -1)), 1), 'slerp of constant speed'
+    assert np.allclose(filled['global_orient'], aa[:m, 0]), 'axis angles of --raw'
+    assert np.allclose(filled['bbox'][:, 0], t[:m]) and filled['betas'].shape == (10,), 'not per-frame'
+
+    filled = lib.unstride_frames(data, stride, keys=keys, total=n)
+    assert all(len(filled[K]) == n for K in (*keys, 'source')) and filled['source'][m:].sum() == 0
+    assert np.array_equal(filled['bbox'][m - 1:], np.repeat(filled['bbox'][m - 1:m], n - m + 1, 0)), 'last row held'
+    with pytest.raises(ValueError):
+        lib.unstride_frames({**data, 'bbox': data['bbox'][:-1]}, stride, keys=keys)
+    assert lib.stride_of(30, target_fps=10) == 3 and lib.stride_of(30, stride=2) == 2 and lib.stride_of(30, stride=0) == 1
+
+
+@pytest.mark.parametrize('stride', [2, 3])
+def test_tail_total(stride):
+    """bbox of a person held up to the video's frames like its poses, as `gvhmr --stride` saves them"""
+    lib = docker_lib()
+    n = 28
+    inferred = -(-n // stride)
+    pose = lib.unstride_frames({'transl': np.zeros((inferred, 3))}, stride, keys=['transl'], total=n)
+    begin = 2   # person shows up late
+    rows = inferred - begin
+    total = lib.tail_total(begin, rows, stride, n)
+    bbox = lib.unstride_frames({'bbox': np.zeros((rows, 4))}, stride, keys=['bbox'], total=total)
+    assert begin * stride + len(bbox['bbox']) == len(pose['transl']) == n
+    assert len(bbox['source']) == len(bbox['bbox'])
+    assert lib.tail_total(begin, rows - 1, stride, n) == 0, 'left before the end'
+
+
+def test_mesh_writer(tmp_path):
+    lib = docker_lib()
+    V = 5
+    faces = np.array([[0, 1, 2], [2, 3, 4]])
+    file = tmp_path / 'a.mesh.npy'
+    with lib.MeshWriter(file, vertices=V, hands=1, faces={'faces': faces}) as writer:
+        for f in range(10):
+            hands = 3 if f == 6 else 1  # grows the slots on the way
+            writer.write([np.full((V, 3), f + h / 10) for h in range(hands)], is_right=[h % 2 for h in range(hands)])
+    verts = np.load(file, mmap_mode='r')
+    assert verts.shape == (10, 3, V, 3) and verts.dtype == np.float32
+    assert np.allclose(verts[6, 2], 6.2) and np.allclose(verts[9, 0], 9) and np.isnan(verts[9, 1]).all()
+    meta = np.load(tmp_path / 'a.mesh.meta.npz')
+    assert np.array_equal(meta['faces'], faces)
+    assert meta['is_right'].tolist()[6] == [0, 1, 0] and meta['is_right'].tolist()[0] == [0, -1, -1]
+
+
+def test_mesh_writer_slots(tmp_path):
+    """a hand stays in the slot of its track, even when detected in another order or alone"""
+    lib = docker_lib()
+    V = 5
+    file = tmp_path / 'b.mesh.npy'
+    with lib.MeshWriter(file, vertices=V) as writer:
+        writer.write([np.full((V, 3), 0), np.full((V, 3), 1)], is_right=[0, 1], slots=[0, 1])
+        writer.write([np.full((V, 3), 1), np.full((V, 3), 0)], is_right=[1, 0], slots=[1, 0])
+        writer.write([np.full((V, 3), 1)], is_right=[1], slots=[1])
+        writer.write([np.full((V, 3), 3)], is_right=[1], slots=[3])    # grows
+    verts = np.load(file)
+    assert verts.shape == (4, 4, V, 3)
+    assert np.allclose(verts[:3, 1], 1) and np.allclose(verts[:2, 0], 0) and np.isnan(verts[2, 0]).all()
+    assert np.allclose(verts[3, 3], 3) and np.isnan(verts[3, :3]).all()
+    is_right = np.load(tmp_path / 'b.mesh.meta.npz')['is_right'].tolist()
+    assert is_right == [[0, 1, -1, -1], [0, 1, -1, -1], [-1, 1, -1, -1], [-1, -1, -1, 1]]
+
+
+@pytest.mark.parametrize('every', [1, 5, 15])
+def test_box_tracker(every):
+    """speed (detector calls) vs accuracy (IoU of the boxes the estimation ran on) of a hand that moves, then jumps"""
+    lib = docker_lib()
+    n = 300
+    fingers = np.random.default_rng(0).uniform(0, 60, (21, 2))
+
+    def keypoints(t):
+        return fingers + (2 * t + (400 if t >= 203 else 0), 100)  # jumps between keyframes
+
+    tracker = lib.BoxTracker(every=every)
+    calls, ious = 0, []
+    for t in range(n):
+        boxes = tracker.next()
+        truth = lib.keypoints_box(keypoints(t))
+        if boxes is None:
+            calls += 1
+            bboxes = truth[None]
+        else:
+            bboxes = boxes[0]
+        # the estimation only sees the part of the hand inside its box
+        kp = keypoints(t).clip(bboxes[0, :2], bboxes[0, 2:])[None]
+        if not tracker.update(bboxes, [1], kp, detected=boxes is None):
+            calls += 1
+            bboxes = truth[None]
+            assert tracker.update(bboxes, [1], keypoints(t)[None], detected=True)
+        ious.append(lib.box_iou(bboxes, truth)[0, 0])
+    Log.info(f'{every=} detector calls={calls}/{n} IoU={np.mean(ious):.3f} {tracker}')
+    assert calls <= n // every + 2
+    assert np.mean(ious) > 0.9 and tracker.lost == (every > 1), 're-detected after the jump'
+
+
 @pytest.fixture(scope="function", autouse=True)
 def setup_progress():
     ...
@@ -0,0 +1,169 @@
+#!/bin/env python
+import time
+import shutil
+import pytest
+import asyncio
+import logging
+from mocap_wrapper.lib import process
+Log = logging.getLogger(__name__)
+BACKENDS = ['aio', 'aexpect']
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    monkeypatch.setattr(process, 'PROCESS', request.param)
+    return request.param
+
+
+@pytest.mark.parametrize(
+    'cmd, status',
+    [
+        (['true'], 0),
+        (['sh', '-c', 'exit 3'], 3),
+        ('exit 7', 7),      # str runs in shell
+    ]
+)
+async def test_status(backend, cmd, status):
+    p = await process.run_tail(cmd).Await()
+    assert not p.is_alive()
+    assert p.get_status() == status, p
+
+
+async def test_output(backend):
+    lines = []
+    p = await process.run_tail(['sh', '-c', 'echo out; echo err >&2; printf "a\\rb"'], output_func=lines.append).Await()
+    assert p.get_status() == 0
+    assert {'out', 'err'} <= {l.strip() for l in lines}, lines
+
+
+async def test_timeout(backend):
+    start = time.perf_counter()
+    p = await process.run_tail(['sleep', '10']).Await(0.3)
+    assert time.perf_counter() - start < 5
+    assert p.get_status() == 128 + 15, p     # SIGTERM
+
+    p = await process.run_tail(['sleep', '0.5']).Await(-0.1)
+    assert p.is_alive(), 'negative timeout should not kill'
+    await p.Await()
+    assert p.get_status() == 0
+
+
+async def test_aio_sendline(monkeypatch):
+    monkeypatch.setattr(process, 'PROCESS', 'aio')
+    lines = []
+    p = process.run_bg(['head', '-n1'], output_func=lines.append)
+    assert isinstance(p, process.AioSpawn)
+    await asyncio.sleep(0.1)
+    p.sendline('hello')
+    await p.Await(5)
+    assert p.get_status() == 0 and lines == ['hello'], lines
+
+
+async def test_aio_utf8(monkeypatch):
+    """a char split across read chunks stays whole, a truncated one at EOF is replaced"""
+    import sys
+    monkeypatch.setattr(process, 'PROCESS', 'aio')
+    lines = []
+    code = 'import sys; sys.stdout.buffer.write(b"a" * (2**16 - 1) + "中\\n".encode() + "文".encode()[:2])'
+    p = await process.run_tail([sys.executable, '-c', code], output_func=lines.append).Await(5)
+    assert p.get_status() == 0
+    assert lines == ['a' * (2**16 - 1) + '中', '\ufffd'], [l[-3:] for l in lines]
+
+
+@pytest.mark.parametrize('n', [32])
+async def test_benchmark(n, monkeypatch):
+    """n concurrent short processes, aio should not be slower than polling"""
+    cost = {}
+    for backend in BACKENDS:
+        monkeypatch.setattr(process, 'PROCESS', backend)
+        start = time.perf_counter()
+        ps = await asyncio.gather(*[process.run_tail(['sleep', '0.05']).Await() for _ in range(n)])
+        cost[backend] = time.perf_counter() - start
+        assert all(p.get_status() == 0 for p in ps)
+    Log.info(f'{n=} {cost=}')
+    assert cost['aio'] < cost['aexpect'], cost
+
+
+async def test_killpg(backend):
+    """cancel kills children too, e.g. python under `pixi run`"""
+    import os
+    lines = []
+    p = process.run_tail(['sh', '-c', 'sleep 30 & echo $!; wait'], output_func=lines.append)
+    task = asyncio.create_task(p.Await())
+    while not lines:
+        await asyncio.sleep(0.05)
+    child = int(lines[0].strip())
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    cleaned = []
+    await process.stop(p, cleanup=lambda: cleaned.append(p.is_alive()))
+    assert cleaned == [False], 'cleanup after exit'
+    for _ in range(50):
+        try:
+            os.kill(child, 0)
+        except ProcessLookupError:
+            break
+        await asyncio.sleep(0.05)
+    else:
+        pytest.fail(f'child {child} still alive')
+
+
+async def test_aio_kill_unspawned(monkeypatch):
+    """killed before the spawn, it exits at once and is never spawned"""
+    monkeypatch.setattr(process, 'PROCESS', 'aio')
+    p = process.run_bg(['sleep', '30'])
+    assert p.get_pid() is None
+    p.kill()
+    assert not p.is_alive() and p.get_status() == 128 + 9, p
+    start = time.perf_counter()
+    assert await process.wait_exit(p, timeout=5)
+    assert time.perf_counter() - start < 1
+    assert p.get_pid() is None and p.get_status() == 128 + 9, p
+
+
+async def test_aio_wait(monkeypatch):
+    monkeypatch.setattr(process, 'PROCESS', 'aio')
+    p = process.run_bg(['sleep', '0.3'])
+    assert not await p.wait(0.05)
+    assert await p.wait(5) and p.get_status() == 0
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_prefetch(workers):
+    """decoding overlaps inference: n * max(decode, infer) instead of n * (decode + infer)"""
+    import numpy as np
+    from sys import path as PATH
+    from pathlib import Path
+    PATH.append(str(Path(__file__).parent.parent / 'docker'))
+    from lib import Prefetch  # type: ignore
+    n, decode, infer = 20, 0.01, 0.01
+
+    def frames():
+        for i in range(n):
+            time.sleep(decode)
+            yield np.full((4, 4, 3), i, dtype=np.uint8)
+
+    def run(images):
+        start = time.perf_counter()
+        got = []
+        for image in images:
+            time.sleep(infer)
+            got.append(int(image[0, 0, 0]))
+        assert got == list(range(n)), 'in order'
+        return time.perf_counter() - start
+
+    inline = run(map(np.copy, frames()))
+    images = Prefetch(frames(), fn=np.copy, size=4, workers=workers)
+    prefetched = run(images)
+    Log.info(f'{inline=:.3f}s {prefetched=:.3f}s waited={images.waited:.3f}s')
+    assert prefetched < inline * 0.8, (prefetched, inline)
+
+    def broken():
+        yield np.zeros(1)
+        raise OSError('decode')
+    with pytest.raises(OSError):
+        list(Prefetch(broken()))
+    images = Prefetch(frames(), size=2)
+    for _ in images:
+        break
+    assert not images._thread.is_alive(), 'stopped when the consumer stops'
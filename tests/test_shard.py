@@ -0,0 +1,73 @@
+#!/bin/env python
+import pytest
+import logging
+import numpy as np
+from mocap_wrapper.lib.shard import plan_shards, stitch, _qmul, _qrot
+Log = logging.getLogger(__name__)
+FPS = 10
+T = 100     # frames of the whole video
+SHARD, OVERLAP = 60, 10     # frames
+
+
+@pytest.mark.parametrize(
+    'duration, shard, overlap, expect',
+    [
+        (10, 0, 2, [(0, 10)]),
+        (10, 20, 2, [(0, 10)]),
+        (100, 30, 2, [(0, 32), (30, 32), (60, 40)]),  # short tail merged into last shard
+        (100, 40, 2, [(10, 42), (50, 42), (90, 20)]),
+    ]
+)
+def test_plan_shards(duration, shard, overlap, expect):
+    start = 10 if shard == 40 else 0
+    assert plan_shards(duration, shard, overlap, start=start) == expect
+
+
+def box(t):
+    """person walks right"""
+    x = 10 + 2 * t
+    return np.array([x, 0, x + 50, 100], dtype=np.float32)
+
+
+def yaw(rad):
+    return np.array([np.cos(rad / 2), 0, 0, np.sin(rad / 2)])
+
+
+def write_shard(path, offset, n, who, world=(yaw(0), np.zeros(3))):
+    """ground truth in frames [offset, offset+n) as seen by a shard: begin from 0, ids renumbered, own world"""
+    d, c = world
+    t = np.arange(offset, offset + n)
+    q = np.stack([yaw(0.01 * i) for i in t])
+    transl = np.stack([[0.1 * i, 0, 0] for i in t])
+    data = {
+        f'smplx;gvhmr;{who};0;global_orient': _qmul(d, q),
+        f'smplx;gvhmr;{who};0;transl': _qrot(d, transl) + c,
+        f'smplx;gvhmr;{who};0;betas': np.ones(10),
+        f'smplx;gvhmr;{who};0;bbox': np.stack([box(i) for i in t]),
+        # a still bystander, only in this shard
+        'smplx;gvhmr;person9;5;bbox': np.tile([500, 0, 550, 100], (5, 1)).astype(np.float32),
+        'smplx;wilor;hand3R;0;bbox': np.stack([box(i) / 4 for i in t]),
+        'smplx;wilor;hand3R;0;hand_pose': np.tile(yaw(0.1), (n, 15, 1)),
+    }
+    np.savez(path, **data)
+
+
+def test_stitch(tmp_path):
+    a, b = tmp_path / 'a.npz', tmp_path / 'b.npz'
+    write_shard(a, 0, SHARD, 'person0')
+    write_shard(b, SHARD - OVERLAP, T - SHARD + OVERLAP, 'person1', world=(yaw(1.2), np.array([3., 1, 0])))
+    out = stitch([(a, 0), (b, SHARD - OVERLAP)], tmp_path / 'out.mocap.npz', overlap=OVERLAP)
+    with np.load(out) as f:
+        keys = set(f.files)
+        q = f['smplx;gvhmr;person0;0;global_orient']
+        transl = f['smplx;gvhmr;person0;0;transl']
+        assert len(q) == T and len(transl) == T, 'person of 2 shards joined'
+        t = np.arange(T)
+        assert np.allclose(np.abs((q * np.stack([yaw(0.01 * i) for i in t])).sum(-1)), 1, atol=1e-6), 'world of shard b aligned'
+        assert np.allclose(transl[:, 0], 0.1 * t, atol=1e-6)
+        assert np.allclose(f['smplx;gvhmr;person0;0;bbox'], np.stack([box(i) for i in t]))
+        assert f['smplx;wilor;hand0R;0;hand_pose'].shape == (T, 15, 4)
+        assert f['smplx;gvhmr;person0;0;betas'].shape == (10,)
+    assert 'smplx;gvhmr;person1;5;bbox' in keys, 'bystander of shard a'
+    assert f'smplx;gvhmr;person2;{SHARD - OVERLAP + 5};bbox' in keys, 'bystander of shard b, begin remapped'
+    assert not any(';person9;' in k or ';hand3R;' in k for k in keys), keys